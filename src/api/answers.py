@@ -0,0 +1,48 @@
+"""
+The API's way into the RAG stack. LangChain, Chroma, Ollama and PyMuPDF take
+seconds to import, so they are loaded on first use (or by `start_rag` in the
+background at startup) rather than when the app is imported: a new worker
+answers /health and webhook verification right away.
+"""
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def ask_question(question: str, language: str = "Auto", conversation: str = None):
+    from src.rag.chatbot import ask_question
+    return ask_question(question, language, conversation)
+
+def stream_question(question: str, language: str = "Auto", conversation: str = None):
+    from src.rag.chatbot import stream_question
+    return stream_question(question, language, conversation)
+
+def start_rag():
+    """
+    Import the RAG stack, start the document watcher and open the retrieval
+    runtime. Returns the watcher's observer (None if it couldn't start).
+    """
+    from src.rag.ingest import DATA_PATH
+    from src.rag.watcher import start_watcher
+    from src.rag.runtime import get_runtime
+    from src.rag.chatbot import get_agent
+
+    observer = None
+    logger.info(f"Starting document watcher on {DATA_PATH}...")
+    try:
+        # Ensure path exists, absolute path
+        abs_path = os.path.abspath(DATA_PATH)
+        if not os.path.exists(abs_path):
+            os.makedirs(abs_path)
+        observer = start_watcher(abs_path)
+    except Exception as e:
+        logger.error(f"Failed to start watcher: {e}")
+
+    # Open the shared embedding client and vector store before the first question
+    try:
+        get_runtime().warmup()
+        get_agent()
+    except Exception as e:
+        logger.error(f"Failed to open retrieval runtime: {e}")
+    return observer
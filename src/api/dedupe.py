@@ -0,0 +1,103 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from src.rag.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+DEDUPE_PATH = "data/seen_messages.sqlite3"  # None keeps the IDs in memory only
+DEDUPE_TTL = 24 * 3600.0  # Meta stops redelivering well before this
+DEDUPE_MAX_SIZE = 100000
+
+
+class MessageDeduper:
+    """
+    Remembers the IDs of webhook messages already accepted (WhatsApp `id`,
+    Instagram `mid`) so redeliveries from Meta are dropped before any
+    retrieval or generation. IDs expire after `ttl` seconds and at most
+    `max_size` are kept. With a `path`, IDs are also stored in SQLite and
+    reloaded on start, so a restart doesn't answer redeliveries twice.
+    """
+
+    def __init__(self, path: str = DEDUPE_PATH, ttl: float = DEDUPE_TTL, max_size: int = DEDUPE_MAX_SIZE,
+                 clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self.duplicates = 0
+        # Wall clock, so expiry times stay meaningful across restarts
+        self._seen = TTLCache(max_size=max_size, ttl=ttl, clock=clock)
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS seen (id TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS seen_at ON seen (seen_at)")
+            self._conn.execute("DELETE FROM seen WHERE seen_at <= ?", (clock() - ttl,))
+            self._conn.commit()
+            rows = self._conn.execute(
+                "SELECT id, seen_at FROM seen ORDER BY seen_at DESC LIMIT ?", (max_size,)
+            ).fetchall()
+            now = clock()
+            for message_id, seen_at in reversed(rows):
+                self._seen.set(message_id, True, ttl=seen_at + ttl - now)
+
+    def first_time(self, message_id: str) -> bool:
+        """True the first time an ID is seen (and remembers it), False for a duplicate."""
+        with self._lock:
+            if self._seen.get(message_id):
+                self.duplicates += 1
+                return False
+            self._seen.set(message_id, True)
+            if self._conn is not None:
+                now = self.clock()
+                self._conn.execute("INSERT OR REPLACE INTO seen (id, seen_at) VALUES (?, ?)", (message_id, now))
+                self._conn.execute("DELETE FROM seen WHERE seen_at <= ?", (now - self.ttl,))
+                self._conn.commit()
+            return True
+
+    def filter_new(self, channel: str, items: list, message_id) -> list:
+        """
+        Keep the items seen for the first time. `message_id(item)` gives the
+        item's ID; items without one are always kept.
+        """
+        new = []
+        for item in items:
+            item_id = message_id(item)
+            if item_id is None or self.first_time(f"{channel}:{item_id}"):
+                new.append(item)
+            else:
+                logger.info(f"Dropped duplicate {channel} message {item_id}")
+        return new
+
+    def forget(self, channel: str, item_id: str):
+        """Drop an accepted ID again, so a redelivery of a message that couldn't be answered is let through."""
+        if item_id is None:
+            return
+        message_id = f"{channel}:{item_id}"
+        with self._lock:
+            self._seen.pop(message_id)
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM seen WHERE id = ?", (message_id,))
+                self._conn.commit()
+
+    def stats(self) -> dict:
+        return {"size": len(self._seen), "duplicates": self.duplicates}
+
+
+_deduper = None
+_deduper_lock = threading.Lock()
+
+def get_deduper() -> MessageDeduper:
+    global _deduper
+    if _deduper is None:
+        with _deduper_lock:
+            if _deduper is None:
+                _deduper = MessageDeduper()
+    return _deduper
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import httpx
+from src.metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+GRAPH_API_URL = "https://graph.facebook.com/v17.0"  # overridden by the GRAPH_API_URL env var
+MAX_CONNECTIONS = 20  # pooled keep-alive connections to the Graph API
+MAX_CONCURRENT_SENDS = 10
+CONNECT_TIMEOUT = 5.0
+REQUEST_TIMEOUT = 15.0
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5  # seconds, doubled on every retry
+BACKOFF_MAX = 8.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GraphAPIError(Exception):
+    """
+    A Graph API call failed for good (non-retryable status or out of retries).
+    `retryable=False` marks errors a later attempt can't fix, like missing credentials.
+    """
+
+    def __init__(self, message: str, status_code: int = None, body: str = "", retryable: bool = True):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+        self.retryable = retryable
+
+
+class GraphClient:
+    """
+    Shared async client for outbound Meta Graph API calls (WhatsApp and
+    Instagram replies). Connections are pooled and kept alive between sends,
+    at most `max_concurrency` requests are in flight, every request has a
+    timeout, and 429/5xx answers or network errors are retried with
+    exponential backoff (honouring Retry-After).
+
+    httpx connections belong to an event loop, so the pool is rebuilt (and
+    the old one closed) if the client is used from a different loop than the
+    one that created it.
+    """
+
+    def __init__(self, base_url: str = GRAPH_API_URL, max_connections: int = MAX_CONNECTIONS,
+                 max_concurrency: int = MAX_CONCURRENT_SENDS, timeout: float = REQUEST_TIMEOUT,
+                 retries: int = MAX_RETRIES, backoff_base: float = BACKOFF_BASE, backoff_max: float = BACKOFF_MAX):
+        self.base_url = base_url.rstrip("/")
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.timeout = httpx.Timeout(timeout, connect=CONNECT_TIMEOUT)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stats = {"requests": 0, "retries": 0, "failures": 0}
+        self._loop = None
+        self._client = None
+        self._semaphore = None
+
+    async def _session(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # The previous pool (if any) is tied to a loop that is gone or not ours
+            stale_client, stale_loop = self._client, self._loop
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            if stale_client is not None:
+                await self._close_stale(stale_client, stale_loop)
+        return self._client, self._semaphore
+
+    @staticmethod
+    async def _close_stale(client: httpx.AsyncClient, loop):
+        # Connections can only be shut down by the loop that owns them
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        elif not loop.is_closed():
+            await client.aclose()
+        else:
+            # The loop closed without aclose(); its sockets can only be released by dropping the client
+            logger.warning("Graph API client was not closed before its event loop ended")
+
+    def _backoff(self, attempt: int, response: httpx.Response = None) -> float:
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return min(float(response.headers["Retry-After"]), self.backoff_max)
+        delay = min(self.backoff_base * 2 ** attempt, self.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def post(self, path: str, payload: dict, token: str) -> dict:
+        """POST `payload` as JSON to `path` (relative to the API version URL) and return the JSON answer."""
+        with span("answer", "graph_send"):
+            return await self._post(path, payload, token)
+
+    async def _post(self, path: str, payload: dict, token: str) -> dict:
+        client, semaphore = await self._session()
+        headers = {"Authorization": f"Bearer {token}"}
+        async with semaphore:
+            for attempt in range(self.retries + 1):
+                self.stats["requests"] += 1
+                response = None
+                try:
+                    response = await client.post(path, json=payload, headers=headers)
+                    if response.status_code not in RETRY_STATUSES:
+                        break
+                    error = f"Graph API answered {response.status_code}"
+                except httpx.TransportError as e:
+                    error = f"Graph API request failed: {e!r}"
+                if attempt == self.retries:
+                    self.stats["failures"] += 1
+                    raise GraphAPIError(error, response.status_code if response is not None else None,
+                                        response.text if response is not None else "")
+                delay = self._backoff(attempt, response)
+                logger.warning(f"{error}, retrying {path} in {delay:.1f}s")
+                self.stats["retries"] += 1
+                await asyncio.sleep(delay)
+
+        if response.is_error:
+            self.stats["failures"] += 1
+            raise GraphAPIError(f"Graph API answered {response.status_code}", response.status_code, response.text)
+        return response.json() if response.content else {}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+        self._loop = self._client = self._semaphore = None
+
+
+_graph_client = None
+_graph_client_lock = threading.Lock()
+
+def get_graph_client() -> GraphClient:
+    global _graph_client
+    if _graph_client is None:
+        with _graph_client_lock:
+            if _graph_client is None:
+                _graph_client = GraphClient(base_url=os.getenv("GRAPH_API_URL", GRAPH_API_URL))
+    return _graph_client
+
+async def close_graph_client():
+    """Close the pooled connections; the next get_graph_client() starts a new client."""
+    global _graph_client
+    with _graph_client_lock:
+        client, _graph_client = _graph_client, None
+    if client is not None:
+        await client.aclose()
@@ -1,16 +1,19 @@
 import os
-import requests
+import asyncio
 import logging
 from fastapi import APIRouter, Request, HTTPException, BackgroundTasks
-from src.api.utils import verify_webhook
-from src.rag.chatbot import ask_question
+from src.api.utils import verify_webhook, process_in_sender_order
+from src.api.graph_client import get_graph_client, GraphAPIError
+from src.api.dedupe import get_deduper
+from src.api.outbox import get_outbox
+from src.api.workers import get_executor, answer_in_conversation, retry_when_full, QueueFullError
+from src.api.answers import ask_question
+from src.profiling import profiled
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-INSTAGRAM_API_URL = "https://graph.facebook.com/v17.0"
-
-def send_instagram_message(to_user_id: str, message_text: str):
+async def send_instagram_message(to_user_id: str, message_text: str):
     """
     Sends a text message via Instagram Graph API.
     """
@@ -21,55 +24,69 @@ def send_instagram_message(to_user_id: str, message_text: str):
     # The 'to' field is the PSID (Page Scoped ID) of the user.
     
     if not token:
-        logger.error("Instagram credentials not found in environment variables.")
-        return
+        raise GraphAPIError("Instagram credentials not found in environment variables.", retryable=False)
 
-    # Using 'me' is common if the token is a Page Access Token for the linked page
-    url = f"{INSTAGRAM_API_URL}/me/messages"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
     payload = {
         "recipient": {"id": to_user_id},
         "message": {"text": message_text}
     }
     
-    try:
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        logger.info(f"Instagram message sent to {to_user_id}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to send Instagram message: {e}")
-        if response is not None:
-             logger.error(f"Response: {response.text}")
+    # Using 'me' is common if the token is a Page Access Token for the linked page
+    await get_graph_client().post("me/messages", payload, token)
+    logger.info(f"Instagram message sent to {to_user_id}")
 
-async def process_instagram_message(body: dict):
+def instagram_messages(body: dict) -> list:
+    """(sender, event) for every text message of every entry, in payload order."""
+    messages = []
+    for entry in body.get("entry", []):
+        # Instagram structure usually has 'messaging' list
+        for event in entry.get("messaging", []):
+            if "message" in event and "text" in event["message"] and "id" in event.get("sender", {}):
+                messages.append((event["sender"]["id"], event))
+            else:
+                logger.info("Received Instagram event without text message.")
+    return messages
+
+async def handle_instagram_message(event: dict):
     """
-    Process the incoming webhook payload.
+    Answer one Instagram message.
     """
     try:
-        entry = body.get("entry", [])[0]
-        # Instagram structure usually has 'messaging' list
-        messaging_events = entry.get("messaging", [])
+        sender_id = event["sender"]["id"]
+        message_text = event["message"]["text"]
         
-        for event in messaging_events:
-            if "message" in event and "text" in event["message"]:
-                sender_id = event["sender"]["id"]
-                message_text = event["message"]["text"]
-                
-                logger.info(f"Received Instagram message from {sender_id}: {message_text}")
-                
-                # Ask the Brain
-                answer = ask_question(message_text)
-                
-                # Send Reply
-                send_instagram_message(sender_id, answer)
-            else:
-                logger.info("Received Instagram event without text message.")
+        logger.info(f"Received Instagram message from {sender_id}: {message_text}")
+        
+        # Ask the Brain (on the bounded LLM worker pool)
+        conversation = f"instagram:{sender_id}"
+        ask = profiled(ask_question, "instagram", user_id=sender_id, question=message_text)
+        # Already acknowledged to Meta, so a full queue is waited out rather than dropping the message
+        answer = await retry_when_full(lambda: answer_in_conversation(
+            get_executor(), ask, message_text, conversation=conversation, channel="instagram", user_id=sender_id
+        ))
+        
+        # Queue the reply; outbox workers send it (and retry on failure)
+        await get_outbox().put("instagram", sender_id, answer)
 
-    except (IndexError, KeyError) as e:
-        logger.error(f"Error parsing Instagram payload: {e}")
+    except KeyError as e:
+        logger.error(f"Error parsing Instagram message: {e}")
+    except QueueFullError as e:
+        logger.error(f"Dropped Instagram message, answer queue stayed full: {e}")
+        await asyncio.to_thread(get_deduper().forget, "instagram", event.get("message", {}).get("mid"))
+    except Exception:
+        # Not answered: let Meta's redelivery of this message through the dedupe layer
+        await asyncio.to_thread(get_deduper().forget, "instagram", event.get("message", {}).get("mid"))
+        raise
+
+async def process_instagram_message(body: dict):
+    """
+    Process the incoming webhook payload. Meta batches several messages (and
+    entries) into one call under load; senders are answered concurrently.
+    """
+    # Meta redelivers when our acknowledgement is slow; drop messages already accepted
+    messages = await asyncio.to_thread(get_deduper().filter_new, "instagram", instagram_messages(body),
+                                       lambda item: item[1]["message"].get("mid"))
+    await process_in_sender_order(messages, handle_instagram_message)
 
 @router.get("/instagram/webhook")
 async def instagram_verification(request: Request):
@@ -80,6 +97,11 @@ async def instagram_webhook(request: Request, background_tasks: BackgroundTasks)
     """
     Handle incoming Instagram messages.
     """
+    # Refuse while saturated so Meta redelivers later instead of us dropping the message
+    executor = get_executor()
+    if executor.is_full():
+        raise HTTPException(status_code=503, detail="Server busy", headers={"Retry-After": str(executor.retry_after())})
+
     body = await request.json()
     
     # Process in background
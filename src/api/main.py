@@ -1,15 +1,26 @@
 
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from contextlib import asynccontextmanager
-from src.rag.chatbot import ask_question
-from src.rag.ingest import DATA_PATH
-from src.rag.watcher import start_watcher
-from src.api.whatsapp import router as whatsapp_router
-from src.api.instagram import router as instagram_router
+from src.rag.memory import get_memory
+from src.api.answers import ask_question, stream_question, start_rag
+from src.api.whatsapp import router as whatsapp_router, send_whatsapp_message
+from src.api.instagram import router as instagram_router, send_instagram_message
+from src.api.dedupe import get_deduper
+from src.api.outbox import get_outbox
+from src.api.graph_client import close_graph_client
+from src.api.workers import get_executor, shutdown_executor, answer_in_conversation, QueueFullError
+from src.metrics import REGISTRY, CONTENT_TYPE, Counter, Gauge
+from src.profiling import PROFILE_HEADER, get_trace_buffer, profiled
 from dotenv import load_dotenv
+import asyncio
+import json
 import logging
 import os
+import secrets
+import threading
+import time
 
 # Load Environment Variables
 load_dotenv()
@@ -18,31 +29,39 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Global Observer
-observer = None
+def log_rag_startup(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("RAG stack failed to start, questions can't be answered until this is fixed",
+                     exc_info=task.exception())
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    logger.info(f"Starting document watcher on {DATA_PATH}...")
-    global observer
-    try:
-        # Ensure path exists, absolute path
-        abs_path = os.path.abspath(DATA_PATH)
-        if not os.path.exists(abs_path):
-             os.makedirs(abs_path)
-             
-        observer = start_watcher(abs_path)
-    except Exception as e:
-        logger.error(f"Failed to start watcher: {e}")
+    # The RAG stack takes seconds to import and open: do it off the event loop, so
+    # /health and webhook verification are answered meanwhile
+    rag_startup = asyncio.create_task(asyncio.to_thread(start_rag))
+    rag_startup.add_done_callback(log_rag_startup)
+
+    # Send queued replies, including any left over from the previous run
+    outbox = get_outbox()
+    outbox.register_sender("whatsapp", send_whatsapp_message)
+    outbox.register_sender("instagram", send_instagram_message)
+    outbox.start()
         
     yield
     
     # Shutdown
+    try:
+        observer = await rag_startup
+    except Exception:
+        observer = None  # logged by log_rag_startup; the rest still has to shut down
     if observer:
         logger.info("Stopping document watcher...")
         observer.stop()
         observer.join()
+    await outbox.stop()
+    shutdown_executor()
+    await close_graph_client()
 
 app = FastAPI(title="RAG Chatbot", lifespan=lifespan)
 
@@ -55,16 +74,34 @@ class ChatRequest(BaseModel):
     user_id: str = "guest"
     language: str = "Auto"
 
+def chat_conversation(user_id: str):
+    """Conversation key for /chat callers; anonymous "guest" callers get no history."""
+    return None if user_id == "guest" else f"chat:{user_id}"
+
+def queue_user(user_id: str, http_request: Request) -> str:
+    """Per-user queue key; anonymous "guest" callers are told apart by client address."""
+    if user_id != "guest" or http_request.client is None:
+        return user_id
+    return f"guest:{http_request.client.host}"
+
 @app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, http_request: Request):
     """
     Simple endpoint for direct testing (Postman/Curl).
+    Send `X-Profile: 1` (or `cprofile`) to record a trace of the answer.
     """
     try:
         logger.info(f"Received message from {request.user_id}: {request.message} (Lang: {request.language})")
-        answer = ask_question(request.message, request.language)
+        ask = profiled(ask_question, "chat", http_request.headers.get(PROFILE_HEADER),
+                       user_id=request.user_id, question=request.message)
+        answer = await answer_in_conversation(get_executor(), ask, request.message, request.language,
+                                              chat_conversation(request.user_id), channel="chat",
+                                              user_id=queue_user(request.user_id, http_request))
         logger.info(f"Generated answer: {answer}")
         return {"response": answer}
+    except QueueFullError as e:
+        logger.warning(f"Rejected message from {request.user_id}: {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         logger.error(f"Error processing text: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -72,3 +109,138 @@ async def chat_endpoint(request: ChatRequest):
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+@app.get("/stats")
+def stats():
+    """Answer queue, outbound queue, webhook dedupe and conversation memory counters."""
+    return {
+        "answers": get_executor().stats(),
+        "outbox": get_outbox().stats(),
+        "dedupe": get_deduper().stats(),
+        "memory": get_memory().stats(),
+    }
+
+# Read from the live objects on each scrape
+Gauge("faq_answer_queue_depth", "Questions waiting for an answer worker",
+      function=lambda: get_executor().stats()["queued"])
+Gauge("faq_answers_in_flight", "Questions being answered by a worker",
+      function=lambda: get_executor().stats()["in_flight"])
+Counter("faq_answers_rejected_total", "Questions refused because the answer queue was full",
+        function=lambda: get_executor().stats()["rejected"])
+Counter("faq_answers_coalesced_total", "Questions answered by an identical question already in flight",
+        function=lambda: get_executor().stats()["coalesced"])
+Gauge("faq_outbox_depth", "Replies waiting to be sent", function=lambda: get_outbox().depth())
+Counter("faq_outbox_failed_total", "Replies given up on after the last retry", function=lambda: get_outbox().failed)
+Counter("faq_webhook_duplicates_total", "Redelivered webhook messages dropped",
+        function=lambda: get_deduper().duplicates)
+
+def check_debug_token(request: Request):
+    """Debug endpoints exist only when DEBUG_TOKEN is set, and need it in X-Debug-Token."""
+    token = os.getenv("DEBUG_TOKEN")
+    if not token or not secrets.compare_digest(request.headers.get("X-Debug-Token", ""), token):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@app.get("/debug/traces")
+def list_traces(request: Request):
+    """Profiled requests kept in memory, newest first."""
+    check_debug_token(request)
+    return {"traces": get_trace_buffer().list()}
+
+@app.get("/debug/traces/export")
+def export_traces(request: Request):
+    """Every kept trace, with span tree and cProfile report, as a JSON Lines file."""
+    check_debug_token(request)
+    return Response(get_trace_buffer().export(), media_type="application/x-ndjson",
+                    headers={"Content-Disposition": 'attachment; filename="traces.jsonl"'})
+
+@app.get("/debug/traces/{trace_id}")
+def get_trace(trace_id: str, request: Request):
+    check_debug_token(request)
+    trace = get_trace_buffer().get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace.to_dict()
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics: stage latency histograms, cache lookups, queue depths and in-flight generations."""
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request):
+    """
+    Same as /chat, but sends the answer as Server-Sent Events: one `token`
+    event per chunk of text, then a `done` event with the time to first token
+    and the total time (seconds). If the client disconnects, the generation
+    is stopped at the next token.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    cancelled = threading.Event()
+    start = time.perf_counter()
+
+    def emit(kind, value):
+        try:
+            loop.call_soon_threadsafe(events.put_nowait, (kind, value))
+        except RuntimeError:
+            # Event loop closed: nobody is listening anymore
+            cancelled.set()
+
+    def generate():
+        tokens = None
+        try:
+            tokens = stream_question(request.message, request.language, chat_conversation(request.user_id))
+            for token in tokens:
+                if cancelled.is_set():
+                    return
+                emit("token", token)
+            emit("done", None)
+        except Exception as e:
+            logger.error(f"Error streaming answer: {e}")
+            emit("error", str(e))
+        finally:
+            if tokens is not None:
+                tokens.close()
+
+    logger.info(f"Received streamed message from {request.user_id}: {request.message} (Lang: {request.language})")
+    generate = profiled(generate, "chat/stream", http_request.headers.get(PROFILE_HEADER),
+                        user_id=request.user_id, question=request.message)
+    try:
+        future = get_executor().submit(generate, channel="chat",
+                                         user_id=queue_user(request.user_id, http_request))
+    except QueueFullError as e:
+        logger.warning(f"Rejected message from {request.user_id}: {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    async def stream():
+        first_token = None
+        try:
+            while True:
+                try:
+                    kind, value = await asyncio.wait_for(events.get(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    if await http_request.is_disconnected():
+                        logger.info(f"Client {request.user_id} disconnected, cancelling generation")
+                        return
+                    continue
+                if kind == "token":
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    yield sse_event("token", {"token": value})
+                elif kind == "done":
+                    total = time.perf_counter() - start
+                    logger.info(f"Streamed answer to {request.user_id}: first token {first_token or 0:.2f}s, total {total:.2f}s")
+                    yield sse_event("done", {"time_to_first_token": first_token, "total_time": total})
+                    return
+                else:
+                    yield sse_event("error", {"detail": value})
+                    return
+        finally:
+            # Runs on completion and when the response task is cancelled by a disconnect
+            cancelled.set()
+            future.cancel()
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
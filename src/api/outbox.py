@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from src.api.graph_client import GraphAPIError, RETRY_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+OUTBOX_PATH = "data/outbox.sqlite3"
+OUTBOX_WORKERS = 4
+MAX_ATTEMPTS = 8  # sends per message before it is marked failed
+RETRY_BASE = 5.0  # seconds, doubled on every failed attempt
+RETRY_MAX = 300.0
+POLL_INTERVAL = 1.0  # how often idle workers look for retries that became due
+# Messages per second per channel, kept under Meta's send throughput caps
+RATE_LIMITS = {"whatsapp": 50.0, "instagram": 10.0}
+LATENCY_WINDOW = 1000  # recent sends kept for the latency percentiles
+
+
+class RateLimiter:
+    """Token bucket: `rate` sends per second on average, bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: int = None, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return how long to wait before using it."""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class Outbox:
+    """
+    Durable queue of outbound replies. Webhook processing stores the answer
+    here and a pool of async workers sends it through the registered channel
+    sender, so a failed Graph API call or a restart doesn't lose an answer
+    that already cost an LLM generation.
+
+    Messages to one recipient are sent one at a time, in order: a message
+    waits while an earlier one to the same recipient is being sent or is
+    waiting to be retried. Retryable failures (network, 429, 5xx) are retried
+    with exponential backoff up to `max_attempts`; other failures are kept
+    with status 'failed'. Sends are rate limited per channel.
+    """
+
+    def __init__(self, path: str = OUTBOX_PATH, workers: int = OUTBOX_WORKERS, max_attempts: int = MAX_ATTEMPTS,
+                 retry_base: float = RETRY_BASE, retry_max: float = RETRY_MAX, rate_limits: dict = None,
+                 poll_interval: float = POLL_INTERVAL):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.poll_interval = poll_interval
+        self.limiters = {channel: RateLimiter(rate) for channel, rate in (rate_limits or RATE_LIMITS).items()}
+        self.senders = {}
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._send_seconds = deque(maxlen=LATENCY_WINDOW)
+        self._queued_seconds = deque(maxlen=LATENCY_WINDOW)
+        self._sending = set()  # (channel, recipient) with a send in progress
+        self._lock = threading.Lock()
+        self._tasks = []
+        self._wakeup = None
+        self._loop = None
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                text TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                last_error TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, channel, recipient, id)")
+        self._conn.commit()
+
+    def register_sender(self, channel: str, send):
+        """`send(recipient, text)` is a coroutine that raises GraphAPIError on failure."""
+        self.senders[channel] = send
+
+    # Storage (blocking, called from worker threads)
+
+    def enqueue(self, channel: str, recipient: str, text: str) -> int:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO outbox (channel, recipient, text, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                (channel, recipient, text, now, now),
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def claim(self):
+        """Take the oldest due message whose recipient has nothing earlier pending or in progress."""
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT id, channel, recipient, text, attempts, next_attempt_at, created_at FROM outbox
+                WHERE id IN (SELECT MIN(id) FROM outbox WHERE status = 'pending' GROUP BY channel, recipient)
+                ORDER BY id
+                """
+            ).fetchall()
+            now = time.time()
+            for row in rows:
+                if row[5] <= now and (row[1], row[2]) not in self._sending:
+                    self._sending.add((row[1], row[2]))
+                    return {"id": row[0], "channel": row[1], "recipient": row[2], "text": row[3],
+                            "attempts": row[4], "created_at": row[6]}
+        return None
+
+    def _finish(self, message: dict, status: str, error: str = None, retry_in: float = None):
+        with self._lock:
+            if status == "sent":
+                self._conn.execute("DELETE FROM outbox WHERE id = ?", (message["id"],))
+            else:
+                self._conn.execute(
+                    "UPDATE outbox SET status = ?, attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                    (status, time.time() + (retry_in or 0.0), error, message["id"]),
+                )
+            self._conn.commit()
+            self._sending.discard((message["channel"], message["recipient"]))
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+    # Workers
+
+    async def put(self, channel: str, recipient: str, text: str) -> int:
+        """Store a reply and wake a worker to send it."""
+        message_id = await asyncio.to_thread(self.enqueue, channel, recipient, text)
+        if self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return message_id
+
+    def _retry_delay(self, attempts: int) -> float:
+        return min(self.retry_base * 2 ** attempts, self.retry_max) * random.uniform(0.5, 1.0)
+
+    async def _deliver(self, message: dict):
+        channel = message["channel"]
+        send = self.senders.get(channel)
+        try:
+            if send is None:
+                raise GraphAPIError(f"No sender registered for channel {channel}", retryable=False)
+            if channel in self.limiters:
+                await self.limiters[channel].acquire()
+            start = time.perf_counter()
+            await send(message["recipient"], message["text"])
+        except GraphAPIError as e:
+            retryable = e.retryable and (e.status_code is None or e.status_code in RETRY_STATUSES)
+            if retryable and message["attempts"] + 1 < self.max_attempts:
+                delay = self._retry_delay(message["attempts"])
+                self.retried += 1
+                logger.warning(f"Send to {channel}:{message['recipient']} failed ({e}), retrying in {delay:.0f}s")
+                await asyncio.to_thread(self._finish, message, "pending", str(e), delay)
+            else:
+                self.failed += 1
+                logger.error(f"Giving up on message {message['id']} to {channel}:{message['recipient']}: {e}")
+                await asyncio.to_thread(self._finish, message, "failed", str(e))
+            return
+        except asyncio.CancelledError:
+            # Shutting down mid-send: leave it pending for the next run
+            with self._lock:
+                self._sending.discard((channel, message["recipient"]))
+            raise
+        self._send_seconds.append(time.perf_counter() - start)
+        self._queued_seconds.append(time.time() - message["created_at"])
+        self.sent += 1
+        await asyncio.to_thread(self._finish, message, "sent")
+
+    async def _work(self):
+        while True:
+            message = await asyncio.to_thread(self.claim)
+            if message is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._deliver(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if message["attempts"] + 1 < self.max_attempts:
+                    logger.error(f"Unexpected error sending message {message['id']}: {e}")
+                    await asyncio.to_thread(self._finish, message, "pending", str(e),
+                                            self._retry_delay(message["attempts"]))
+                else:
+                    self.failed += 1
+                    logger.error(f"Giving up on message {message['id']} after unexpected error: {e}")
+                    await asyncio.to_thread(self._finish, message, "failed", str(e))
+
+    def start(self):
+        """Start the workers on the running event loop (pending messages from a previous run included)."""
+        if self._tasks:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work(), name=f"outbox-worker-{i}") for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._wakeup = None
+
+    def stats(self) -> dict:
+        send_seconds = sorted(self._send_seconds)
+        queued_seconds = sorted(self._queued_seconds)
+        percentile = lambda values, p: values[min(len(values) - 1, int(p * len(values)))] if values else 0.0
+        return {
+            "depth": self.depth(),
+            "sending": len(self._sending),
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "send_seconds_p50": percentile(send_seconds, 0.5),
+            "send_seconds_p95": percentile(send_seconds, 0.95),
+            "queued_seconds_p50": percentile(queued_seconds, 0.5),
+            "queued_seconds_p95": percentile(queued_seconds, 0.95),
+        }
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+def get_outbox() -> Outbox:
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                _outbox = Outbox()
+    return _outbox
@@ -1,4 +1,5 @@
 import os
+import asyncio
 import logging
 from fastapi import HTTPException, Request
 
@@ -31,3 +32,35 @@ async def verify_webhook(request: Request):
     # But usually this endpoint is strictly for verification (GET) or receiving data (POST)
     # So if it's GET without params, it's an error.
     raise HTTPException(status_code=400, detail="Missing parameters")
+
+
+# sender -> [lock, number of lanes using it], so one sender's messages keep their order across webhook calls
+_sender_locks = {}
+
+async def process_in_sender_order(events, handle):
+    """
+    Run the coroutine `handle(event)` for each (sender, event) pair of a webhook
+    payload. Different senders are processed concurrently; one sender's events
+    run one after another, in payload order and after any of their events from
+    an earlier payload that are still being processed.
+    """
+    lanes = {}
+    for sender, event in events:
+        lanes.setdefault(sender, []).append(event)
+
+    async def run_lane(sender, lane):
+        entry = _sender_locks.setdefault(sender, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                for event in lane:
+                    try:
+                        await handle(event)
+                    except Exception as e:
+                        logger.error(f"Error processing message from {sender}: {e}")
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del _sender_locks[sender]
+
+    await asyncio.gather(*(run_lane(sender, lane) for sender, lane in lanes.items()))
@@ -1,16 +1,19 @@
 import os
-import requests
+import asyncio
 import logging
 from fastapi import APIRouter, Request, HTTPException, BackgroundTasks
-from src.api.utils import verify_webhook
-from src.rag.chatbot import ask_question
+from src.api.utils import verify_webhook, process_in_sender_order
+from src.api.graph_client import get_graph_client, GraphAPIError
+from src.api.dedupe import get_deduper
+from src.api.outbox import get_outbox
+from src.api.workers import get_executor, answer_in_conversation, retry_when_full, QueueFullError
+from src.api.answers import ask_question
+from src.profiling import profiled
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-WHATSAPP_API_URL = "https://graph.facebook.com/v17.0"
-
-def send_whatsapp_message(to_number: str, message_text: str):
+async def send_whatsapp_message(to_number: str, message_text: str):
     """
     Sends a text message via WhatsApp Cloud API.
     """
@@ -18,14 +21,8 @@ def send_whatsapp_message(to_number: str, message_text: str):
     phone_number_id = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
     
     if not token or not phone_number_id:
-        logger.error("WhatsApp credentials not found in environment variables.")
-        return
+        raise GraphAPIError("WhatsApp credentials not found in environment variables.", retryable=False)
 
-    url = f"{WHATSAPP_API_URL}/{phone_number_id}/messages"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
     payload = {
         "messaging_product": "whatsapp",
         "to": to_number,
@@ -33,30 +30,27 @@ def send_whatsapp_message(to_number: str, message_text: str):
         "text": {"body": message_text}
     }
     
-    try:
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        logger.info(f"WhatsApp message sent to {to_number}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to send WhatsApp message: {e}")
-        if response is not None:
-             logger.error(f"Response: {response.text}")
+    await get_graph_client().post(f"{phone_number_id}/messages", payload, token)
+    logger.info(f"WhatsApp message sent to {to_number}")
 
-async def process_whatsapp_message(body: dict):
+def whatsapp_messages(body: dict) -> list:
+    """(sender, message) for every message of every entry and change, in payload order."""
+    messages = []
+    for entry in body.get("entry", []):
+        for change in entry.get("changes", []):
+            # Changes without "messages" are status updates (sent, delivered, read) - ignore for now
+            for message in change.get("value", {}).get("messages", []):
+                if "from" in message:
+                    messages.append((message["from"], message))
+                else:
+                    logger.error(f"WhatsApp message without sender: {message}")
+    return messages
+
+async def handle_whatsapp_message(message: dict):
     """
-    Process the incoming webhook payload.
+    Answer one WhatsApp message.
     """
     try:
-        entry = body.get("entry", [])[0]
-        changes = entry.get("changes", [])[0]
-        value = changes.get("value", {})
-        
-        # Check if it's a message
-        if "messages" not in value:
-            # Could be a status update (sent, delivered, read) - ignore for now
-            return
-
-        message = value["messages"][0]
         from_number = message["from"]
         msg_type = message["type"]
         
@@ -65,17 +59,39 @@ async def process_whatsapp_message(body: dict):
             text_body = message["text"]["body"]
             logger.info(f"Received WhatsApp message from {from_number}: {text_body}")
             
-            # Ask the Brain
-            answer = ask_question(text_body)
+            # Ask the Brain (on the bounded LLM worker pool)
+            conversation = f"whatsapp:{from_number}"
+            ask = profiled(ask_question, "whatsapp", user_id=from_number, question=text_body)
+            # Already acknowledged to Meta, so a full queue is waited out rather than dropping the message
+            answer = await retry_when_full(lambda: answer_in_conversation(
+                get_executor(), ask, text_body, conversation=conversation, channel="whatsapp", user_id=from_number
+            ))
             
-            # Send Reply
-            send_whatsapp_message(from_number, answer)
+            # Queue the reply; outbox workers send it (and retry on failure)
+            await get_outbox().put("whatsapp", from_number, answer)
         else:
              logger.info(f"Received non-text message type: {msg_type}")
-             send_whatsapp_message(from_number, "Sorry, I can only understand text messages for now.")
+             await get_outbox().put("whatsapp", from_number, "Sorry, I can only understand text messages for now.")
+
+    except KeyError as e:
+        logger.error(f"Error parsing WhatsApp message: {e}")
+    except QueueFullError as e:
+        logger.error(f"Dropped WhatsApp message, answer queue stayed full: {e}")
+        await asyncio.to_thread(get_deduper().forget, "whatsapp", message.get("id"))
+    except Exception:
+        # Not answered: let Meta's redelivery of this message through the dedupe layer
+        await asyncio.to_thread(get_deduper().forget, "whatsapp", message.get("id"))
+        raise
 
-    except (IndexError, KeyError) as e:
-        logger.error(f"Error parsing WhatsApp payload: {e}")
+async def process_whatsapp_message(body: dict):
+    """
+    Process the incoming webhook payload. Meta batches several messages (and
+    entries) into one call under load; senders are answered concurrently.
+    """
+    # Meta redelivers when our acknowledgement is slow; drop messages already accepted
+    messages = await asyncio.to_thread(get_deduper().filter_new, "whatsapp", whatsapp_messages(body),
+                                       lambda item: item[1].get("id"))
+    await process_in_sender_order(messages, handle_whatsapp_message)
 
 @router.get("/whatsapp/webhook")
 async def whatsapp_verification(request: Request):
@@ -86,6 +102,11 @@ async def whatsapp_webhook(request: Request, background_tasks: BackgroundTasks):
     """
     Handle incoming WhatsApp messages.
     """
+    # Refuse while saturated so Meta redelivers later instead of us dropping the message
+    executor = get_executor()
+    if executor.is_full():
+        raise HTTPException(status_code=503, detail="Server busy", headers={"Retry-After": str(executor.retry_after())})
+
     body = await request.json()
     
     # Process in background to return 200 OK quickly to Meta
@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from src.rag.cache import normalize_query
+from src.rag.memory import get_memory
+from src.metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+LLM_WORKERS = 2  # answers generated at the same time
+MAX_QUEUE = 32  # answers waiting for a worker, all channels together
+MAX_QUEUED_PER_USER = 3
+# Lower value is served first. Direct /chat callers hold an open HTTP request.
+PRIORITIES = {"chat": 0, "whatsapp": 1, "instagram": 1}
+ADMISSION_TIMEOUT = 600.0  # seconds an acknowledged webhook message keeps retrying a full queue
+
+
+class QueueFullError(Exception):
+    """Raised when an answer can't be queued. Carries the HTTP status and Retry-After to send back."""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AnswerExecutor:
+    """
+    Bounded pool of threads for blocking answer generation, so the event loop
+    stays free for /health and webhook acknowledgements.
+
+    Work is queued per priority class and, inside a class, per user: workers
+    take the next task round-robin across users, so one chatty sender only
+    delays their own messages. A full queue (or a user over their quota) is
+    rejected up front with QueueFullError instead of piling up.
+
+    Tasks submitted with a `key` are coalesced: while one is queued or running,
+    later calls with the same key share its result instead of running again.
+    """
+
+    def __init__(self, workers: int = LLM_WORKERS, max_queue: int = MAX_QUEUE,
+                 max_queued_per_user: int = MAX_QUEUED_PER_USER):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_queued_per_user = max_queued_per_user
+        self.queued = 0
+        self.in_flight = 0
+        self.rejected = 0
+        self.completed = 0
+        self.coalesced = 0  # calls answered by a task already in flight
+        self._shared = {}  # key -> [future, number of callers waiting on it]
+        self._avg_seconds = 5.0  # moving average of one generation, for Retry-After
+        self._queues = {p: OrderedDict() for p in sorted(set(PRIORITIES.values()))}
+        self._cond = threading.Condition()
+        self._shutdown = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f"answer-worker-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog is expected to drain."""
+        return max(1, math.ceil(self._avg_seconds * (self.queued + self.in_flight) / self.workers))
+
+    def is_full(self) -> bool:
+        with self._cond:
+            return self.queued >= self.max_queue
+
+    def submit(self, fn, *args, channel: str = "chat", user_id: str = "guest", key=None, **kwargs) -> Future:
+        priority = PRIORITIES.get(channel, max(PRIORITIES.values()))
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("Answer executor is shut down")
+            shared = self._shared.get(key) if key is not None else None
+            if shared is not None:
+                shared[1] += 1
+                self.coalesced += 1
+                return shared[0]
+            user_tasks = self._queues[priority].get(user_id)
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise QueueFullError("Server busy, try again later", 503, self.retry_after())
+            if user_tasks is not None and len(user_tasks) >= self.max_queued_per_user:
+                self.rejected += 1
+                raise QueueFullError("Too many pending messages", 429, self.retry_after())
+            future = Future()
+            self._queues[priority].setdefault(user_id, deque()).append((future, fn, args, kwargs, time.perf_counter()))
+            self.queued += 1
+            if key is not None:
+                self._shared[key] = [future, 1]
+            self._cond.notify()
+        if key is not None:
+            future.add_done_callback(lambda f: self._unshare(key, f))
+        return future
+
+    def _unshare(self, key, future):
+        with self._cond:
+            shared = self._shared.get(key)
+            if shared is not None and shared[0] is future:
+                del self._shared[key]
+
+    def _leave(self, key, future):
+        # A caller stopped waiting; cancel the task once nobody is left waiting on it
+        with self._cond:
+            shared = self._shared.get(key) if key is not None else None
+            if shared is not None and shared[0] is future:
+                shared[1] -= 1
+                if shared[1] > 0:
+                    return
+        future.cancel()
+
+    async def run(self, fn, *args, channel: str = "chat", user_id: str = "guest", key=None, **kwargs):
+        """Queue `fn` and await its result without blocking the event loop."""
+        future = self.submit(fn, *args, channel=channel, user_id=user_id, key=key, **kwargs)
+        try:
+            # Shielded so one caller going away doesn't cancel the others' shared task
+            return await asyncio.shield(asyncio.wrap_future(future))
+        except asyncio.CancelledError:
+            self._leave(key, future)
+            raise
+
+    def _next_task(self):
+        # Caller holds the lock. Highest priority first, round-robin over users inside it.
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            if users:
+                user_id, tasks = next(iter(users.items()))
+                task = tasks.popleft()
+                if tasks:
+                    users.move_to_end(user_id)
+                else:
+                    del users[user_id]
+                return task
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self.queued and not self._shutdown:
+                    self._cond.wait()
+                if not self.queued:
+                    return
+                future, fn, args, kwargs, queued_at = self._next_task()
+                self.queued -= 1
+                self.in_flight += 1
+            start = time.perf_counter()
+            STAGE_SECONDS.observe(start - queued_at, path="answer", stage="queue_wait")
+            # Skipped if the caller went away while it was queued
+            ran = future.set_running_or_notify_cancel()
+            if ran:
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+            with self._cond:
+                self.in_flight -= 1
+                if ran:
+                    self.completed += 1
+                    self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "queued": self.queued,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "coalesced": self.coalesced,
+                "workers": self.workers,
+            }
+
+    def shutdown(self, wait: bool = True):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+def answer_key(question: str, language: str = "Auto") -> tuple:
+    """Coalescing key for an answer: the same question, ignoring case, accents and spacing."""
+    return ("answer", normalize_query(question), language)
+
+async def answer_in_conversation(executor: AnswerExecutor, ask, question: str, language: str = "Auto",
+                                 conversation: str = None, channel: str = "chat", user_id: str = "guest"):
+    """
+    Answer `question` with `ask` (ask_question) on the executor.
+    Follow-ups run with the conversation's history. Opening questions don't
+    depend on any history, so they are coalesced with identical in-flight
+    questions and the turn is then recorded in each caller's conversation.
+    """
+    if conversation and get_memory().has_history(conversation):
+        return await executor.run(ask, question, language, conversation=conversation, channel=channel, user_id=user_id)
+    answer = await executor.run(ask, question, language, channel=channel, user_id=user_id,
+                                key=answer_key(question, language))
+    if conversation:
+        get_memory().append(conversation, question, answer)
+    return answer
+
+
+async def retry_when_full(call, timeout: float = ADMISSION_TIMEOUT):
+    """
+    Await `call()`, a coroutine function that queues work on the executor,
+    and try again after the Retry-After of each QueueFullError. For webhook
+    messages, which were acknowledged to Meta before being queued: a rejection
+    waits for capacity instead of dropping the message. Raises the last
+    QueueFullError once `timeout` seconds have passed.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return await call()
+        except QueueFullError as e:
+            delay = min(e.retry_after, deadline - time.monotonic())
+            if delay <= 0:
+                raise
+            logger.warning(f"Answer queue is full ({e}), retrying in {delay:.0f}s")
+            await asyncio.sleep(delay)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor() -> AnswerExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = AnswerExecutor()
+    return _executor
+
+def shutdown_executor():
+    """Finish queued answers and drop the pool; the next get_executor() starts a new one."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown()
@@ -0,0 +1,235 @@
+"""
+Offline retrieval benchmark.
+
+Ingests a documents folder once per chunking strategy into a throwaway
+Chroma directory, then runs the questions of a benchmark file through each
+retrieval mode and reports recall@k, MRR and retrieval latency, together
+with ingest time and index size. Embeddings and the keyword LLM are
+deterministic local stand-ins, so runs need no Ollama and are comparable
+over time.
+
+Benchmark files live in benchmarks/ and hold one question per line, either
+as plain text (timed only) or as JSON with the sections/pages expected among
+the retrieved chunks:
+
+    {"question": "¿Hay wifi?", "expected": {"section": "Servicios", "page": 3}}
+    {"question": "Price of a cabin?", "expected": [{"section": "Prices"}, {"page": 7}]}
+
+    python -m src.benchmark faq.jsonl --strategies recursive semantic --k 4
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+from src.utils import BENCHMARK_DIR, load_benchmark, percentile
+from src.rag import ingest
+from src.rag.bm25 import tokenize
+from src.rag.cache import normalize_query
+from src.rag.extract_processor import ExtractProcessor, KEYWORD_PROMPT
+from src.rag.runtime import RetrievalRuntime
+
+# Configuration
+STRATEGIES = ["md", "recursive", "semantic"]
+MODES = ["vector", "bm25", "hybrid"]
+TOP_K = 4
+EMBEDDING_DIM = 256
+FAKE_KEYWORDS = 5  # keywords the stand-in LLM returns per chunk
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic stand-in for Ollama embeddings: hashed bag of words and
+    character trigrams, L2-normalized. Texts sharing words end up close.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+
+    def _embed(self, text: str) -> list[float]:
+        vector = [0.0] * self.dim
+        words = re.findall(r"\w+", normalize_query(text))
+        features = words + [w[i:i + 3] for w in words for i in range(max(1, len(w) - 2))]
+        for feature in features:
+            digest = hashlib.md5(feature.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0 if digest[4] % 2 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+
+_TEMPLATE_TERMS = set(tokenize(KEYWORD_PROMPT))
+
+def fake_keyword_llm(keywords: int = FAKE_KEYWORDS):
+    """Stand-in for the keyword extraction LLM: the chunk's most frequent terms, as a list."""
+    def answer(prompt):
+        terms = Counter(t for t in tokenize(prompt.to_string()) if t not in _TEMPLATE_TERMS)
+        return AIMessage(content=json.dumps([term for term, _ in terms.most_common(keywords)]))
+    return RunnableLambda(answer)
+
+
+def parse_case(line: str) -> dict:
+    """One benchmark line: {"question", "expected": [criteria, ...]}; plain text has no expectations."""
+    try:
+        case = json.loads(line)
+    except ValueError:
+        case = None
+    if not isinstance(case, dict):
+        return {"question": line, "expected": []}
+    expected = case.get("expected") or []
+    return {"question": case["question"], "expected": expected if isinstance(expected, list) else [expected]}
+
+def matches(metadata: dict, criteria: dict) -> bool:
+    """Every expected field equals the chunk's metadata (text compared ignoring case and accents)."""
+    for field, value in criteria.items():
+        actual = metadata.get(field)
+        if isinstance(value, str) or isinstance(actual, str):
+            if normalize_query(str(value)) != normalize_query(str(actual or "")):
+                return False
+        elif actual != value:
+            return False
+    return True
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+@contextmanager
+def isolated_ingest(db_path: str, data_path: str):
+    """Point ingest at a scratch database and the benchmark documents for the duration of the block."""
+    saved = ingest.DB_PATH, ingest.DATA_PATH
+    ingest.DB_PATH, ingest.DATA_PATH = db_path, data_path
+    try:
+        yield
+    finally:
+        ingest.DB_PATH, ingest.DATA_PATH = saved
+
+def retrieve(runtime: RetrievalRuntime, mode: str, question: str, k: int):
+    if mode == "vector":
+        return runtime.similarity_search(question, k=k)
+    if mode == "bm25":
+        bm25 = runtime.get_bm25()
+        return [bm25.document(doc_id) for doc_id, _ in bm25.search(question, k=k)]
+    if mode == "hybrid":
+        return runtime.hybrid_search(question, k=k)
+    raise ValueError(f"Unknown retrieval mode: {mode}")
+
+def evaluate(runtime: RetrievalRuntime, cases: list[dict], mode: str, k: int) -> dict:
+    latencies, recalls, reciprocal_ranks = [], [], []
+    for case in cases:
+        start = time.perf_counter()
+        docs = retrieve(runtime, mode, case["question"], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if not case["expected"]:
+            continue
+        found = [any(matches(doc.metadata, criteria) for doc in docs) for criteria in case["expected"]]
+        recalls.append(sum(found) / len(found))
+        first = next((rank for rank, doc in enumerate(docs, start=1)
+                      if any(matches(doc.metadata, c) for c in case["expected"])), None)
+        reciprocal_ranks.append(1.0 / first if first else 0.0)
+    return {
+        f"recall@{k}": sum(recalls) / len(recalls) if recalls else None,
+        "mrr": sum(reciprocal_ranks) / len(reciprocal_ranks) if reciprocal_ranks else None,
+        "judged_questions": len(recalls),
+        "latency_ms": {f"p{p}": percentile(latencies, p) for p in (50, 95, 99)},
+    }
+
+def benchmark_strategy(strategy: str, cases: list[dict], docs_path: str, modes: list[str], k: int) -> dict:
+    work_dir = tempfile.mkdtemp(prefix=f"benchmark-{strategy}-")
+    db_path = os.path.join(work_dir, "chroma_db")
+    embeddings = HashEmbeddings()
+    try:
+        with isolated_ingest(db_path, docs_path):
+            start = time.perf_counter()
+            ingest.ingest_docs(clear_db=True, strategy=strategy, embeddings=embeddings,
+                               extract_processor=ExtractProcessor(fake_keyword_llm()))
+            ingest_seconds = time.perf_counter() - start
+        runtime = RetrievalRuntime(db_path=db_path, strategy=strategy, embeddings=embeddings)
+        runtime.warmup()
+        chunks = len(runtime.get_bm25())
+        if not chunks:
+            raise ValueError(f"No documents for strategy '{strategy}' in {docs_path}")
+        result = {
+            "ingest_seconds": ingest_seconds,
+            "chunks": chunks,
+            "index_bytes": directory_size(db_path),
+            "modes": {mode: evaluate(runtime, cases, mode, k) for mode in modes},
+        }
+        return result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def run_benchmark(benchmark_name: str, docs_path: str = ingest.DATA_PATH, strategies: list[str] = STRATEGIES,
+                  modes: list[str] = MODES, k: int = TOP_K) -> dict:
+    """Benchmark every strategy and mode; a strategy that fails to ingest is reported with its error."""
+    cases = [parse_case(line) for line in load_benchmark(benchmark_name)]
+    results = {
+        "benchmark": benchmark_name,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "questions": len(cases),
+        "k": k,
+        "docs_path": docs_path,
+        "embeddings": f"hash-{EMBEDDING_DIM}",
+        "strategies": {},
+    }
+    for strategy in strategies:
+        print(f"Benchmarking strategy '{strategy}'...")
+        try:
+            results["strategies"][strategy] = benchmark_strategy(strategy, cases, docs_path, modes, k)
+        except Exception as e:
+            print(f"Strategy '{strategy}' failed: {e}")
+            results["strategies"][strategy] = {"error": str(e)}
+    return results
+
+def print_report(results: dict):
+    k = results["k"]
+    print(f"\n{'strategy':<10} {'mode':<7} {f'recall@{k}':>9} {'mrr':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for strategy, result in results["strategies"].items():
+        if "error" in result:
+            print(f"{strategy:<10} error: {result['error']}")
+            continue
+        for mode, scores in result["modes"].items():
+            fmt = lambda value: f"{value:.3f}" if value is not None else "-"
+            latency = scores["latency_ms"]
+            print(f"{strategy:<10} {mode:<7} {fmt(scores[f'recall@{k}']):>9} {fmt(scores['mrr']):>6} "
+                  f"{latency['p50']:>8.2f} {latency['p95']:>8.2f} {latency['p99']:>8.2f}")
+        print(f"{strategy:<10} ingest {result['ingest_seconds']:.1f}s, {result['chunks']} chunks, "
+              f"{result['index_bytes'] / 1e6:.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmark")
+    parser.add_argument("benchmark", help=f"benchmark file name in {BENCHMARK_DIR}/")
+    parser.add_argument("--docs", default=ingest.DATA_PATH, help="documents folder to ingest")
+    parser.add_argument("--strategies", nargs="+", default=STRATEGIES, choices=STRATEGIES)
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--k", type=int, default=TOP_K)
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<name>-<time>.json)")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.benchmark, args.docs, args.strategies, args.modes, args.k)
+    print_report(results)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{os.path.splitext(args.benchmark)[0]}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,506 @@
+"""
+End-to-end load test for the API.
+
+Starts src.api.main:app in a subprocess (in a scratch working directory, so
+its data/ files stay out of the repo) against two local stand-ins: a fake
+Ollama server with configurable latency and token rate, and a fake Graph
+API that records every reply it receives. Then drives /chat and both
+webhooks open-loop at a target request rate and reports, per endpoint,
+throughput, error rate and tail latency, plus queueing delay: how late
+requests left the client, answer queue depth sampled from /stats, outbox
+queueing time, and for webhooks the time until the reply reached the
+Graph API.
+
+    python -m src.loadtest --rate 20 --duration 30 --mix chat=2 whatsapp=1 instagram=1 --llm-latency 0.5
+
+Latencies are measured from each request's scheduled send time, so a
+saturated server shows up as latency rather than as a lower request rate.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+from src.benchmark import HashEmbeddings
+from src.utils import percentile
+
+# Configuration
+RATE = 10.0  # requests per second, all endpoints together
+DURATION = 10.0  # seconds of load
+MIX = {"chat": 1, "whatsapp": 1, "instagram": 1}  # relative share of each endpoint
+USERS = 100  # distinct senders per endpoint
+DRAIN_TIMEOUT = 60.0  # seconds to wait for webhook replies after the load stops
+REQUEST_TIMEOUT = 120.0
+STATS_INTERVAL = 0.5  # seconds between /stats samples
+STARTUP_TIMEOUT = 60.0
+LLM_LATENCY = 0.2  # seconds before the first token
+TOKENS_PER_SECOND = 50.0
+ANSWER_TOKENS = 40
+EMBED_LATENCY = 0.01
+EMBEDDING_DIM = 256
+GRAPH_LATENCY = 0.05
+QUESTIONS = [
+    "¿A qué hora es el check-in?",
+    "Do you allow dogs?",
+    "¿Hay wifi en las cabañas?",
+    "How much is a night in a safari tent?",
+    "¿Se puede desayunar en el glamping?",
+    "Is there parking?",
+    "¿Cómo llego desde Santiago?",
+    "Can I cancel my booking?",
+]
+ANSWER_WORDS = "Thanks for your question about the glamping , we are happy to help and hope to see you soon .".split()
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class StubServer:
+    """Threaded local HTTP server; subclasses implement `handle(handler, method, path, body)`."""
+
+    def __init__(self, port: int = 0):
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _dispatch(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"null") if length else None
+                owner.handle(self, method, self.path, body)
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @staticmethod
+    def send_json(handler, data: dict, status: int = 200):
+        payload = json.dumps(data).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+
+class FakeOllama(StubServer):
+    """
+    Speaks enough of the Ollama API for ChatOllama and OllamaEmbeddings:
+    /api/chat waits `latency` seconds, then streams `answer_tokens` tokens at
+    `tokens_per_second`; /api/embed returns deterministic vectors after
+    `embed_latency` seconds.
+    """
+
+    def __init__(self, latency: float = LLM_LATENCY, tokens_per_second: float = TOKENS_PER_SECOND,
+                 answer_tokens: int = ANSWER_TOKENS, embed_latency: float = EMBED_LATENCY,
+                 embedding_dim: int = EMBEDDING_DIM, port: int = 0):
+        super().__init__(port)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.embed_latency = embed_latency
+        self.embeddings = HashEmbeddings(dim=embedding_dim)
+        self.chats = 0
+        self.embeds = 0
+        self.generating = 0
+        self.peak_generating = 0
+
+    def handle(self, handler, method, path, body):
+        if path == "/api/chat":
+            self._chat(handler, body or {})
+        elif path == "/api/embed":
+            time.sleep(self.embed_latency)
+            with self._lock:
+                self.embeds += 1
+            texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            self.send_json(handler, {"model": body["model"], "embeddings": self.embeddings.embed_documents(texts)})
+        elif path == "/api/tags":
+            self.send_json(handler, {"models": []})
+        elif path == "/api/version":
+            self.send_json(handler, {"version": "0.0.0-loadtest"})
+        else:
+            self.send_json(handler, {"error": f"unsupported: {method} {path}"}, status=404)
+
+    def _chat(self, handler, body):
+        with self._lock:
+            self.chats += 1
+            self.generating += 1
+            self.peak_generating = max(self.peak_generating, self.generating)
+        try:
+            time.sleep(self.latency)
+            words = [ANSWER_WORDS[i % len(ANSWER_WORDS)] + " " for i in range(self.answer_tokens)]
+            final = {"model": body.get("model"), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                     "message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "stop",
+                     "prompt_eval_count": 0, "eval_count": len(words)}
+            if not body.get("stream", True):
+                time.sleep(len(words) / self.tokens_per_second)
+                final["message"]["content"] = "".join(words)
+                self.send_json(handler, final)
+                return
+            # No Content-Length: the stream ends when the connection closes
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/x-ndjson")
+            handler.end_headers()
+            for word in words:
+                time.sleep(1.0 / self.tokens_per_second)
+                chunk = {"model": body.get("model"), "created_at": final["created_at"],
+                         "message": {"role": "assistant", "content": word}, "done": False}
+                handler.wfile.write(json.dumps(chunk).encode("utf-8") + b"\n")
+                handler.wfile.flush()
+            handler.wfile.write(json.dumps(final).encode("utf-8") + b"\n")
+            handler.close_connection = True
+        finally:
+            with self._lock:
+                self.generating -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"chats": self.chats, "embeds": self.embeds, "peak_generating": self.peak_generating}
+
+
+class FakeGraph(StubServer):
+    """
+    Accepts WhatsApp and Instagram send calls (POST .../messages) after
+    `latency` seconds and records (channel, recipient, time) for each. A
+    share `error_rate` of calls fails with a 500, which the app retries.
+    """
+
+    def __init__(self, latency: float = GRAPH_LATENCY, error_rate: float = 0.0, seed: int = 0, port: int = 0):
+        super().__init__(port)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.deliveries = []
+        self.errors = 0
+        self._random = random.Random(seed)
+
+    def handle(self, handler, method, path, body):
+        if method != "POST" or not path.endswith("/messages"):
+            self.send_json(handler, {"error": {"message": f"unsupported: {method} {path}"}}, status=404)
+            return
+        time.sleep(self.latency)
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            elif "messaging_product" in body:
+                self.deliveries.append(("whatsapp", body["to"], time.monotonic()))
+            else:
+                self.deliveries.append(("instagram", body["recipient"]["id"], time.monotonic()))
+        if failed:
+            self.send_json(handler, {"error": {"message": "injected failure", "code": 2}}, status=500)
+        else:
+            self.send_json(handler, {"messages": [{"id": f"wamid.{uuid.uuid4().hex}"}]})
+
+    def delivered(self) -> int:
+        with self._lock:
+            return len(self.deliveries)
+
+
+@contextmanager
+def app_server(ollama_url: str, graph_url: str, workdir: str = None, port: int = 0):
+    """Run src.api.main:app with uvicorn in a subprocess wired to the fakes; yields its base URL."""
+    workdir = workdir or tempfile.mkdtemp(prefix="loadtest-")
+    os.makedirs(workdir, exist_ok=True)
+    port = port or free_port()
+    env = dict(
+        os.environ,
+        PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        OLLAMA_HOST=ollama_url,
+        GRAPH_API_URL=graph_url + "/v17.0",
+        WHATSAPP_API_TOKEN="loadtest",
+        WHATSAPP_PHONE_NUMBER_ID="loadtest",
+        INSTAGRAM_ACCESS_TOKEN="loadtest",
+        NO_PROXY="127.0.0.1,localhost",
+    )
+    log = open(os.path.join(workdir, "app.log"), "ab")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.api.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"App exited during startup, see {log.name}")
+            try:
+                if httpx.get(url + "/health", timeout=1.0, trust_env=False).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"App did not start within {STARTUP_TIMEOUT:.0f}s, see {log.name}")
+            time.sleep(0.2)
+        print(f"App running at {url} (working directory {workdir})")
+        yield url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        log.close()
+
+
+#======================
+#=    LOAD DRIVER     =
+#======================
+def whatsapp_payload(sender: str, message_id: str, text: str) -> dict:
+    return {"object": "whatsapp_business_account", "entry": [{"id": "loadtest", "changes": [{
+        "field": "messages",
+        "value": {"messaging_product": "whatsapp", "messages": [{
+            "from": sender, "id": message_id, "timestamp": str(int(time.time())),
+            "type": "text", "text": {"body": text},
+        }]},
+    }]}]}
+
+def instagram_payload(sender: str, message_id: str, text: str) -> dict:
+    return {"object": "instagram", "entry": [{"id": "loadtest", "time": int(time.time() * 1000), "messaging": [{
+        "sender": {"id": sender}, "recipient": {"id": "loadtest"}, "timestamp": int(time.time() * 1000),
+        "message": {"mid": message_id, "text": text},
+    }]}]}
+
+def build_requests(rate: float, duration: float, mix: dict, users: int, distinct: bool, seed: int = 0) -> list:
+    """The schedule: (offset in seconds, endpoint, path, JSON body, sender) per request."""
+    rng = random.Random(seed)
+    run = uuid.uuid4().hex[:8]  # message IDs must be new to the app's dedupe store
+    endpoints = [e for e, weight in mix.items() for _ in range(weight)]
+    schedule = []
+    for i in range(int(rate * duration)):
+        endpoint = rng.choice(endpoints)
+        sender = f"lt{run}-{endpoint}-{rng.randrange(users)}"
+        text = rng.choice(QUESTIONS) + (f" (#{i})" if distinct else "")
+        if endpoint == "chat":
+            path, body = "/chat", {"message": text, "user_id": sender}
+        elif endpoint == "whatsapp":
+            path, body = "/whatsapp/webhook", whatsapp_payload(sender, f"wamid.{run}.{i}", text)
+        else:
+            path, body = "/instagram/webhook", instagram_payload(sender, f"mid.{run}.{i}", text)
+        schedule.append((i / rate, endpoint, path, body, sender))
+    return schedule
+
+def reply_latencies(accepted: list, deliveries: list) -> tuple[dict, dict]:
+    """
+    Match webhook messages to the replies the fake Graph API received: a
+    sender's replies arrive in message order, so the n-th reply to a sender
+    answers its n-th accepted message. Returns latencies and unanswered counts per channel.
+    """
+    replies = defaultdict(deque)
+    for channel, recipient, at in sorted(deliveries, key=lambda d: d[2]):
+        replies[(channel, recipient)].append(at)
+    latencies, unanswered = defaultdict(list), defaultdict(int)
+    for channel, sender, sent_at in sorted(accepted, key=lambda a: a[2]):
+        queue = replies[(channel, sender)]
+        if queue:
+            latencies[channel].append(queue.popleft() - sent_at)
+        else:
+            unanswered[channel] += 1
+    return latencies, unanswered
+
+async def run_load(app_url: str, graph: FakeGraph, rate: float = RATE, duration: float = DURATION, mix: dict = MIX,
+                   users: int = USERS, distinct: bool = False, drain_timeout: float = DRAIN_TIMEOUT) -> dict:
+    """Send the schedule open-loop, wait for webhook replies, and summarize."""
+    schedule = build_requests(rate, duration, mix, users, distinct)
+    results = defaultdict(lambda: {"latencies": [], "delays": [], "statuses": defaultdict(int)})
+    accepted = []  # (channel, sender, scheduled time) of webhook messages the app took
+    samples = []
+    done = asyncio.Event()
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+
+    async with httpx.AsyncClient(base_url=app_url, timeout=REQUEST_TIMEOUT, limits=limits, trust_env=False) as client:
+        async def sample_stats():
+            while not done.is_set():
+                try:
+                    samples.append((await client.get("/stats")).json())
+                except (httpx.HTTPError, ValueError):
+                    pass
+                try:
+                    await asyncio.wait_for(done.wait(), STATS_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+        async def send(scheduled, endpoint, path, body, sender):
+            result = results[endpoint]
+            result["delays"].append(time.monotonic() - scheduled)
+            try:
+                response = await client.post(path, json=body)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            result["latencies"].append(time.monotonic() - scheduled)
+            result["statuses"][status] += 1
+            if status == "200" and endpoint != "chat":
+                accepted.append((endpoint, sender, scheduled))
+
+        sampler = asyncio.create_task(sample_stats())
+        start = time.monotonic()
+        tasks = []
+        for offset, endpoint, path, body, sender in schedule:
+            await asyncio.sleep(max(0.0, start + offset - time.monotonic()))
+            tasks.append(asyncio.create_task(send(start + offset, endpoint, path, body, sender)))
+        await asyncio.gather(*tasks)
+        load_seconds = time.monotonic() - start
+
+        # Webhooks answer 200 before the reply is generated: wait for the replies
+        deadline = time.monotonic() + drain_timeout
+        while graph.delivered() < len(accepted) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        done.set()
+        await sampler
+        final_stats = (await client.get("/stats")).json()
+
+    with graph._lock:
+        deliveries = list(graph.deliveries)
+    latencies, unanswered = reply_latencies(accepted, deliveries)
+    ms = lambda values: {f"p{p}": percentile(values, p) * 1000 for p in (50, 95, 99)}
+    endpoints = {}
+    for endpoint, result in results.items():
+        total = sum(result["statuses"].values())
+        ok = result["statuses"].get("200", 0)
+        summary = {
+            "requests": total,
+            "ok": ok,
+            "error_rate": (total - ok) / total if total else 0.0,
+            "throughput": ok / load_seconds if load_seconds else 0.0,
+            "statuses": dict(result["statuses"]),
+            "latency_ms": ms(result["latencies"]),
+            "client_delay_ms": ms(result["delays"]),
+        }
+        if endpoint != "chat":
+            summary["reply_latency_ms"] = ms(latencies[endpoint])
+            summary["unanswered"] = unanswered[endpoint]
+        endpoints[endpoint] = summary
+
+    queued = [s["answers"]["queued"] for s in samples]
+    in_flight = [s["answers"]["in_flight"] for s in samples]
+    return {
+        "target_rate": rate,
+        "duration": duration,
+        "load_seconds": load_seconds,
+        "endpoints": endpoints,
+        "queueing": {
+            "answer_queue_peak": max(queued, default=0),
+            "answer_queue_mean": sum(queued) / len(queued) if queued else 0.0,
+            "in_flight_peak": max(in_flight, default=0),
+            "outbox_queued_seconds_p95": final_stats["outbox"]["queued_seconds_p95"],
+            "outbox_send_seconds_p95": final_stats["outbox"]["send_seconds_p95"],
+        },
+        "server": final_stats,
+        "graph": {"delivered": len(deliveries), "injected_errors": graph.errors},
+    }
+
+def print_report(results: dict, ollama: FakeOllama = None):
+    print(f"\n{results['load_seconds']:.1f}s at {results['target_rate']:.1f} req/s target")
+    print(f"{'endpoint':<10} {'reqs':>6} {'ok/s':>7} {'err%':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'delay p95':>10} {'reply p95':>10}")
+    for endpoint, s in sorted(results["endpoints"].items()):
+        reply = f"{s['reply_latency_ms']['p95']:>10.0f}" if "reply_latency_ms" in s else f"{'-':>10}"
+        print(f"{endpoint:<10} {s['requests']:>6} {s['throughput']:>7.1f} {s['error_rate'] * 100:>6.1f} "
+              f"{s['latency_ms']['p50']:>8.0f} {s['latency_ms']['p95']:>8.0f} {s['latency_ms']['p99']:>8.0f} "
+              f"{s['client_delay_ms']['p95']:>10.1f} {reply}")
+        if s.get("unanswered"):
+            print(f"{'':<10} {s['unanswered']} messages never answered")
+    q = results["queueing"]
+    print(f"answer queue peak {q['answer_queue_peak']} (mean {q['answer_queue_mean']:.1f}), "
+          f"in flight peak {q['in_flight_peak']}, outbox queued p95 {q['outbox_queued_seconds_p95'] * 1000:.0f} ms, "
+          f"send p95 {q['outbox_send_seconds_p95'] * 1000:.0f} ms")
+    if ollama is not None:
+        o = ollama.stats()
+        print(f"fake Ollama: {o['chats']} generations (peak {o['peak_generating']} concurrent), {o['embeds']} embeddings")
+
+def parse_mix(values: list[str]) -> dict:
+    mix = {}
+    for value in values:
+        endpoint, _, weight = value.partition("=")
+        if endpoint not in MIX:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint '{endpoint}', expected one of {', '.join(MIX)}")
+        mix[endpoint] = int(weight or 1)
+    return mix
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API against fake Ollama and Graph API servers")
+    parser.add_argument("--rate", type=float, default=RATE, help="requests per second")
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds of load")
+    parser.add_argument("--mix", nargs="+", default=[f"{e}={w}" for e, w in MIX.items()],
+                        help="endpoint=weight for chat, whatsapp, instagram")
+    parser.add_argument("--users", type=int, default=USERS, help="distinct senders per endpoint")
+    parser.add_argument("--distinct", action="store_true", help="make every question unique (defeats the answer cache)")
+    parser.add_argument("--llm-latency", type=float, default=LLM_LATENCY, help="seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=TOKENS_PER_SECOND)
+    parser.add_argument("--answer-tokens", type=int, default=ANSWER_TOKENS)
+    parser.add_argument("--embed-latency", type=float, default=EMBED_LATENCY)
+    parser.add_argument("--graph-latency", type=float, default=GRAPH_LATENCY)
+    parser.add_argument("--graph-error-rate", type=float, default=0.0, help="share of sends answered with a 500")
+    parser.add_argument("--drain-timeout", type=float, default=DRAIN_TIMEOUT)
+    parser.add_argument("--workdir", help="app working directory (default: a new temp directory)")
+    parser.add_argument("--app-url", help="use an app that is already running instead of starting one")
+    parser.add_argument("--ollama-port", type=int, default=0)
+    parser.add_argument("--graph-port", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    ollama = FakeOllama(args.llm_latency, args.tokens_per_second, args.answer_tokens, args.embed_latency,
+                        port=args.ollama_port)
+    graph = FakeGraph(args.graph_latency, args.graph_error_rate, port=args.graph_port)
+    with ollama, graph:
+        print(f"Fake Ollama at {ollama.url}, fake Graph API at {graph.url}")
+        load = lambda url: asyncio.run(run_load(url, graph, args.rate, args.duration, parse_mix(args.mix),
+                                                args.users, args.distinct, args.drain_timeout))
+        if args.app_url:
+            results = load(args.app_url)
+        else:
+            with app_server(ollama.url, graph.url, args.workdir) as url:
+                results = load(url)
+    results["ollama"] = ollama.stats()
+    print_report(results, ollama)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
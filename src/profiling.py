@@ -0,0 +1,260 @@
+"""
+Opt-in request profiling. A profiled request records a span tree (queue
+wait, answer cache, agent middleware, retrieval, LLM, tools), optionally
+with a cProfile report of the threads serving it, into a ring buffer of the
+last traces that /debug/traces serves.
+
+A request is profiled when it carries `X-Profile: 1` (or `X-Profile:
+cprofile`), when it is picked by PROFILE_SAMPLE_RATE, or for every request
+with PROFILE_REQUESTS=1 (or =cprofile). PROFILE_EXPORT_PATH appends each
+finished trace to a JSON Lines file.
+
+cProfile only sees the thread it runs in. Work that LangGraph runs on its
+own threads is profiled from the first span entered on each of them (the
+LLM call, tools), and the per-thread reports are merged; code those threads
+run outside any span is missing from the report.
+"""
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+PROFILE_HEADER = "X-Profile"
+TRACE_BUFFER_SIZE = 100  # finished traces kept for /debug/traces
+CPROFILE_TOP = 40  # functions listed in a cProfile report
+
+
+class Span:
+    def __init__(self, name: str, start: float = None, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter() if start is None else start
+        self.end = None
+        self.children = []
+
+    def to_dict(self, origin: float) -> dict:
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            "name": self.name,
+            "start_ms": (self.start - origin) * 1000,
+            "duration_ms": (end - self.start) * 1000,
+            **({"attrs": self.attrs} if self.attrs else {}),
+            "children": [child.to_dict(origin) for child in list(self.children)],
+        }
+
+
+class Trace:
+    """The span tree of one profiled request. Created when the request arrives."""
+
+    def __init__(self, name: str, cprofile: bool = False, **attrs):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attrs = attrs
+        self.cprofile = cprofile
+        self.started_at = time.time()
+        self.root = Span(name)
+        self.profile = None
+        self._profilers = []  # finished per-thread cProfile runs
+        self._profiled_threads = set()
+        self._lock = threading.Lock()
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.root.end if self.root.end is not None else time.perf_counter()
+        return (end - self.root.start) * 1000
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "attrs": self.attrs,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "duration_ms": self.duration_ms,
+            "cprofile": self.profile is not None,
+        }
+
+    def to_dict(self) -> dict:
+        return {**self.summary(), "spans": self.root.to_dict(self.root.start), "profile": self.profile}
+
+    @contextmanager
+    def profile_thread(self):
+        """cProfile the block if this is a cProfile trace and the calling thread isn't profiled yet."""
+        thread = threading.get_ident()
+        with self._lock:
+            start = self.cprofile and thread not in self._profiled_threads
+            if start:
+                self._profiled_threads.add(thread)
+        if not start:
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows one profiler per process, and it already sees every thread
+            profiler = None
+        if profiler is None:
+            with self._lock:
+                self._profiled_threads.discard(thread)
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._profiled_threads.discard(thread)
+                self._profilers.append(profiler)
+
+    def build_profile(self):
+        with self._lock:
+            profilers = list(self._profilers)
+        if not profilers:
+            return
+        report = io.StringIO()
+        stats = pstats.Stats(profilers[0], stream=report)
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        stats.sort_stats("cumulative").print_stats(CPROFILE_TOP)
+        self.profile = report.getvalue()
+
+
+_current_span = contextvars.ContextVar("profiling_span", default=None)
+_current_trace = contextvars.ContextVar("profiling_trace", default=None)
+
+@contextmanager
+def trace_span(name: str, **attrs):
+    """A child span of the current one while a profiled request runs; does nothing otherwise."""
+    parent = _current_span.get()
+    if parent is None:
+        yield
+        return
+    span = Span(name, **attrs)
+    parent.children.append(span)
+    token = _current_span.set(span)
+    try:
+        # The context follows the request onto LangGraph's threads; profile those too
+        with _current_trace.get().profile_thread():
+            yield
+    finally:
+        span.end = time.perf_counter()
+        _current_span.reset(token)
+
+@contextmanager
+def run_trace(trace: Trace):
+    """Run the block as the body of `trace`; the time since the trace was created is recorded as queue wait."""
+    now = time.perf_counter()
+    queue_wait = Span("queue_wait", start=trace.root.start)
+    queue_wait.end = now
+    trace.root.children.append(queue_wait)
+    span_token = _current_span.set(trace.root)
+    trace_token = _current_trace.set(trace)
+    try:
+        with trace.profile_thread():
+            yield trace
+    finally:
+        _current_trace.reset(trace_token)
+        _current_span.reset(span_token)
+        trace.root.end = time.perf_counter()
+        trace.build_profile()
+        get_trace_buffer().add(trace)
+
+
+def profile_mode(header: str = None):
+    """None, "spans" or "cprofile" for a request with the given X-Profile header value."""
+    for value in (header, os.getenv("PROFILE_REQUESTS")):
+        value = (value or "").strip().lower()
+        if value == "cprofile":
+            return "cprofile"
+        if value in ("1", "true", "yes", "on"):
+            return "spans"
+    sample_rate = get_sample_rate()
+    if sample_rate > 0 and random.random() < sample_rate:
+        return "spans"
+    return None
+
+_sample_rate = None
+
+def get_sample_rate() -> float:
+    """PROFILE_SAMPLE_RATE, read once. An invalid value disables sampling instead of failing requests."""
+    global _sample_rate
+    if _sample_rate is None:
+        value = os.getenv("PROFILE_SAMPLE_RATE") or "0"
+        try:
+            _sample_rate = float(value)
+        except ValueError:
+            logger.warning(f"Invalid PROFILE_SAMPLE_RATE {value!r}, request sampling is off")
+            _sample_rate = 0.0
+    return _sample_rate
+
+def profiled(fn, name: str, header: str = None, **attrs):
+    """
+    `fn` wrapped to run under a new trace if this request is picked for
+    profiling, else `fn` itself. Call it when the request arrives, so the
+    trace includes the time spent waiting for a worker.
+    """
+    mode = profile_mode(header)
+    if mode is None:
+        return fn
+    trace = Trace(name, cprofile=mode == "cprofile", **attrs)
+
+    @functools.wraps(fn)
+    def traced(*args, **kwargs):
+        with run_trace(trace):
+            return fn(*args, **kwargs)
+    traced.trace = trace
+    return traced
+
+
+class TraceBuffer:
+    """The last `size` finished traces, newest last. Also appended to `export_path` when set."""
+
+    def __init__(self, size: int = TRACE_BUFFER_SIZE, export_path: str = None):
+        self.export_path = export_path
+        self._traces = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, trace: Trace):
+        with self._lock:
+            self._traces.append(trace)
+            if self.export_path:
+                with open(self.export_path, "a") as f:
+                    f.write(json.dumps(trace.to_dict(), ensure_ascii=False) + "\n")
+
+    def list(self) -> list[dict]:
+        with self._lock:
+            return [trace.summary() for trace in reversed(self._traces)]
+
+    def get(self, trace_id: str):
+        with self._lock:
+            return next((trace for trace in self._traces if trace.id == trace_id), None)
+
+    def export(self) -> str:
+        """Every trace in the buffer as JSON Lines, oldest first."""
+        with self._lock:
+            return "".join(json.dumps(trace.to_dict(), ensure_ascii=False) + "\n" for trace in self._traces)
+
+
+_trace_buffer = None
+_trace_buffer_lock = threading.Lock()
+
+def get_trace_buffer() -> TraceBuffer:
+    global _trace_buffer
+    if _trace_buffer is None:
+        with _trace_buffer_lock:
+            if _trace_buffer is None:
+                _trace_buffer = TraceBuffer(export_path=os.getenv("PROFILE_EXPORT_PATH"))
+    return _trace_buffer
@@ -0,0 +1,147 @@
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from src.metrics import record_cache
+
+# Configuration
+ANSWER_CACHE_PATH = "data/answer_cache.sqlite3"
+ANSWER_CACHE_MAX_DISTANCE = 0.05  # cosine distance
+ANSWER_CACHE_MAX_SIZE = 1000
+
+
+class SemanticAnswerCache:
+    """
+    Answers keyed by query embedding. A question whose embedding is within
+    `max_distance` (cosine) of a cached one, in the same language, gets the
+    cached answer back. Entries belong to an ingest generation: when the
+    generation changes, older entries are dropped.
+    Backed by SQLite so the cache survives restarts; lookups run in memory.
+    """
+
+    def __init__(self, path: str = ANSWER_CACHE_PATH, max_distance: float = ANSWER_CACHE_MAX_DISTANCE,
+                 max_size: int = ANSWER_CACHE_MAX_SIZE):
+        self.path = path
+        self.max_distance = max_distance
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question TEXT NOT NULL,
+                language TEXT NOT NULL,
+                generation INTEGER NOT NULL,
+                answer TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+        self._generation = None
+        self._ids = []
+        self._languages = []
+        self._answers = []
+        self._matrix = None
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _sync(self, generation: int):
+        # Caller holds the lock. Drops stale generations and loads the rest into memory.
+        if generation == self._generation:
+            return
+        self._conn.execute("DELETE FROM answers WHERE generation != ?", (generation,))
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT id, language, answer, embedding FROM answers ORDER BY id"
+        ).fetchall()
+        self._ids = [row[0] for row in rows]
+        self._languages = [row[1] for row in rows]
+        self._answers = [row[2] for row in rows]
+        self._matrix = np.vstack([np.frombuffer(row[3], dtype=np.float32) for row in rows]) if rows else None
+        self._generation = generation
+
+    def lookup(self, embedding, language: str, generation: int):
+        """Return the cached answer closest to `embedding`, or None."""
+        query = self._normalize(embedding)
+        with self._lock:
+            self._sync(generation)
+            if self._matrix is not None and self._matrix.shape[1] == query.shape[0]:
+                similarities = self._matrix @ query
+                candidates = [i for i, lang in enumerate(self._languages) if lang == language]
+                if candidates:
+                    best = max(candidates, key=lambda i: similarities[i])
+                    if 1.0 - similarities[best] <= self.max_distance:
+                        self.hits += 1
+                        record_cache("answer", True)
+                        return self._answers[best]
+            self.misses += 1
+            record_cache("answer", False)
+            return None
+
+    def store(self, question: str, embedding, language: str, generation: int, answer: str):
+        vector = self._normalize(embedding)
+        with self._lock:
+            self._sync(generation)
+            if self._matrix is not None and self._matrix.shape[1] != vector.shape[0]:
+                # Embedding model changed: start over
+                self._conn.execute("DELETE FROM answers")
+                self._generation = None
+                self._sync(generation)
+            cursor = self._conn.execute(
+                "INSERT INTO answers (question, language, generation, answer, embedding, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (question, language, generation, answer, vector.tobytes(), time.time()),
+            )
+            self._ids.append(cursor.lastrowid)
+            self._languages.append(language)
+            self._answers.append(answer)
+            self._matrix = vector[None, :] if self._matrix is None else np.vstack([self._matrix, vector])
+
+            overflow = len(self._ids) - self.max_size
+            if overflow > 0:
+                # Oldest entries go first
+                self._conn.executemany("DELETE FROM answers WHERE id = ?", [(i,) for i in self._ids[:overflow]])
+                del self._ids[:overflow]
+                del self._languages[:overflow]
+                del self._answers[:overflow]
+                self._matrix = self._matrix[overflow:]
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+            self._generation = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._ids),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+def get_answer_cache() -> SemanticAnswerCache:
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = SemanticAnswerCache()
+    return _answer_cache
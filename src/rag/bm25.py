@@ -0,0 +1,144 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from langchain_core.documents import Document
+from src.rag.cache import normalize_query
+
+# Configuration
+BM25_SUFFIX = ".bm25.json"
+K1 = 1.5
+B = 0.75
+KEYWORD_BOOST = 2  # keyword metadata counts this many times in a chunk's term frequencies
+
+STOPWORDS = {
+    "el", "la", "los", "las", "de", "del", "que", "y", "en", "es", "un", "una", "por", "para", "con",
+    "al", "se", "su", "lo", "le", "mi", "me", "como", "hay", "o", "a",
+    "the", "is", "are", "a", "an", "of", "and", "in", "to", "for", "do", "does", "it", "on", "at",
+    "i", "you", "we", "can", "be", "or", "what", "how", "there",
+}
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in re.findall(r"\w+", normalize_query(text)) if t not in STOPWORDS]
+
+def index_path(db_path: str, collection_name: str) -> str:
+    return os.path.join(db_path, collection_name + BM25_SUFFIX)
+
+def chunk_keywords(metadata: dict) -> list[str]:
+    try:
+        return json.loads(metadata.get("keywords", "[]"))
+    except (TypeError, ValueError):
+        return []
+
+
+class BM25Index:
+    """
+    In-memory inverted index over chunk text and the LLM-extracted `keywords`
+    metadata, scored with Okapi BM25. Chunks are added and removed by ID so
+    the index follows incremental re-ingests.
+    """
+
+    def __init__(self):
+        self.docs = {}  # id -> {"text", "metadata", "length", "terms"}
+        self.postings = {}  # term -> {id: term frequency}
+        self.keyword_terms = {}  # id -> set of terms from the keywords metadata
+        self.total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.docs
+
+    def add(self, ids: list[str], texts: list[str], metadatas: list[dict]):
+        with self._lock:
+            self.remove([i for i in ids if i in self.docs])
+            for doc_id, text, metadata in zip(ids, texts, metadatas):
+                keyword_terms = [t for k in chunk_keywords(metadata) for t in tokenize(str(k))]
+                terms = Counter(tokenize(text))
+                for term in keyword_terms:
+                    terms[term] += KEYWORD_BOOST
+                length = sum(terms.values())
+                self.docs[doc_id] = {"text": text, "metadata": metadata, "length": length, "terms": list(terms)}
+                self.keyword_terms[doc_id] = set(keyword_terms)
+                self.total_length += length
+                for term, tf in terms.items():
+                    self.postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, ids: list[str]):
+        with self._lock:
+            for doc_id in ids:
+                doc = self.docs.pop(doc_id, None)
+                if doc is None:
+                    continue
+                self.keyword_terms.pop(doc_id, None)
+                self.total_length -= doc["length"]
+                for term in doc["terms"]:
+                    del self.postings[term][doc_id]
+                    if not self.postings[term]:
+                        del self.postings[term]
+
+    def search(self, query: str, k: int = 4) -> list[tuple[str, float]]:
+        """Return up to k (id, score) pairs, best first."""
+        with self._lock:
+            if not self.docs:
+                return []
+            n = len(self.docs)
+            avg_length = self.total_length / n
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = K1 * (1 - B + B * self.docs[doc_id]["length"] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+            return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def covers_query(self, doc_id: str, query: str) -> bool:
+        """True if every query term is one of the chunk's extracted keywords."""
+        terms = set(tokenize(query))
+        with self._lock:
+            return bool(terms) and terms <= self.keyword_terms.get(doc_id, set())
+
+    def document(self, doc_id: str) -> Document:
+        doc = self.docs[doc_id]
+        return Document(id=doc_id, page_content=doc["text"], metadata=doc["metadata"])
+
+    def sync(self, collection, expected_ids):
+        """
+        Make the index hold exactly `expected_ids`: drop the others and load
+        missing chunks from the Chroma collection.
+        """
+        expected = set(expected_ids)
+        with self._lock:
+            self.remove([i for i in self.docs if i not in expected])
+            missing = [i for i in expected_ids if i not in self.docs]
+        for start in range(0, len(missing), 256):
+            result = collection.get(ids=missing[start:start + 256], include=["documents", "metadatas"])
+            self.add(result["ids"], result["documents"], result["metadatas"])
+
+    def save(self, path: str):
+        with self._lock:
+            data = {doc_id: {"text": d["text"], "metadata": d["metadata"]} for doc_id, d in self.docs.items()}
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        index = cls()
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        ids = list(data)
+        index.add(ids, [data[i]["text"] for i in ids], [data[i]["metadata"] for i in ids])
+        return index
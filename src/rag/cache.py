@@ -0,0 +1,107 @@
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normalize a user message for cache lookups: case, accents and whitespace
+    are ignored, so "  Precío " and "precio" share a key.
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.split())
+
+
+SPANISH_HINTS = {
+    "el", "la", "los", "las", "de", "del", "que", "y", "en", "es", "un", "una", "por", "para",
+    "con", "hay", "como", "cuanto", "cuantos", "donde", "cuando", "precio", "hola", "gracias",
+    "tienen", "puedo", "se", "al", "mi", "su", "no", "si",
+}
+ENGLISH_HINTS = {
+    "the", "is", "are", "a", "an", "of", "and", "in", "to", "for", "what", "how", "where",
+    "when", "do", "does", "can", "you", "your", "i", "my", "there", "price", "hello", "thanks",
+    "have", "with", "it", "no", "yes",
+}
+
+def detect_language(text: str) -> str:
+    """
+    Cheap Spanish/English guess from stopwords and punctuation.
+    Returns "es", "en" or "unknown" when there is not enough signal.
+    """
+    if "¿" in text or "¡" in text or "ñ" in text.lower():
+        return "es"
+    words = [w.strip("?!.,;:") for w in normalize_query(text).split()]
+    spanish = sum(w in SPANISH_HINTS for w in words)
+    english = sum(w in ENGLISH_HINTS for w in words)
+    if spanish > english:
+        return "es"
+    if english > spanish:
+        return "en"
+    return "unknown"
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with a maximum size and a time-to-live per entry.
+    Keeps hit/miss/eviction counters for monitoring.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at > self.clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.evictions += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: float = None):
+        """Store `value`; `ttl` overrides the cache's time-to-live for this entry."""
+        with self._lock:
+            self._data[key] = (value, self.clock() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
@@ -1,8 +1,8 @@
-from langchain.agents.middleware import dynamic_prompt, ModelRequest
+from langchain.agents.middleware import dynamic_prompt, wrap_model_call, wrap_tool_call, ModelRequest, AgentState
 
-from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings
 from langchain_ollama import ChatOllama
+from langchain_core.runnables import RunnableLambda
+from langchain_core.messages import AIMessageChunk
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_classic.chains.combine_documents import create_stuff_documents_chain
 from langchain_classic.chains.retrieval import create_retrieval_chain
@@ -10,10 +10,16 @@ from langchain.tools import tool
 from langchain.agents import create_agent
 from langchain_core.globals import set_debug
 from dotenv import load_dotenv
+from typing_extensions import NotRequired
+import threading
+from src.rag.runtime import get_runtime, MODEL_NAME
+from src.rag.answer_cache import get_answer_cache
+from src.rag.cache import detect_language
+from src.rag.memory import get_memory
+from src.rag.context import pack_context
+from src.metrics import LLM_IN_FLIGHT, span
+from src.profiling import trace_span
 
-# Configuration
-DB_PATH = "data/chroma_db"
-MODEL_NAME = "llama3.1"
 # Debug mode
 set_debug(False)
 load_dotenv()
@@ -24,16 +30,7 @@ load_dotenv()
 @tool(response_format="content_and_artifact")
 def retrieve_context(query: str):
     """Retrieve information to help answer a query."""
-    embeddings = OllamaEmbeddings(model=MODEL_NAME)
-    vectorstore = Chroma(collection_name="espazo_nature",
-        embedding_function=embeddings,
-        persist_directory=DB_PATH)
-    retrieved_docs = vectorstore.similarity_search(query, k=3, filter={
-        "$or": [
-            {"section": {"$in": [query]}},
-            {"keywords": {"$in": [query]}}
-        ]
-    })
+    retrieved_docs = get_runtime().hybrid_search(query, k=3)
 
     serialized = "\n\n".join(
         (f"Source: {doc.metadata}\nContent: {doc.page_content}")
@@ -46,35 +43,158 @@ def retrieve_context(query: str):
 @dynamic_prompt
 def prompt_with_context(request: ModelRequest) -> str:
     """Inject context into state messages."""
-    embeddings = OllamaEmbeddings(model=MODEL_NAME)
-    vectorstore = Chroma(collection_name="espazo_nature",
-        embedding_function=embeddings,
-        persist_directory=DB_PATH)
     last_query = request.state["messages"][-1].text
-    retrieved_docs = vectorstore.similarity_search(last_query)
+    with trace_span("prompt_with_context"):
+        with span("answer", "retrieval"):
+            retrieved_docs = get_runtime().hybrid_search(last_query)
 
-    docs_content = "\n\n".join(doc.page_content for doc in retrieved_docs)
+        with span("answer", "prompt"):
+            return _system_prompt(request.state, retrieved_docs)
+
+def _system_prompt(state, retrieved_docs) -> str:
+    # Keyword headers, chunk overlap and near-duplicates only cost prompt tokens
+    docs_content = "\n\n".join(pack_context(retrieved_docs))
 
     system_message = (
         "You are a custom service assistant from company Espazo Nature.",
         "Espazo Nature is a company that provides glamping services in Galicia, Spain.",
         "You have access to a tool that retrieves context from a document with information about the company.",
         "Use it to answer the user's question.",
-        "If the question is in Spanish, answer in Spanish. If the question is in English, answer in English.",
-        f"\n\n{docs_content}"
+        f"Answer in {state.get('language', 'the same language as the question')}.",
     )
+    if state.get("summary"):
+        system_message += (f"Earlier in this conversation the user asked: {state['summary']}.",)
+    system_message += (f"\n\n{docs_content}",)
+
+    return " ".join(system_message)
+
+@wrap_model_call
+def timed_model_call(request: ModelRequest, handler):
+    """Time each LLM call and count it as in flight while it runs (also while streaming)."""
+    with LLM_IN_FLIGHT.track(), span("answer", "llm"):
+        return handler(request)
+
+@wrap_tool_call
+def traced_tool_call(request, handler):
+    """Tool invocations show up in the trace of a profiled request."""
+    with trace_span(f"tool:{request.tool_call['name']}", args=request.tool_call.get("args")):
+        return handler(request)
+
+
+class RAGState(AgentState):
+    language: NotRequired[str]
+    summary: NotRequired[str]
+
+
+_agent = None
+_rag_chain = None
+_rag_chain_lock = threading.Lock()
+
+def get_agent():
+    """Build the answering agent once per process. Takes {"messages", "language"}."""
+    global _agent
+    if _agent is None:
+        with _rag_chain_lock:
+            if _agent is None:
+                model = ChatOllama(model=MODEL_NAME)
+                _agent = create_agent(model, [], middleware=[prompt_with_context, timed_model_call, traced_tool_call],
+                                      state_schema=RAGState)
+    return _agent
 
-    return system_message
+def get_rag_chain():
+    """
+    Wrap the agent once per process.
+    Takes {"input", "language"} (plus "history" and "summary" from the
+    conversation memory, if any) and returns {"answer"}.
+    """
+    global _rag_chain
+    if _rag_chain is None:
+        agent = get_agent()
+        with _rag_chain_lock:
+            if _rag_chain is None:
+                _rag_chain = (
+                    RunnableLambda(lambda x: {
+                        "messages": x.get("history", []) + [{"role": "user", "content": x["input"]}],
+                        "language": x["language"],
+                        "summary": x.get("summary", ""),
+                    })
+                    | agent
+                    | RunnableLambda(lambda state: {"answer": state["messages"][-1].text})
+                )
+    return _rag_chain
 
-"""def ask_question(question: str, language: str = "Auto"):
-    chain = get_rag_chain()
-    
-    target_lang = language
+def _target_language(language: str) -> str:
     if language == "Auto":
-        target_lang = "the same language as the question"
-        
-    response = chain.invoke({"input": question, "language": target_lang})
-    return response["answer"]"""
+        return "the same language as the question"
+    return language
+
+def _cache_key(question: str, language: str):
+    """Embedding, language and index generation the answer cache is keyed on."""
+    runtime = get_runtime()
+    cache_language = detect_language(question) if language == "Auto" else language
+    return runtime.embeddings.embed_query(question), cache_language, runtime.generation
+
+def ask_question(question: str, language: str = "Auto", conversation: str = None):
+    """
+    Answer a question. `conversation` ("channel:user_id") adds that user's
+    earlier turns to the prompt and records this one.
+    """
+    history = get_memory().history(conversation) if conversation else {}
+    answer_cache = get_answer_cache()
+    answer = None
+    # Near-duplicate questions are answered from the semantic cache, skipping the LLM.
+    # Follow-ups depend on the earlier turns, so only opening questions use it.
+    if not history:
+        with trace_span("answer_cache"):
+            query_embedding, cache_language, generation = _cache_key(question, language)
+            answer = answer_cache.lookup(query_embedding, cache_language, generation)
+
+    if answer is None:
+        chain = get_rag_chain()
+        response = chain.invoke({"input": question, "language": _target_language(language), **history})
+        answer = response["answer"]
+        if not history:
+            answer_cache.store(question, query_embedding, cache_language, generation, answer)
+
+    if conversation:
+        get_memory().append(conversation, question, answer)
+    return answer
+
+def stream_question(question: str, language: str = "Auto", conversation: str = None):
+    """
+    Like ask_question, but yields the answer text as the model produces it.
+    Closing the generator stops the generation; only complete answers are
+    cached and recorded in the conversation.
+    """
+    history = get_memory().history(conversation) if conversation else {}
+    answer_cache = get_answer_cache()
+    answer = None
+    if not history:
+        with trace_span("answer_cache"):
+            query_embedding, cache_language, generation = _cache_key(question, language)
+            answer = answer_cache.lookup(query_embedding, cache_language, generation)
+
+    if answer is not None:
+        yield answer
+    else:
+        parts = []
+        for chunk, _ in get_agent().stream(
+            {
+                "messages": history.get("history", []) + [{"role": "user", "content": question}],
+                "language": _target_language(language),
+                "summary": history.get("summary", ""),
+            },
+            stream_mode="messages",
+        ):
+            if isinstance(chunk, AIMessageChunk) and chunk.text:
+                parts.append(chunk.text)
+                yield chunk.text
+        answer = "".join(parts)
+        if not history:
+            answer_cache.store(question, query_embedding, cache_language, generation, answer)
+
+    if conversation:
+        get_memory().append(conversation, question, answer)
 
 if __name__ == "__main__":
     tools = [] # [retrieve_context]
@@ -0,0 +1,90 @@
+import re
+from src.rag.memory import count_tokens
+
+# Configuration
+CONTEXT_TOKEN_BUDGET = 1500  # retrieved text allowed in the system prompt
+DUPLICATE_THRESHOLD = 0.8  # share of a passage's word shingles already in a better one
+SHINGLE_SIZE = 3
+
+KEYWORD_HEADER = re.compile(r"^\s*\[KEYWORDS\].*?\[CONTENT\]\s*", re.DOTALL)
+
+
+def strip_keywords(text: str) -> str:
+    """Remove the [KEYWORDS] ... [CONTENT] header that ingest puts in front of each chunk."""
+    return KEYWORD_HEADER.sub("", text, count=1).strip()
+
+def section_key(metadata: dict) -> tuple:
+    """Chunks with the same key were split from the same text, so their start_index values are comparable."""
+    return tuple(metadata.get(k) for k in ("source", "page", "parent_section", "section"))
+
+def _shingles(text: str) -> set:
+    words = re.findall(r"\w+", text.casefold())
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def _merge(first: dict, second: dict):
+    """Join two passages of the same section that overlap or touch, or return None."""
+    if first["key"] != second["key"] or first["start"] is None or second["start"] is None:
+        return None
+    a, b = (first, second) if first["start"] <= second["start"] else (second, first)
+    a_end = a["start"] + len(a["text"])
+    if b["start"] > a_end:
+        return None
+    overlap = a_end - b["start"]
+    if overlap > len(b["text"]):
+        text = a["text"]  # b lies inside a
+    elif a["text"][len(a["text"]) - overlap:] == b["text"][:overlap]:
+        text = a["text"] + b["text"][overlap:]
+    else:
+        return None  # offsets don't line up with the text; keep both
+    return {"key": a["key"], "start": a["start"], "text": text}
+
+def pack_context(docs, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                 duplicate_threshold: float = DUPLICATE_THRESHOLD) -> list[str]:
+    """
+    Turn retrieved chunks (best first) into the passages to put in the prompt:
+    keyword headers stripped, overlapping chunks of the same section merged
+    into one passage (at the rank of the best of them), near-duplicates
+    dropped, then passages taken in relevance order while they fit in
+    `token_budget`.
+    """
+    passages = [
+        {"key": section_key(doc.metadata), "start": doc.metadata.get("start_index"), "text": strip_keywords(doc.page_content)}
+        for doc in docs
+    ]
+    passages = [p for p in passages if p["text"]]
+
+    # Merge pairs until none overlap; a merged passage keeps the better rank of the two
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(passages)):
+            for j in range(i + 1, len(passages)):
+                joined = _merge(passages[i], passages[j])
+                if joined is not None:
+                    passages[i] = joined
+                    del passages[j]
+                    merged = True
+                    break
+            if merged:
+                break
+
+    kept = []
+    for passage in passages:
+        shingles = _shingles(passage["text"])
+        if any(len(shingles & seen) / len(shingles) >= duplicate_threshold for _, seen in kept):
+            continue
+        kept.append((passage["text"], shingles))
+
+    packed, used = [], 0
+    for text, _ in kept:
+        tokens = count_tokens(text)
+        if used + tokens <= token_budget:
+            packed.append(text)
+            used += tokens
+        elif not packed:
+            # The best passage alone is over budget: keep its beginning
+            packed.append(text[:token_budget * 4])
+            used = token_budget
+    return packed
@@ -0,0 +1,120 @@
+import hashlib
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from src.metrics import STAGE_SECONDS
+
+# Configuration
+EMBED_CONCURRENCY = 2  # embedding requests to Ollama in flight
+
+
+class EmbeddingWriter:
+    """
+    Embeds batches of chunks and upserts them into a Chroma collection.
+    Up to `max_in_flight` batches are embedded in background threads while
+    the oldest finished batch is written, and batches are written in the
+    order they were submitted.
+    Each chunk is stored with a `content_hash` (model + text); chunks whose
+    hash is already stored in the target collection (or in `reuse_from`)
+    reuse that embedding instead of calling the embedding model again.
+    """
+
+    def __init__(self, embeddings, collection, model_name: str, max_in_flight: int = EMBED_CONCURRENCY,
+                 reuse_from: list = ()):
+        self.embeddings = embeddings
+        self.collection = collection
+        self.model_name = model_name
+        self.max_in_flight = max_in_flight
+        self.reuse_from = list(reuse_from)
+        self.stats = {"embedded": 0, "reused": 0, "written": 0, "embed_seconds": 0.0, "write_seconds": 0.0}
+        self._stats_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embedding-writer")
+        self._in_flight = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def content_hash(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _stored_embeddings(self, hashes: list[str]) -> dict:
+        found = {}
+        for collection in [self.collection] + self.reuse_from:
+            remaining = [h for h in hashes if h not in found]
+            if not remaining:
+                break
+            result = collection.get(where={"content_hash": {"$in": remaining}}, include=["embeddings", "metadatas"])
+            for metadata, embedding in zip(result["metadatas"], result["embeddings"]):
+                found[metadata["content_hash"]] = list(embedding)
+        return found
+
+    def _embed(self, docs):
+        texts = [doc.page_content for doc in docs]
+        hashes = [self.content_hash(text) for text in texts]
+        stored = self._stored_embeddings(hashes)
+        missing = [i for i, h in enumerate(hashes) if h not in stored]
+
+        start = time.perf_counter()
+        new_vectors = self.embeddings.embed_documents([texts[i] for i in missing]) if missing else []
+        seconds = time.perf_counter() - start
+        if missing:
+            STAGE_SECONDS.observe(seconds, path="ingest", stage="embed")
+        with self._stats_lock:
+            self.stats["embed_seconds"] += seconds
+            self.stats["embedded"] += len(missing)
+            self.stats["reused"] += len(docs) - len(missing)
+
+        vectors = [stored.get(h) for h in hashes]
+        for i, vector in zip(missing, new_vectors):
+            vectors[i] = vector
+        return hashes, vectors
+
+    def _write_next(self):
+        future, docs, ids, tag = self._in_flight.popleft()
+        if future is not None:
+            hashes, vectors = future.result()
+            start = time.perf_counter()
+            self.collection.upsert(
+                ids=ids,
+                embeddings=vectors,
+                documents=[doc.page_content for doc in docs],
+                metadatas=[{**doc.metadata, "content_hash": h} for doc, h in zip(docs, hashes)],
+            )
+            seconds = time.perf_counter() - start
+            STAGE_SECONDS.observe(seconds, path="ingest", stage="upsert")
+            self.stats["write_seconds"] += seconds
+            self.stats["written"] += len(ids)
+        return tag
+
+    def submit(self, docs, ids, tag=None) -> list:
+        """
+        Queue a batch for embedding. Returns the tags of earlier batches that
+        were written to the collection to make room (oldest first).
+        """
+        future = self._pool.submit(self._embed, docs) if docs else None
+        self._in_flight.append((future, docs, ids, tag))
+        written = []
+        while len(self._in_flight) > self.max_in_flight:
+            written.append(self._write_next())
+        return written
+
+    def flush(self) -> list:
+        """Write every queued batch and return their tags."""
+        written = []
+        while self._in_flight:
+            written.append(self._write_next())
+        return written
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def log_stats(self):
+        embed_rate = self.stats["embedded"] / self.stats["embed_seconds"] if self.stats["embed_seconds"] else 0.0
+        write_rate = self.stats["written"] / self.stats["write_seconds"] if self.stats["write_seconds"] else 0.0
+        print(f"embed: {self.stats['embedded']} chunks in {self.stats['embed_seconds']:.1f}s "
+              f"({embed_rate:.1f} chunks/s), {self.stats['reused']} reused from stored hashes")
+        print(f"upsert: {self.stats['written']} chunks in {self.stats['write_seconds']:.1f}s ({write_rate:.1f} chunks/s)")
@@ -6,15 +6,17 @@ from langchain_core.documents import Document
 import fitz
 import re
 import ast
+import time
+import multiprocessing
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from src.rag.keyword_cache import KeywordCache
 
 
-class ExtractProcessor:
-    def __init__(self, llm: ChatOllama):
-        self.llm = llm
-    
-    def extract_metadata(self, content: str) -> dict:
-        prompt = ChatPromptTemplate.from_template(
-            """
+PAGES_PER_TASK = 8  # pages parsed per worker task
+
+KEYWORD_PROMPT = """
             You are an expert in metadata extraction.
             Extract important keywords from the following content.
             {content}
@@ -22,11 +24,66 @@ class ExtractProcessor:
             Return the keywords in a list format separated by commas and between [].
             Each keyword should be sourrounded by ""
             """
-        )
-        chain = prompt | self.llm
+
+
+class ExtractProcessor:
+    def __init__(self, llm: ChatOllama, cache: KeywordCache = None):
+        self.llm = llm
+        self.prompt = ChatPromptTemplate.from_template(KEYWORD_PROMPT)
+        self.cache = cache
+    
+    def extract_metadata(self, content: str) -> dict:
+        if self.cache is not None:
+            key = KeywordCache.make_key(getattr(self.llm, "model", type(self.llm).__name__), KEYWORD_PROMPT, content)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        chain = self.prompt | self.llm
         metadata = chain.invoke({"content": content})
         parsed_metadata = self.parse_to_list(metadata.content)
+
+        # Only successful parses are cached, failures get another chance next run
+        if self.cache is not None and parsed_metadata:
+            self.cache.set(key, parsed_metadata)
         return parsed_metadata
+
+    def extract_metadata_batch(self, contents: list[str], max_concurrency: int = 4, retries: int = 1,
+                               progress_every: int = 10) -> list[list]:
+        """
+        Extract keywords for many chunks concurrently, at most `max_concurrency`
+        LLM calls at a time. Results keep the order of `contents`.
+        A chunk whose call fails or whose answer has no parsable list is retried
+        `retries` times, then skipped with an empty keyword list.
+        """
+        results = [[] for _ in contents]
+        if not contents:
+            return results
+
+        def extract(index):
+            for attempt in range(retries + 1):
+                try:
+                    keywords = self.extract_metadata(contents[index])
+                except Exception as e:
+                    print(f"Keyword extraction failed for chunk {index} (attempt {attempt + 1}): {e}")
+                    continue
+                if keywords:
+                    return keywords
+            print(f"Skipping keywords for chunk {index} after {retries + 1} attempts.")
+            return []
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            futures = {pool.submit(extract, i): i for i in range(len(contents))}
+            for done, future in enumerate(as_completed(futures), start=1):
+                results[futures[future]] = future.result()
+                if done % progress_every == 0 or done == len(contents):
+                    elapsed = time.perf_counter() - start
+                    print(f"Extracted keywords for {done}/{len(contents)} chunks ({done / elapsed:.2f} chunks/s)")
+        if self.cache is not None:
+            stats = self.cache.stats()
+            print(f"Keyword cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), {stats['size']} entries")
+        return results
     
     def parse_to_list(self, metadata: str) -> list:
         # We can use re.DOTALL in case the list spans multiple lines
@@ -47,17 +104,58 @@ class ExtractProcessor:
         return json.loads(metadata)
     
     
-    def process_document(self, document_path: str) -> list[Document]:
-        section_docs = []
-
-        fitz_doc = fitz.open(document_path)
-        current_section = {"parent_section":"","section": "Espazo Nature", "text": "", "page_start": 0}
-        font_sizes = [] # Lista para almacenar el tamaño superior {"section_name": ..., "size": ...}
-        for page_num, page in enumerate(fitz_doc):
-            blocks = page.get_text("dict")["blocks"]
+    def process_document(self, document_path: str, workers: int = 1) -> list[Document]:
+        """Split a PDF into sections by headings. workers > 1 parses pages in parallel processes."""
+        return next(self.process_documents([document_path], workers=workers))[1]
+
+    def process_documents(self, document_paths: list[str], workers: int = 1):
+        """
+        Split many PDFs into sections, yielding (path, sections) in input order.
+        With workers > 1, page ranges of all files are parsed in a process pool
+        and merged back in reading order before the heading logic runs.
+        """
+        if workers <= 1:
+            for path in document_paths:
+                yield path, build_sections(extract_page_blocks(path))
+            return
+
+        def submit(pool, path):
+            with fitz.open(path) as fitz_doc:
+                page_count = fitz_doc.page_count
+            ranges = [(p, min(p + PAGES_PER_TASK, page_count)) for p in range(0, page_count, PAGES_PER_TASK)]
+            return path, [pool.submit(extract_page_blocks, path, first, last) for first, last in ranges]
+
+        # Only a few files are parsed ahead of the consumer, to bound memory.
+        # Spawned, not forked: the server runs this from the watcher thread, and forking a
+        # process with other threads holding locks (httpx, SQLite, Chroma) can deadlock the child.
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            paths = iter(document_paths)
+            in_flight = deque(submit(pool, path) for path in islice(paths, 2 * workers))
+            while in_flight:
+                path, page_futures = in_flight.popleft()
+                blocks = []
+                for future in page_futures:
+                    blocks.extend(future.result())
+                next_path = next(paths, None)
+                if next_path is not None:
+                    in_flight.append(submit(pool, next_path))
+                yield path, build_sections(blocks)
+
+
+def extract_page_blocks(document_path: str, first_page: int = 0, last_page: int = None) -> list[tuple]:
+    """
+    Parse pages [first_page, last_page) of a PDF into text blocks in reading order.
+    Returns (page_num, text, max_font_size, is_bold) tuples. Runs in worker processes.
+    """
+    page_blocks = []
+    with fitz.open(document_path) as fitz_doc:
+        if last_page is None:
+            last_page = fitz_doc.page_count
+        for page_num in range(first_page, last_page):
+            blocks = fitz_doc[page_num].get_text("dict")["blocks"]
             # Sort blocks by vertical position to maintain reading order
             blocks.sort(key=lambda b: (b["bbox"][1], b["bbox"][0]))
-            
+
             for block in blocks:
                 # Only process text blocks
                 if block.get("type", 0) != 0:
@@ -65,75 +163,67 @@ class ExtractProcessor:
                 if "lines" not in block:
                     continue
 
-                text = ""
+                parts = []
                 max_font_size = 0
                 is_bold = False
 
                 for line in block["lines"]:
                     for span in line["spans"]:
-                        text += span["text"]
+                        parts.append(span["text"])
                         max_font_size = max(max_font_size, span["size"])
 
                         if span["flags"] & 2:  # bold flag
                             is_bold = True
-                        text += "\n"
-
-                text = text.strip()
-                if not text:
-                    continue
-
-                #is_numbered = re.match(r"^\d+(\.\d+)*\s+", text)
-                is_short = len(text) < 120
-                is_large_font = max_font_size > 15  # adjust threshold
-                is_upper = text.isupper()
-
-                if (is_bold or is_large_font or is_upper) and is_short:
-                    if current_section["text"].strip():
-                        # Save previous section as a Langchain Document
-                        #metadata = fitz_doc.metadata.copy()
-                        #self.extract_metadata(current_section["text"])
-                        metadata = {}
-                        metadata.update({"parent_section":current_section["parent_section"],"section": current_section["section"], "page": current_section["page_start"]})
-                        section_docs.append(Document(page_content=current_section["text"].strip(), metadata=metadata))
-
-                    # Buscar el elemento con el menor tamaño dentro de los mayores
-                    mayores = [f for f in font_sizes if f["size"] > max_font_size]
-                    if mayores:
-                        padre = min(mayores, key=lambda x: x["size"])
-                        parent_section_name = padre["section_name"]
-                    else:
-                        parent_section_name = ""
-
-                    # Actualizamos la lista eliminando tamaños menores o iguales,
-                    # para que la jerarquía siga siendo válida (funciona como una pila)
-                    font_sizes = [f for f in font_sizes if f["size"] > max_font_size]
-                    font_sizes.append({"section_name": text, "size": max_font_size})
-
-                    # Start new section
-                    current_section = {
-                        "parent_section": parent_section_name,
-                        "section": text,
-                        "text": "",
-                        "page_start": page_num
-                    }
-                else:
-                    current_section["text"] += text + "\n\n"
-
-        # Append the final section
-        if current_section["text"].strip():
-            #metadata = fitz_doc.metadata.copy()
-            metadata = {}
-            metadata.update({"parent_section":current_section["parent_section"],"section": current_section["section"], "page": current_section["page_start"]})
-            section_docs.append(Document(page_content=current_section["text"].strip(), metadata=metadata))
-                    
-        try:
-            fitz_doc.close()
-        except Exception as e:
-            print(f"Error processing {document_path} with PyMuPDF: {e}")
-            # Fallback: Just append original doc if there's an error
-            section_docs.append(doc)
-
-        return section_docs
+                        parts.append("\n")
+
+                text = "".join(parts).strip()
+                if text:
+                    page_blocks.append((page_num, text, max_font_size, is_bold))
+    return page_blocks
+
+
+def build_sections(page_blocks: list[tuple]) -> list[Document]:
+    """Group text blocks into sections, each headed by the last short bold/large/uppercase block."""
+    section_docs = []
+    current_section = {"parent_section":"","section": "Espazo Nature", "parts": [], "page_start": 0}
+    # Stack of open headings {"section_name": ..., "size": ...}, font sizes strictly decreasing
+    font_sizes = []
+
+    def save_section():
+        if current_section["parts"]:
+            metadata = {"parent_section":current_section["parent_section"],"section": current_section["section"], "page": current_section["page_start"]}
+            section_docs.append(Document(page_content="\n\n".join(current_section["parts"]), metadata=metadata))
+
+    for page_num, text, max_font_size, is_bold in page_blocks:
+        #is_numbered = re.match(r"^\d+(\.\d+)*\s+", text)
+        is_short = len(text) < 120
+        is_large_font = max_font_size > 15  # adjust threshold
+        is_upper = text.isupper()
+
+        if (is_bold or is_large_font or is_upper) and is_short:
+            # Save previous section as a Langchain Document
+            save_section()
+
+            # The parent is the closest open heading with a larger font;
+            # headings with a smaller or equal font are closed
+            while font_sizes and font_sizes[-1]["size"] <= max_font_size:
+                font_sizes.pop()
+            parent_section_name = font_sizes[-1]["section_name"] if font_sizes else ""
+            font_sizes.append({"section_name": text, "size": max_font_size})
+
+            # Start new section
+            current_section = {
+                "parent_section": parent_section_name,
+                "section": text,
+                "parts": [],
+                "page_start": page_num
+            }
+        else:
+            current_section["parts"].append(text)
+
+    # Append the final section
+    save_section()
+    return section_docs
 
 
 if __name__ == "__main__":
@@ -7,25 +7,69 @@ from langchain_ollama import OllamaEmbeddings, ChatOllama
 from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate
 import chromadb
-from extract_processor import ExtractProcessor
+from chromadb.errors import NotFoundError
+from src.rag.extract_processor import ExtractProcessor
+from src.rag.keyword_cache import KeywordCache
+from src.rag.pipeline import Pipeline
+from src.rag.embedding_writer import EmbeddingWriter
+from src.rag.bm25 import BM25Index, index_path
+from src.metrics import span
+from src.rag.runtime import get_runtime, bump_generation, read_active, update_active, active_collection, activate_collection, start_build, abandon_build
 import json
+import hashlib
+import threading
+import time
 
 # Configuration
 DATA_PATH = "data/documents"
 DB_PATH = "data/chroma_db"
 MODEL_NAME = "llama3.1"
 COLLECTION_NAME = "espazo_nature"
+MANIFEST_SUFFIX = ".manifest.json"
+PARSE_WORKERS = min(4, os.cpu_count() or 1)  # processes parsing PDF pages
+KEYWORD_CONCURRENCY = 4  # parallel keyword extraction calls to Ollama
+CHUNK_BATCH_SIZE = 32  # chunks per embedding request and per vector store commit
+GC_GRACE_PERIOD = 300  # seconds a retired collection is kept for in-flight readers
 
 
-# Reset database - Erases the collection
-def reset_db(strategy: str):
-    print(f"Resetting database at {DB_PATH} (clearing collection '{strategy}_{COLLECTION_NAME}')...")
-    client = chromadb.PersistentClient(path=DB_PATH)
-    try:
-        client.delete_collection(strategy+"_"+COLLECTION_NAME)
-        print(f"Deleted existing collection '{strategy}_{COLLECTION_NAME}'")
-    except Exception as e:
-        print(f"Collection '{COLLECTION_NAME}' could not be deleted (might not exist): {e}")
+# Garbage collection - Deletes collections retired longer than the grace period ago
+def collect_garbage(grace_period: float = GC_GRACE_PERIOD, db_path: str = None):
+    db_path = db_path or DB_PATH
+    state = read_active(db_path)
+    now = time.time()
+    expired = [r for r in state["retired"] if now - r["retired_at"] >= grace_period]
+    if not expired:
+        return
+    client = chromadb.PersistentClient(path=db_path)
+    for retired in expired:
+        try:
+            client.delete_collection(retired["name"])
+            print(f"Deleted retired collection '{retired['name']}'")
+        except Exception as e:
+            print(f"Retired collection '{retired['name']}' could not be deleted (might not exist): {e}")
+        # The BM25 index holds a full copy of the chunks, so it goes with the collection
+        for path in (manifest_path(retired["name"], db_path), index_path(db_path, retired["name"])):
+            if os.path.exists(path):
+                os.remove(path)
+    # Re-read under the lock so a concurrent switch is not lost
+    expired_names = {r["name"] for r in expired}
+    with update_active(db_path) as state:
+        state["retired"] = [r for r in state["retired"] if r["name"] not in expired_names]
+
+_gc_timer = None
+
+def schedule_garbage_collection(delay: float = None):
+    """
+    Collect garbage once the grace period of a collection retired now has
+    passed, so a server that doesn't re-ingest still deletes it.
+    """
+    global _gc_timer
+    if _gc_timer is not None:
+        _gc_timer.cancel()  # the new run collects everything the old one would have
+    _gc_timer = threading.Timer(GC_GRACE_PERIOD + 1 if delay is None else delay, collect_garbage,
+                                kwargs={"grace_period": GC_GRACE_PERIOD, "db_path": DB_PATH})
+    _gc_timer.daemon = True
+    _gc_timer.start()
 
 def load_documents(format: str = "txt") -> list[Document]:
     print(f"Loading documents from {DATA_PATH}...")
@@ -77,53 +121,50 @@ def semantic_chunking_strategie(docs, embeddings):
     all_splits = text_splitter.split_documents(docs)
     return all_splits
 
-def ingest_docs(clear_db=False, strategy="recursive"):
-    if clear_db:
-        reset_db(strategy)
-
-    embeddings = OllamaEmbeddings(model=MODEL_NAME)
-    vector_store = Chroma(
-        collection_name=strategy+"_"+COLLECTION_NAME,
-        embedding_function=embeddings,
-        persist_directory=DB_PATH
-    )
+#======================
+#= INCREMENTAL INGEST =
+#======================
+def file_hash(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
 
-    llm = ChatOllama(model=MODEL_NAME)
-    extract_processor = ExtractProcessor(llm)
+def manifest_path(collection_name: str, db_path: str = None) -> str:
+    return os.path.join(db_path or DB_PATH, collection_name + MANIFEST_SUFFIX)
 
-    if strategy == "md":
-        docs = load_documents("md")
-    else:
-        docs = load_documents("pdf")
-    assert len(docs) > 0, "No documents loaded"
-    print(f"Loaded {len(docs)} documents.")
+def load_manifest(collection_name: str) -> dict:
+    """Per-file content hash and chunk IDs from the last ingest: {path: {"hash", "chunk_ids"}}"""
+    try:
+        with open(manifest_path(collection_name), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-    # Divide documents into sections by headings
-    print(f"Dividing documents into sections...")
-    docs_processed = []
-    for doc in docs:
-        docs_processed.extend(extract_processor.process_document(doc))
-    print(f"Processed documents into {len(docs_processed)} sections.")
-    for doc in docs_processed:
-        print(doc.metadata['section'])
+def save_manifest(collection_name: str, manifest: dict):
+    os.makedirs(DB_PATH, exist_ok=True)
+    tmp_path = manifest_path(collection_name) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path(collection_name))
 
-    # Chunking process
+def chunk_documents(docs, strategy, embeddings):
     if strategy == "md":
-        all_splits = md_chunking_strategie(docs_processed)
+        return md_chunking_strategie(docs)
     elif strategy == "recursive":
-        all_splits = recursive_chunking_strategie(docs_processed)
+        return recursive_chunking_strategie(docs)
     elif strategy == "semantic":
-        all_splits = semantic_chunking_strategie(docs_processed, embeddings)
-    else:
-        raise ValueError(f"Unknown chunking strategy: {strategy}")
+        return semantic_chunking_strategie(docs, embeddings)
+    raise ValueError(f"Unknown chunking strategy: {strategy}")
 
-    print(f"Split document into {len(all_splits)} sub-documents using {strategy}.")
-
-    # Metadata extraction with LLM
-    print("Extracting keywords for metadata...")
+def add_keywords(splits, extract_processor):
+    with span("ingest", "keywords"):
+        all_keywords = extract_processor.extract_metadata_batch(
+            [doc.page_content for doc in splits], max_concurrency=KEYWORD_CONCURRENCY
+        )
     docs_with_metadata = []
-    for doc in all_splits:
-        keywords = extract_processor.extract_metadata(doc.page_content)
+    for doc, keywords in zip(splits, all_keywords):
         doc.page_content = f"""
         [KEYWORDS]
         {" , ".join(keywords)}
@@ -132,13 +173,197 @@ def ingest_docs(clear_db=False, strategy="recursive"):
         """
         doc.metadata.update({"keywords": json.dumps(keywords)})
         docs_with_metadata.append(doc)
-    
-    print("Added metadata to documents.")
+    return docs_with_metadata
+
+def chunk_id(path: str, digest: str, index: int) -> str:
+    path_key = hashlib.sha1(path.encode()).hexdigest()[:8]
+    return f"{path_key}-{digest[:16]}-{index}"
+
+def chunk_batches(job, strategy, embeddings, batch_size):
+    """
+    Chunk the sections of one file and yield batches of at most `batch_size`
+    chunks with deterministic IDs. Chunks committed before a crash are skipped.
+    The last batch of a file is flagged (and emitted even if empty) so the
+    file can be finalized in the manifest.
+    """
+    print(f"Processing {job['path']}...")
+    batch, ids, index = [], [], 0
+    for section in job["sections"]:
+        section.metadata["source"] = job["path"]
+        print(section.metadata['section'])
+        with span("ingest", "chunk"):
+            splits = chunk_documents([section], strategy, embeddings)
+        for split in splits:
+            if index >= job["committed"]:
+                batch.append(split)
+                ids.append(chunk_id(job["path"], job["digest"], index))
+            index += 1
+            if len(batch) == batch_size:
+                yield {"job": job, "docs": batch, "ids": ids, "last": False}
+                batch, ids = [], []
+    print(f"Split {job['path']} into {len(job['sections'])} sections and {index} sub-documents using {strategy}.")
+    job["total"] = index
+    yield {"job": job, "docs": batch, "ids": ids, "last": True}
+
+def ingest_docs(clear_db=False, strategy="recursive", batch_size=CHUNK_BATCH_SIZE, embeddings=None,
+                extract_processor=None):
+    """
+    Bring the collection in line with DATA_PATH. Only files whose content hash
+    changed since the last run are re-processed; chunks of deleted files are
+    removed. clear_db=True rebuilds everything.
+    Full rebuilds go into a new versioned shadow collection that is switched
+    live only once complete, so readers never see a half-built index.
+
+    Changed files stream through load -> section -> chunk -> keywords -> embed ->
+    upsert stages that run concurrently. Chunks are embedded and committed
+    `batch_size` at a time and recorded in the manifest, so an interrupted run
+    resumes after the last committed batch.
+
+    `embeddings` and `extract_processor` default to the Ollama models (and
+    the on-disk keyword cache); the benchmark passes local stand-ins.
+    """
+    collect_garbage()
+
+    previous = collection_name = active_collection(strategy, DB_PATH)
+    shadow = clear_db or collection_name is None
+    if shadow:
+        # An interrupted build is resumed under its name, from its manifest
+        collection_name = start_build(strategy, DB_PATH)
+        print(f"Building shadow collection '{collection_name}'...")
+    else:
+        abandoned = abandon_build(strategy, DB_PATH)
+        if abandoned:
+            print(f"Retired unfinished shadow collection '{abandoned}'.")
+
+    embeddings = embeddings or OllamaEmbeddings(model=MODEL_NAME)
+    client = chromadb.PersistentClient(path=DB_PATH)
+    # Chunks are embedded by EmbeddingWriter, so the raw collection is used for writes
+    collection = client.get_or_create_collection(collection_name)
+
+    if extract_processor is None:
+        extract_processor = ExtractProcessor(ChatOllama(model=MODEL_NAME), cache=KeywordCache())
+
+    if strategy == "md":
+        docs = load_documents("md")
+    else:
+        docs = load_documents("pdf")
+    if docs:
+        print(f"Loaded {len(docs)} documents.")
+    else:
+        # Still run the deletions below, so removing the last file empties the collection
+        print(f"No documents found in {DATA_PATH}.")
+
+    manifest = load_manifest(collection_name)
+    changed = False
+
+    # Files that disappeared from DATA_PATH
+    for path in [p for p in manifest if p not in docs]:
+        print(f"Removing chunks of deleted file {path}...")
+        stale_ids = list(manifest[path]["chunk_ids"])
+        pending = manifest[path].get("pending")
+        if pending:
+            stale_ids += [chunk_id(path, pending["hash"], i) for i in range(pending["committed"])]
+        if stale_ids:
+            collection.delete(ids=stale_ids)
+        del manifest[path]
+        save_manifest(collection_name, manifest)
+        changed = True
+
+    jobs = []
+    for path in docs:
+        digest = file_hash(path)
+        entry = manifest.setdefault(path, {"hash": None, "chunk_ids": []})
+        pending = entry.get("pending")
+        if entry["hash"] == digest and not pending:
+            print(f"Unchanged: {path}")
+            continue
+        committed = 0
+        if pending and pending["hash"] == digest:
+            committed = pending["committed"]
+            print(f"Resuming {path} after {committed} committed chunks...")
+        elif pending:
+            # Interrupted run on an older version of this file
+            collection.delete(ids=[chunk_id(path, pending["hash"], i) for i in range(pending["committed"])])
+        entry["pending"] = {"hash": digest, "committed": committed}
+        jobs.append({"path": path, "digest": digest, "committed": committed})
+
+    def load_and_section():
+        # Divide changed documents into sections by headings, parsing files and pages in parallel
+        sectioned = extract_processor.process_documents([job["path"] for job in jobs], workers=PARSE_WORKERS)
+        for job in jobs:
+            with span("ingest", "parse"):
+                _, job["sections"] = next(sectioned)
+            yield job
+
+    def keywords(batch):
+        batch["docs"] = add_keywords(batch["docs"], extract_processor) if batch["docs"] else []
+        yield batch
+
+    def commit(batch):
+        # Called once the batch is written to the collection
+        job = batch["job"]
+        entry = manifest[job["path"]]
+        entry["pending"]["committed"] += len(batch["ids"])
+        if batch["last"]:
+            # New chunks are written before the old ones are dropped so readers never see a gap
+            chunk_ids = [chunk_id(job["path"], job["digest"], i) for i in range(job["total"])]
+            new_ids = set(chunk_ids)
+            stale_ids = [i for i in entry["chunk_ids"] if i not in new_ids]
+            if stale_ids:
+                collection.delete(ids=stale_ids)
+            manifest[job["path"]] = {"hash": job["digest"], "chunk_ids": chunk_ids}
+            print(f"Stored {len(chunk_ids)} documents for {job['path']}.")
+        save_manifest(collection_name, manifest)
+
+    chunk_count = lambda batch: len(batch["docs"])
+    pipeline = (
+        Pipeline(load_and_section())
+        .add_stage("chunk", lambda job: chunk_batches(job, strategy, embeddings, batch_size), size=chunk_count)
+        .add_stage("keywords", keywords, size=chunk_count)
+    )
+    # Embeddings already stored in the live collection are reused by a shadow build
+    reuse_from = []
+    if shadow and previous:
+        try:
+            reuse_from = [client.get_collection(previous)]
+        except NotFoundError:
+            # Deleted by hand or already garbage-collected
+            print(f"Previous collection '{previous}' not found, embedding every chunk.")
+    with EmbeddingWriter(embeddings, collection, MODEL_NAME, reuse_from=reuse_from) as writer:
+        for batch in pipeline.run():
+            for written in writer.submit(batch["docs"], batch["ids"], tag=batch):
+                commit(written)
+            changed = True
+        for written in writer.flush():
+            commit(written)
+
+    for name, stats in pipeline.stats.items():
+        rate = stats["items"] / stats["seconds"] if stats["seconds"] else 0.0
+        print(f"{name}: {stats['items']} chunks in {stats['seconds']:.1f}s ({rate:.1f} chunks/s)")
+    writer.log_stats()
+
+    # Keep the lexical index in line with the collection: new chunks are read back
+    # from Chroma, removed ones dropped. A missing or stale index file is repaired here too.
+    bm25_path = index_path(DB_PATH, collection_name)
+    bm25 = BM25Index.load(bm25_path)
+    expected_ids = [i for entry in manifest.values() for i in entry["chunk_ids"]]
+    if changed or set(expected_ids) != set(bm25.docs):
+        bm25.sync(collection, expected_ids)
+        bm25.save(bm25_path)
+        print(f"BM25 index updated ({len(bm25)} chunks).")
+
+    if shadow:
+        generation = activate_collection(strategy, collection_name, DB_PATH)
+        schedule_garbage_collection()
+        print(f"Switched '{strategy}' to collection '{collection_name}' (generation {generation}).")
+    elif changed:
+        bump_generation(DB_PATH)
+    else:
+        print("No document changes, collection is up to date.")
+        return
 
-    # Storing documents
-    print("Storing documents in vector store...")
-    document_ids = vector_store.add_documents(documents=docs_with_metadata)
-    print(f"Stored {len(document_ids)} documents.")
+    # Swap the shared handles so live readers in this process see the new collection
+    get_runtime().reload()
 
 if __name__ == "__main__":
     from langchain_core.globals import set_debug
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from src.metrics import record_cache
+
+# Configuration
+KEYWORD_CACHE_PATH = "data/keyword_cache.sqlite3"
+KEYWORD_CACHE_MAX_SIZE = 50000
+
+
+class KeywordCache:
+    """
+    On-disk cache of parsed keyword lists, addressed by
+    hash(model name, prompt template, chunk text).
+    Least recently used entries are evicted once the cache grows past `max_size`.
+    """
+
+    def __init__(self, path: str = KEYWORD_CACHE_PATH, max_size: int = KEYWORD_CACHE_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS keywords (
+                key TEXT PRIMARY KEY,
+                keywords TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name: str, prompt_template: str, content: str) -> str:
+        sha = hashlib.sha256()
+        for part in (model_name, prompt_template, content):
+            sha.update(part.encode("utf-8"))
+            sha.update(b"\0")
+        return sha.hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT keywords FROM keywords WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                record_cache("keyword", False)
+                return None
+            self._conn.execute("UPDATE keywords SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            record_cache("keyword", True)
+            return json.loads(row[0])
+
+    def set(self, key: str, keywords: list):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO keywords (key, keywords, last_used) VALUES (?, ?, ?)",
+                (key, json.dumps(keywords), time.time()),
+            )
+            overflow = self._conn.execute("SELECT COUNT(*) FROM keywords").fetchone()[0] - self.max_size
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM keywords WHERE key IN (SELECT key FROM keywords ORDER BY last_used LIMIT ?)",
+                    (overflow,),
+                )
+                self.evictions += overflow
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM keywords").fetchone()[0]
+
+    def stats(self) -> dict:
+        size = len(self)
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,157 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Configuration
+MEMORY_TOKEN_BUDGET = 1000  # history tokens sent with each question, summary included
+SUMMARY_TOKEN_BUDGET = 150  # part of the budget kept for the summary of trimmed turns
+SUMMARY_QUESTION_CHARS = 120  # trimmed questions are shortened to this in the summary
+MEMORY_MAX_USERS = 10000  # conversations kept in memory, least recently active evicted first
+MEMORY_IDLE_TTL = 24 * 3600.0  # a conversation idle this long starts over
+MEMORY_PATH = None  # e.g. "data/conversations.sqlite3" to keep conversations across restarts
+
+
+def count_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for budgeting prompts."""
+    return (len(text) + 3) // 4
+
+
+class ConversationMemory:
+    """
+    Recent turns per conversation (keyed by "channel:user_id"), kept under a
+    hard token budget so prompt size stays bounded however long a
+    conversation gets. When the turns outgrow the budget the oldest are
+    dropped and their questions folded into a one-line summary.
+    Conversations idle for `idle_ttl` are forgotten and at most `max_users`
+    are held in memory (LRU). With a `path`, conversations are also stored
+    in SQLite and reloaded on demand.
+    """
+
+    def __init__(self, token_budget: int = MEMORY_TOKEN_BUDGET, summary_budget: int = SUMMARY_TOKEN_BUDGET,
+                 max_users: int = MEMORY_MAX_USERS, idle_ttl: float = MEMORY_IDLE_TTL, path: str = MEMORY_PATH,
+                 clock=time.time):
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.path = path
+        self.clock = clock
+        self.evictions = 0
+        self.trimmed_turns = 0
+        # key -> {"earlier": [question, ...], "turns": [[question, answer], ...], "updated_at": float}
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations (key TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("DELETE FROM conversations WHERE updated_at <= ?", (clock() - idle_ttl,))
+            self._conn.commit()
+
+    def _load(self, key: str):
+        # Caller holds the lock
+        conversation = self._conversations.get(key)
+        if conversation is None and self._conn is not None:
+            row = self._conn.execute("SELECT data FROM conversations WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conversation = json.loads(row[0])
+                self._conversations[key] = conversation
+        if conversation is not None and conversation["updated_at"] <= self.clock() - self.idle_ttl:
+            del self._conversations[key]
+            conversation = None
+        return conversation
+
+    def has_history(self, key: str) -> bool:
+        with self._lock:
+            return self._load(key) is not None
+
+    def history(self, key: str) -> dict:
+        """
+        Agent inputs for the next question: "history" (earlier turns as chat
+        messages, oldest first) and "summary" (older, trimmed questions).
+        Empty dict for a new conversation.
+        """
+        with self._lock:
+            conversation = self._load(key)
+            if conversation is None:
+                return {}
+            self._conversations.move_to_end(key)
+            inputs = {"history": [
+                message
+                for question, answer in conversation["turns"]
+                for message in ({"role": "user", "content": question}, {"role": "assistant", "content": answer})
+            ]}
+            if conversation["earlier"]:
+                inputs["summary"] = "; ".join(conversation["earlier"])
+            return inputs
+
+    def _trim(self, conversation: dict):
+        turns = conversation["turns"]
+        earlier = conversation["earlier"]
+        turn_budget = self.token_budget - self.summary_budget
+        tokens = [count_tokens(q) + count_tokens(a) for q, a in turns]
+        while len(turns) > 1 and sum(tokens) > turn_budget:
+            question, _ = turns.pop(0)
+            tokens.pop(0)
+            earlier.append(question[:SUMMARY_QUESTION_CHARS])
+            self.trimmed_turns += 1
+        if turns and tokens[0] > turn_budget:
+            # A single oversized turn: keep the question, cut the answer
+            question, answer = turns[0]
+            keep = max(0, turn_budget - count_tokens(question)) * 4
+            turns[0] = [question, answer[:keep]]
+        while earlier and count_tokens("; ".join(earlier)) > self.summary_budget:
+            earlier.pop(0)
+
+    def append(self, key: str, question: str, answer: str):
+        """Record a finished turn."""
+        with self._lock:
+            conversation = self._load(key) or {"earlier": [], "turns": []}
+            conversation["turns"].append([question, answer])
+            conversation["updated_at"] = self.clock()
+            self._trim(conversation)
+            self._conversations[key] = conversation
+            self._conversations.move_to_end(key)
+            while len(self._conversations) > self.max_users:
+                self._conversations.popitem(last=False)
+                self.evictions += 1
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO conversations (key, data, updated_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(conversation, ensure_ascii=False), conversation["updated_at"]),
+                )
+                self._conn.commit()
+
+    def clear(self, key: str):
+        with self._lock:
+            self._conversations.pop(key, None)
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM conversations WHERE key = ?", (key,))
+                self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "conversations": len(self._conversations),
+                "evictions": self.evictions,
+                "trimmed_turns": self.trimmed_turns,
+            }
+
+
+_memory = None
+_memory_lock = threading.Lock()
+
+def get_memory() -> ConversationMemory:
+    global _memory
+    if _memory is None:
+        with _memory_lock:
+            if _memory is None:
+                _memory = ConversationMemory()
+    return _memory
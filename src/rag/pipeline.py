@@ -0,0 +1,115 @@
+import queue
+import threading
+import time
+
+# Configuration
+QUEUE_SIZE = 4  # items buffered between two stages
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+class Pipeline:
+    """
+    Streams items from `source` through a chain of stages. Each stage runs in
+    its own thread and maps one input item to any number of output items
+    (a generator function). Stages are connected by bounded queues, so they
+    overlap while at most `queue_size` items wait between any two of them.
+    The first error stops every stage and is re-raised to the consumer.
+    `stats` holds, per stage, the output size produced and the time spent
+    working (time blocked on the queues is not counted).
+
+        for batch in Pipeline(files).add_stage("chunk", chunk).add_stage("keywords", annotate).run():
+            store(batch)
+    """
+
+    def __init__(self, source, queue_size: int = QUEUE_SIZE):
+        self.source = source
+        self.queue_size = queue_size
+        self.stages = []
+        self.stats = {}
+        self._stop = threading.Event()
+
+    def add_stage(self, name: str, fn, size=lambda item: 1):
+        """`size(output)` is how much work an output item counts for in `stats` (e.g. chunks per batch)."""
+        self.stages.append((name, fn, size))
+        self.stats[name] = {"items": 0, "seconds": 0.0}
+        return self
+
+    def _put(self, q, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _run_source(self, out):
+        try:
+            for item in self.source:
+                if not self._put(out, item):
+                    return
+        except BaseException as e:
+            self._put(out, _Failure(e))
+            return
+        self._put(out, _DONE)
+
+    def _run_stage(self, name, fn, size, inq, out):
+        stats = self.stats[name]
+        while True:
+            item = self._get(inq)
+            if item is _DONE or isinstance(item, _Failure):
+                self._put(out, item)
+                return
+            try:
+                results = iter(fn(item))
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        result = next(results)
+                    except StopIteration:
+                        stats["seconds"] += time.perf_counter() - start
+                        break
+                    stats["seconds"] += time.perf_counter() - start
+                    stats["items"] += size(result)
+                    if not self._put(out, result):
+                        return
+            except BaseException as e:
+                self._put(out, _Failure(e))
+                return
+
+    def run(self):
+        """Start all stages and yield the outputs of the last one."""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._run_source, args=(queues[0],), name="pipeline-source", daemon=True)]
+        for i, (name, fn, size) in enumerate(self.stages):
+            threads.append(threading.Thread(
+                target=self._run_stage, args=(name, fn, size, queues[i], queues[i + 1]), name=f"pipeline-{name}", daemon=True
+            ))
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _DONE:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.exc
+                yield item
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
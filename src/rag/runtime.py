@@ -0,0 +1,327 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows: active.json updates are only serialized within one process
+    fcntl = None
+import chromadb
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+from langchain_ollama import OllamaEmbeddings
+from src.rag.cache import TTLCache, normalize_query
+from src.rag.bm25 import BM25Index, index_path
+from src.metrics import record_cache, span
+
+# Configuration
+DB_PATH = "data/chroma_db"
+MODEL_NAME = "llama3.1"
+COLLECTION_NAME = "espazo_nature"
+STRATEGY = "recursive"
+EMBEDDING_CACHE_SIZE = 1024
+EMBEDDING_CACHE_TTL = 3600  # seconds
+ACTIVE_FILE = "active.json"
+POINTER_CHECK_INTERVAL = 1.0  # seconds
+RRF_K = 60  # reciprocal-rank fusion constant
+LEXICAL_MARGIN = 1.5  # BM25 lead over the runner-up needed to skip the vector query
+
+
+#===========================
+#= ACTIVE COLLECTION POINTER=
+#===========================
+# active.json holds the ingest generation, the live collection of each chunking
+# strategy, the shadow collections being built (and by which process) and the
+# collections retired by a switch (deleted after a grace period):
+# {"generation": 3, "collections": {"recursive": "recursive_espazo_nature_v3"},
+#  "building": {"md": {"name": "md_espazo_nature_v4", "pid": 4242}},
+#  "retired": [{"name": "recursive_espazo_nature_v2", "retired_at": 1700000000.0}]}
+
+def read_active(db_path: str = DB_PATH) -> dict:
+    try:
+        with open(os.path.join(db_path, ACTIVE_FILE), "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    state.setdefault("generation", 0)
+    state.setdefault("collections", {})
+    state.setdefault("building", {})
+    state.setdefault("retired", [])
+    return state
+
+def write_active(state: dict, db_path: str = DB_PATH):
+    # Write to a temp file and rename, so readers only ever see a complete pointer
+    os.makedirs(db_path, exist_ok=True)
+    tmp_path = os.path.join(db_path, ACTIVE_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, os.path.join(db_path, ACTIVE_FILE))
+
+_active_lock = threading.Lock()
+
+@contextmanager
+def update_active(db_path: str = DB_PATH):
+    """
+    Read-modify-write active.json: yields the current state and writes it back
+    when the block exits (not if it raises). Holds an exclusive lock on
+    active.json.lock for the whole block, so the ingest CLI and the server's
+    watcher can't overwrite each other's switches or retired entries.
+    """
+    os.makedirs(db_path, exist_ok=True)
+    with _active_lock, open(os.path.join(db_path, ACTIVE_FILE + ".lock"), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            state = read_active(db_path)
+            yield state
+            write_active(state, db_path)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def legacy_collection(strategy: str = STRATEGY) -> str:
+    """Name of the unversioned collection `strategy` was ingested into before active.json existed."""
+    return strategy + "_" + COLLECTION_NAME
+
+def read_generation(db_path: str = DB_PATH) -> int:
+    """Ingest generation of the collection on disk (0 if never ingested)."""
+    return read_active(db_path)["generation"]
+
+def bump_generation(db_path: str = DB_PATH) -> int:
+    """Record that the collection was rebuilt. Caches tagged with older generations become stale."""
+    with update_active(db_path) as state:
+        state["generation"] += 1
+    return state["generation"]
+
+def active_collection(strategy: str = STRATEGY, db_path: str = DB_PATH):
+    """Name of the live collection for `strategy`, or None if none was activated yet."""
+    return read_active(db_path)["collections"].get(strategy)
+
+def activate_collection(strategy: str, collection_name: str, db_path: str = DB_PATH) -> int:
+    """
+    Point `strategy` at `collection_name` in one atomic write and bump the
+    generation. The previously active collection (the unversioned legacy one
+    on the first switch) is queued for garbage collection.
+    """
+    with update_active(db_path) as state:
+        previous = state["collections"].get(strategy) or legacy_collection(strategy)
+        if previous != collection_name:
+            state["retired"].append({"name": previous, "retired_at": time.time()})
+        if state["building"].get(strategy, {}).get("name") == collection_name:
+            del state["building"][strategy]
+        state["collections"][strategy] = collection_name
+        state["generation"] += 1
+    return state["generation"]
+
+def start_build(strategy: str, db_path: str = DB_PATH) -> str:
+    """
+    Name of the shadow collection to build for `strategy`, recorded in
+    active.json as being built by this process. An unfinished build is
+    resumed under its name; otherwise a new version is started.
+    """
+    with update_active(db_path) as state:
+        build = state["building"].get(strategy)
+        name = build["name"] if build else f"{legacy_collection(strategy)}_v{state['generation'] + 1}"
+        state["building"][strategy] = {"name": name, "pid": os.getpid()}
+    return name
+
+def _process_alive(pid: int) -> bool:
+    if os.name == "nt":
+        return True  # os.kill would terminate it; keep the build rather than guess
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def abandon_build(strategy: str, db_path: str = DB_PATH):
+    """
+    Retire the shadow build of `strategy` unless another live process is
+    running it, so a crashed or failed full rebuild is garbage-collected
+    instead of orphaned. Ingests within one process run one at a time (the
+    watcher holds its ingest lock), so a build recorded by this process is
+    no longer running. Returns the retired collection name, or None.
+    """
+    build = read_active(db_path)["building"].get(strategy)
+    if build is None or (build["pid"] != os.getpid() and _process_alive(build["pid"])):
+        return None
+    with update_active(db_path) as state:
+        if state["building"].get(strategy) != build:
+            return None
+        del state["building"][strategy]
+        state["retired"].append({"name": build["name"], "retired_at": time.time()})
+    return build["name"]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding client and caches query embeddings by normalized text.
+    Document embeddings are passed through untouched.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: TTLCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_query(self, text: str) -> list[float]:
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        record_cache("embedding", vector is not None)
+        if vector is None:
+            with span("answer", "embed"):
+                vector = self.embeddings.embed_query(text)
+            self.cache.set(key, vector)
+        return vector
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+
+class RetrievalRuntime:
+    """
+    Process-wide retrieval handles: one embedding client, one Chroma client and
+    one vector store. Handles are built lazily and replaced as a whole on reload,
+    so readers always see a consistent (embeddings, vector store) pair.
+    The active collection pointer is re-checked every POINTER_CHECK_INTERVAL
+    seconds, so a switch made by another process is picked up without a restart.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, model_name: str = MODEL_NAME, strategy: str = STRATEGY,
+                 embeddings=None):
+        self.db_path = db_path
+        self.model_name = model_name
+        self.strategy = strategy
+        self.collection_name = None
+        self.generation = 0
+        self._pointer_mtime = None
+        self._next_pointer_check = 0.0
+        self._resolve_collection()
+        self.base_embeddings = embeddings  # None: Ollama embeddings for model_name
+        self.embedding_cache = TTLCache(max_size=EMBEDDING_CACHE_SIZE, ttl=EMBEDDING_CACHE_TTL)
+        self._lock = threading.Lock()
+        self._embeddings = None
+        self._client = None
+        self._vectorstore = None
+        self._bm25 = None
+
+    def _build(self):
+        embeddings = self._embeddings or CachedEmbeddings(
+            self.base_embeddings or OllamaEmbeddings(model=self.model_name), self.embedding_cache
+        )
+        client = self._client or chromadb.PersistentClient(path=self.db_path)
+        vectorstore = Chroma(
+            collection_name=self.collection_name,
+            embedding_function=embeddings,
+            client=client,
+        )
+        return embeddings, client, vectorstore
+
+    def _resolve_collection(self):
+        state = read_active(self.db_path)
+        # Collections ingested before versioning have no pointer
+        self.collection_name = state["collections"].get(self.strategy) or legacy_collection(self.strategy)
+        self.generation = state["generation"]
+
+    def _follow_pointer(self):
+        now = time.monotonic()
+        if now < self._next_pointer_check:
+            return
+        self._next_pointer_check = now + POINTER_CHECK_INTERVAL
+        try:
+            mtime = os.stat(os.path.join(self.db_path, ACTIVE_FILE)).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._pointer_mtime:
+            self._pointer_mtime = mtime
+            if read_generation(self.db_path) != self.generation:
+                self.reload()
+
+    @property
+    def embeddings(self):
+        return self.get_vectorstore().embeddings
+
+    def get_vectorstore(self) -> Chroma:
+        self._follow_pointer()
+        vectorstore = self._vectorstore
+        if vectorstore is not None:
+            return vectorstore
+        with self._lock:
+            if self._vectorstore is None:
+                self._embeddings, self._client, self._vectorstore = self._build()
+            return self._vectorstore
+
+    def warmup(self):
+        """Open the handles and load the BM25 index now instead of on the first question."""
+        self.get_vectorstore()
+        self.get_bm25()
+
+    def reload(self):
+        """
+        Swap in a fresh vector store handle after the collection was rebuilt or
+        the active collection pointer moved. The new handle is fully built
+        before it replaces the old one.
+        Cached query embeddings are dropped with the old collection.
+        """
+        with self._lock:
+            self.embedding_cache.clear()
+            self._resolve_collection()
+            self._bm25 = None
+            if self._vectorstore is not None:
+                self._embeddings, self._client, self._vectorstore = self._build()
+        print(f"Retrieval runtime reloaded (generation {self.generation}).")
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs):
+        with span("answer", "vector_search"):
+            return self.get_vectorstore().similarity_search(query, k=k, **kwargs)
+
+    def get_bm25(self) -> BM25Index:
+        self._follow_pointer()
+        bm25 = self._bm25
+        if bm25 is not None:
+            return bm25
+        with self._lock:
+            if self._bm25 is None:
+                self._bm25 = BM25Index.load(index_path(self.db_path, self.collection_name))
+            return self._bm25
+
+    def hybrid_search(self, query: str, k: int = 4):
+        """
+        BM25 over chunk text and keywords fused with vector search by reciprocal rank.
+        When the best BM25 hit has every query term among its keywords and clearly
+        leads the runner-up, it is returned without a vector query.
+        """
+        bm25 = self.get_bm25()
+        with span("answer", "bm25_search"):
+            lexical = bm25.search(query, k=2 * k)
+        if lexical and bm25.covers_query(lexical[0][0], query):
+            runner_up = lexical[1][1] if len(lexical) > 1 else 0.0
+            if lexical[0][1] >= LEXICAL_MARGIN * runner_up:
+                return [bm25.document(doc_id) for doc_id, _ in lexical[:k]]
+
+        semantic = self.similarity_search(query, k=2 * k)
+        scores = {}
+        docs = {}
+        for rank, doc in enumerate(semantic):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+            docs[key] = doc
+        for rank, (doc_id, _) in enumerate(lexical):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+            docs.setdefault(doc_id, bm25.document(doc_id))
+        ranked = sorted(scores, key=lambda key: scores[key], reverse=True)
+        return [docs[key] for key in ranked[:k]]
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+def get_runtime() -> RetrievalRuntime:
+    global _runtime
+    if _runtime is None:
+        with _runtime_lock:
+            if _runtime is None:
+                _runtime = RetrievalRuntime()
+    return _runtime
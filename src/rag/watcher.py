@@ -4,7 +4,6 @@ import os
 import threading
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from src.rag.ingest import ingest_docs
 
 # Debounce time in seconds
 DEBOUNCE_DELAY = 2.0
@@ -51,7 +50,8 @@ class IngestHandler(FileSystemEventHandler):
         with self.ingest_lock:
             print("\nChange detected in documents. Reloading database...")
             try:
-                ingest_docs(clear_db=True)
+                from src.rag.ingest import ingest_docs  # heavy; the app imports this module at startup
+                ingest_docs()
                 print("Database reload complete.\n")
             except Exception as e:
                 print(f"Error reloading database: {e}")
@@ -0,0 +1,39 @@
+from src.rag.answer_cache import SemanticAnswerCache
+
+def test_near_duplicate_question_hits_cache(tmp_path):
+    cache = SemanticAnswerCache(path=str(tmp_path / "answers.sqlite3"), max_distance=0.05)
+    cache.store("What is the price?", [1.0, 0.0, 0.0], "en", 1, "50 euros per night.")
+
+    assert cache.lookup([0.99, 0.05, 0.0], "en", 1) == "50 euros per night."
+    assert cache.lookup([0.0, 1.0, 0.0], "en", 1) is None
+    assert cache.stats()["hits"] == 1
+
+def test_language_must_match(tmp_path):
+    cache = SemanticAnswerCache(path=str(tmp_path / "answers.sqlite3"))
+    cache.store("precio", [1.0, 0.0], "es", 1, "50 euros la noche.")
+
+    assert cache.lookup([1.0, 0.0], "en", 1) is None
+    assert cache.lookup([1.0, 0.0], "es", 1) == "50 euros la noche."
+
+def test_new_generation_invalidates_entries(tmp_path):
+    cache = SemanticAnswerCache(path=str(tmp_path / "answers.sqlite3"))
+    cache.store("wifi?", [1.0, 0.0], "en", 1, "Yes, free wifi.")
+
+    assert cache.lookup([1.0, 0.0], "en", 2) is None
+    assert cache.lookup([1.0, 0.0], "en", 1) is None
+
+def test_entries_survive_restart(tmp_path):
+    path = str(tmp_path / "answers.sqlite3")
+    SemanticAnswerCache(path=path).store("wifi?", [1.0, 0.0], "en", 4, "Yes, free wifi.")
+
+    assert SemanticAnswerCache(path=path).lookup([1.0, 0.0], "en", 4) == "Yes, free wifi."
+
+def test_size_cap_evicts_oldest(tmp_path):
+    cache = SemanticAnswerCache(path=str(tmp_path / "answers.sqlite3"), max_size=2)
+    cache.store("a", [1.0, 0.0, 0.0], "en", 1, "A")
+    cache.store("b", [0.0, 1.0, 0.0], "en", 1, "B")
+    cache.store("c", [0.0, 0.0, 1.0], "en", 1, "C")
+
+    assert cache.lookup([1.0, 0.0, 0.0], "en", 1) is None
+    assert cache.lookup([0.0, 0.0, 1.0], "en", 1) == "C"
+    assert cache.stats()["size"] == 2
@@ -1,7 +1,10 @@
 from fastapi.testclient import TestClient
 from src.api.main import app
+from src.api.dedupe import MessageDeduper
+from src.rag.memory import ConversationMemory
 import os
-from unittest.mock import patch
+import pytest
+from unittest.mock import AsyncMock, patch
 
 client = TestClient(app)
 
@@ -11,6 +14,20 @@ os.environ["WHATSAPP_API_TOKEN"] = "mock_token"
 os.environ["WHATSAPP_PHONE_NUMBER_ID"] = "mock_id"
 os.environ["INSTAGRAM_ACCESS_TOKEN"] = "mock_token"
 
+@pytest.fixture(autouse=True)
+def deduper():
+    # In memory, so tests don't write to data/
+    deduper = MessageDeduper(path=None)
+    with patch("src.api.whatsapp.get_deduper", return_value=deduper), \
+         patch("src.api.instagram.get_deduper", return_value=deduper):
+        yield deduper
+
+@pytest.fixture(autouse=True)
+def memory():
+    memory = ConversationMemory()
+    with patch("src.api.workers.get_memory", return_value=memory):
+        yield memory
+
 def test_whatsapp_verification():
     # Test correct token
     response = client.get("/whatsapp/webhook", params={
@@ -40,10 +57,10 @@ def test_instagram_verification():
     assert response.text == "67890"
 
 @patch("src.api.whatsapp.ask_question")
-@patch("src.api.whatsapp.requests.post")
-def test_whatsapp_message_handling(mock_post, mock_ask):
+@patch("src.api.whatsapp.get_outbox")
+def test_whatsapp_message_handling(mock_outbox, mock_ask):
     mock_ask.return_value = "This is a mock answer."
-    mock_post.return_value.status_code = 200
+    mock_outbox.return_value.put = AsyncMock()
 
     payload = {
         "object": "whatsapp_business_account",
@@ -62,12 +79,13 @@ def test_whatsapp_message_handling(mock_post, mock_ask):
 
     response = client.post("/whatsapp/webhook", json=payload)
     assert response.status_code == 200
+    mock_outbox.return_value.put.assert_awaited_with("whatsapp", "123456789", "This is a mock answer.")
 
 @patch("src.api.instagram.ask_question")
-@patch("src.api.instagram.requests.post")
-def test_instagram_message_handling(mock_post, mock_ask):
+@patch("src.api.instagram.get_outbox")
+def test_instagram_message_handling(mock_outbox, mock_ask):
     mock_ask.return_value = "This is a mock answer."
-    mock_post.return_value.status_code = 200
+    mock_outbox.return_value.put = AsyncMock()
 
     payload = {
         "object": "instagram",
@@ -81,3 +99,344 @@ def test_instagram_message_handling(mock_post, mock_ask):
 
     response = client.post("/instagram/webhook", json=payload)
     assert response.status_code == 200
+    mock_outbox.return_value.put.assert_awaited_with("instagram", "987654321", "This is a mock answer.")
+
+@patch("src.api.main.get_executor")
+def test_chat_returns_retry_after_when_queue_is_full(mock_get_executor):
+    from src.api.workers import QueueFullError
+
+    async def run(*args, **kwargs):
+        raise QueueFullError("Server busy, try again later", 503, 7)
+    mock_get_executor.return_value.run = run
+
+    response = client.post("/chat", json={"message": "Hola"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
+
+@patch("src.api.main.get_executor")
+def test_anonymous_chat_callers_get_a_queue_quota_per_address(mock_get_executor):
+    import asyncio
+    import httpx
+    queued_as = []
+
+    async def run(*args, user_id, **kwargs):
+        queued_as.append(user_id)
+        return "Answer"
+    mock_get_executor.return_value.run = run
+
+    async def post(address, payload):
+        transport = httpx.ASGITransport(app=app, client=(address, 5000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await http.post("/chat", json=payload)
+
+    for address, payload in [("10.0.0.1", {"message": "Hola"}), ("10.0.0.2", {"message": "Hola"}),
+                             ("10.0.0.2", {"message": "Hola", "user_id": "ana"})]:
+        assert asyncio.run(post(address, payload)).status_code == 200
+    assert queued_as == ["guest:10.0.0.1", "guest:10.0.0.2", "ana"]
+
+@patch("src.api.main.ask_question")
+def test_chat_runs_on_worker_pool_without_blocking_health(mock_ask):
+    import asyncio
+    import threading
+    import httpx
+    release = threading.Event()
+    mock_ask.side_effect = lambda message, language: release.wait(5) and "Answer"
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            chat = asyncio.create_task(http.post("/chat", json={"message": "Hola"}))
+            await asyncio.sleep(0.05)
+            # Same event loop: /health answers while the generation is still running
+            health = await asyncio.wait_for(http.get("/health"), timeout=2)
+            assert not chat.done()
+            release.set()
+            return health, await chat
+
+    health, chat = asyncio.run(scenario())
+    assert health.status_code == 200
+    assert chat.json() == {"response": "Answer"}
+
+@patch("src.api.main.close_graph_client", new_callable=AsyncMock)
+@patch("src.api.main.shutdown_executor")
+@patch("src.api.main.get_outbox")
+@patch("src.api.main.start_rag")
+def test_failed_rag_startup_is_logged_and_shutdown_still_runs(mock_start_rag, mock_outbox, mock_shutdown_executor,
+                                                              mock_close_graph_client, caplog):
+    mock_start_rag.side_effect = ImportError("No module named 'fitz'")
+    mock_outbox.return_value.stop = AsyncMock()
+
+    with TestClient(app) as lifespan_client:
+        assert lifespan_client.get("/health").status_code == 200
+
+    assert "No module named 'fitz'" in caplog.text
+    mock_outbox.return_value.stop.assert_awaited_once()
+    mock_shutdown_executor.assert_called_once()
+    mock_close_graph_client.assert_awaited_once()
+
+@patch("src.api.main.get_deduper")
+@patch("src.api.main.get_outbox")
+@patch("src.api.main.ask_question")
+def test_metrics_exposes_stage_latency_and_queue_gauges(mock_ask, mock_outbox, mock_deduper):
+    mock_ask.return_value = "Answer"
+    mock_outbox.return_value.depth.return_value = 4
+    mock_outbox.return_value.failed = 1
+    mock_deduper.return_value.duplicates = 2
+    assert client.post("/chat", json={"message": "Metrics?"}).status_code == 200
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert "# TYPE faq_stage_seconds histogram" in text
+    assert 'faq_stage_seconds_count{path="answer",stage="queue_wait"}' in text
+    assert "faq_answer_queue_depth 0" in text
+    assert "faq_outbox_depth 4" in text
+    assert "faq_outbox_failed_total 1" in text
+    assert "faq_webhook_duplicates_total 2" in text
+
+@patch("src.api.main.ask_question")
+def test_profiled_chat_trace_is_served_on_debug_endpoints(mock_ask, monkeypatch):
+    from src import profiling
+    monkeypatch.setattr(profiling, "_trace_buffer", profiling.TraceBuffer())
+    mock_ask.return_value = "Answer"
+
+    assert client.get("/debug/traces").status_code == 404  # no DEBUG_TOKEN: no debug endpoints
+    monkeypatch.setenv("DEBUG_TOKEN", "debug-secret")
+    assert client.get("/debug/traces", headers={"X-Debug-Token": "wrong"}).status_code == 404
+
+    client.post("/chat", json={"message": "Unprofiled"})
+    client.post("/chat", json={"message": "Why so slow?", "user_id": "ana"}, headers={"X-Profile": "1"})
+
+    headers = {"X-Debug-Token": "debug-secret"}
+    [summary] = client.get("/debug/traces", headers=headers).json()["traces"]
+    assert summary["name"] == "chat"
+    assert summary["attrs"] == {"user_id": "ana", "question": "Why so slow?"}
+    trace = client.get(f"/debug/traces/{summary['id']}", headers=headers).json()
+    assert trace["spans"]["children"][0]["name"] == "queue_wait"
+    assert client.get("/debug/traces/missing", headers=headers).status_code == 404
+    export = client.get("/debug/traces/export", headers=headers)
+    assert export.headers["content-type"] == "application/x-ndjson"
+    assert len(export.text.splitlines()) == 1
+
+def parse_sse(body):
+    import json
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+@patch("src.api.main.stream_question")
+def test_chat_stream_sends_tokens_then_timings(mock_stream):
+    mock_stream.side_effect = lambda message, language, conversation: iter(["Hola", ", ", "mundo"])
+
+    response = client.post("/chat/stream", json={"message": "Hola"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    assert [data["token"] for kind, data in events if kind == "token"] == ["Hola", ", ", "mundo"]
+    kind, done = events[-1]
+    assert kind == "done"
+    assert 0 <= done["time_to_first_token"] <= done["total_time"]
+
+@patch("src.api.main.stream_question")
+def test_chat_stream_stops_generation_when_client_disconnects(mock_stream):
+    import asyncio
+    import threading
+    from unittest.mock import MagicMock
+    from src.api.main import chat_stream_endpoint, ChatRequest
+    release = threading.Event()
+    closed = threading.Event()
+    produced = []
+
+    def tokens(message, language, conversation):
+        try:
+            for token in ["first", "second", "third"]:
+                produced.append(token)
+                yield token
+                release.wait(5)
+        finally:
+            closed.set()
+    mock_stream.side_effect = tokens
+
+    async def scenario():
+        http_request = MagicMock()
+        async def is_disconnected():
+            return True
+        http_request.is_disconnected = is_disconnected
+        response = await chat_stream_endpoint(ChatRequest(message="Hola"), http_request)
+        body = response.body_iterator
+        first = await body.__anext__()
+        remaining = [chunk async for chunk in body]
+        release.set()
+        return first, remaining
+
+    first, remaining = asyncio.run(scenario())
+    assert '"first"' in first
+    assert remaining == []
+    assert closed.wait(5)
+    assert produced == ["first", "second"]
+
+@patch("src.api.main.stream_question")
+def test_chat_stream_reports_an_error_when_the_stream_cannot_start(mock_stream):
+    mock_stream.side_effect = RuntimeError("vector store unavailable")
+
+    response = client.post("/chat/stream", json={"message": "Hola"})
+
+    assert parse_sse(response.text) == [("error", {"detail": "vector store unavailable"})]
+
+@patch("src.api.whatsapp.get_outbox")
+@patch("src.api.whatsapp.get_executor")
+@patch("src.api.whatsapp.ask_question")
+def test_whatsapp_batched_payload_answers_every_message(mock_ask, mock_get_executor, mock_outbox):
+    import asyncio
+    import time
+    from src.api.whatsapp import process_whatsapp_message
+    from src.api.workers import AnswerExecutor
+    executor = AnswerExecutor(workers=3)
+    mock_get_executor.return_value = executor
+    mock_outbox.return_value.put = AsyncMock()
+    spans = {}
+
+    def answer(text, language, conversation=None):
+        start = time.perf_counter()
+        time.sleep(0.1)
+        spans[text] = (start, time.perf_counter())
+        return f"re: {text}"
+    mock_ask.side_effect = answer
+
+    text = lambda sender, body: {"from": sender, "type": "text", "text": {"body": body}}
+    payload = {"entry": [
+        {"changes": [
+            {"value": {"messages": [text("alice", "first"), text("bob", "hello")]}},
+            {"value": {"statuses": [{"id": "wamid.1", "status": "read"}]}},
+        ]},
+        {"changes": [{"value": {"messages": [text("alice", "second")]}}]},
+    ]}
+
+    asyncio.run(process_whatsapp_message(payload))
+    executor.shutdown()
+
+    sent = [call.args for call in mock_outbox.return_value.put.await_args_list]
+    assert sorted(sent) == sorted([("whatsapp", "alice", "re: first"), ("whatsapp", "alice", "re: second"),
+                                   ("whatsapp", "bob", "re: hello")])
+    assert [s for s in sent if s[1] == "alice"] == [("whatsapp", "alice", "re: first"), ("whatsapp", "alice", "re: second")]
+    # Alice's messages run in order; Bob is answered alongside Alice's first one
+    assert spans["first"][1] <= spans["second"][0]
+    assert spans["hello"][0] < spans["first"][1]
+
+@patch("src.api.instagram.get_outbox")
+@patch("src.api.instagram.ask_question")
+def test_instagram_batched_payload_answers_every_entry(mock_ask, mock_outbox):
+    import asyncio
+    from src.api.instagram import process_instagram_message
+    mock_ask.side_effect = lambda text, language, conversation=None: f"re: {text}"
+    mock_outbox.return_value.put = AsyncMock()
+
+    event = lambda sender, body: {"sender": {"id": sender}, "message": {"text": body}}
+    payload = {"entry": [
+        {"messaging": [event("carol", "one"), {"sender": {"id": "carol"}, "read": {"mid": "m1"}}]},
+        {"messaging": [event("dave", "two"), event("carol", "three")]},
+    ]}
+
+    asyncio.run(process_instagram_message(payload))
+
+    sent = [call.args for call in mock_outbox.return_value.put.await_args_list]
+    assert sorted(sent) == [("instagram", "carol", "re: one"), ("instagram", "carol", "re: three"),
+                            ("instagram", "dave", "re: two")]
+    assert [s for s in sent if s[1] == "carol"] == [("instagram", "carol", "re: one"), ("instagram", "carol", "re: three")]
+
+def test_sender_order_holds_across_payloads():
+    import asyncio
+    from src.api.utils import process_in_sender_order, _sender_locks
+    handled = []
+
+    async def handle(event):
+        await asyncio.sleep(event["delay"])
+        handled.append(event["name"])
+
+    async def scenario():
+        first = asyncio.create_task(process_in_sender_order([("erin", {"name": "erin-1", "delay": 0.05})], handle))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(process_in_sender_order([("erin", {"name": "erin-2", "delay": 0.0}),
+                                                              ("frank", {"name": "frank-1", "delay": 0.0})], handle))
+        await asyncio.gather(first, second)
+
+    asyncio.run(scenario())
+
+    assert handled == ["frank-1", "erin-1", "erin-2"]
+    assert _sender_locks == {}
+
+@patch("src.api.whatsapp.get_outbox")
+@patch("src.api.whatsapp.ask_question")
+def test_whatsapp_redelivered_message_is_answered_once(mock_ask, mock_outbox, deduper):
+    mock_ask.return_value = "Once."
+    mock_outbox.return_value.put = AsyncMock()
+    message = {"id": "wamid.ABC", "from": "123", "type": "text", "text": {"body": "Hola"}}
+    payload = {"entry": [{"changes": [{"value": {"messages": [message, message]}}]}]}
+
+    client.post("/whatsapp/webhook", json=payload)
+    client.post("/whatsapp/webhook", json=payload)
+
+    assert mock_ask.call_count == 1
+    assert mock_outbox.return_value.put.await_count == 1
+    assert deduper.stats()["duplicates"] == 3
+
+@patch("src.api.whatsapp.get_outbox")
+@patch("src.api.whatsapp.ask_question")
+def test_whatsapp_redelivery_of_a_failed_message_is_answered(mock_ask, mock_outbox, deduper):
+    mock_ask.side_effect = [RuntimeError("model unavailable"), "Now."]
+    mock_outbox.return_value.put = AsyncMock()
+    message = {"id": "wamid.DEF", "from": "124", "type": "text", "text": {"body": "Hola?"}}
+    payload = {"entry": [{"changes": [{"value": {"messages": [message]}}]}]}
+
+    client.post("/whatsapp/webhook", json=payload)
+    client.post("/whatsapp/webhook", json=payload)
+
+    assert mock_ask.call_count == 2
+    mock_outbox.return_value.put.assert_awaited_once_with("whatsapp", "124", "Now.")
+    assert deduper.stats()["duplicates"] == 0
+
+@patch("src.api.instagram.get_outbox")
+@patch("src.api.instagram.ask_question")
+def test_instagram_redelivered_message_is_answered_once(mock_ask, mock_outbox):
+    mock_ask.return_value = "Once."
+    mock_outbox.return_value.put = AsyncMock()
+    payload = {"entry": [{"messaging": [{"sender": {"id": "987"}, "message": {"mid": "m_1", "text": "Hola"}}]}]}
+
+    client.post("/instagram/webhook", json=payload)
+    client.post("/instagram/webhook", json=payload)
+
+    assert mock_ask.call_count == 1
+
+def test_opening_questions_are_shared_and_recorded_per_conversation(memory):
+    import asyncio
+    import threading
+    from src.api.workers import AnswerExecutor, answer_in_conversation
+    executor = AnswerExecutor(workers=1)
+    release = threading.Event()
+    calls = []
+
+    def ask(question, language, conversation=None):
+        calls.append((question, conversation))
+        release.wait(5)
+        return f"re: {question}"
+
+    async def scenario():
+        first = [asyncio.create_task(answer_in_conversation(executor, ask, "Wifi?", conversation=f"whatsapp:{user}",
+                                                            channel="whatsapp", user_id=user))
+                 for user in ["ana", "ben"]]
+        await asyncio.sleep(0.05)
+        release.set()
+        await asyncio.gather(*first)
+        return await answer_in_conversation(executor, ask, "Is it free?", conversation="whatsapp:ana",
+                                            channel="whatsapp", user_id="ana")
+
+    asyncio.run(scenario())
+    executor.shutdown()
+
+    # One generation for both opening questions, then the follow-up runs with Ana's history
+    assert calls == [("Wifi?", None), ("Is it free?", "whatsapp:ana")]
+    assert memory.history("whatsapp:ben")["history"][1] == {"role": "assistant", "content": "re: Wifi?"}
@@ -0,0 +1,75 @@
+import json
+from unittest.mock import patch
+import fitz
+import pytest
+from src import benchmark
+from src.benchmark import HashEmbeddings, matches, parse_case, percentile, run_benchmark
+
+SECTIONS = [
+    ("ALOJAMIENTO", "Cabanas", "The wooden cabins have a double bed, a private bathroom and heating."),
+    ("ALOJAMIENTO", "Tiendas", "Safari tents sleep four guests and include a small terrace."),
+    ("SERVICIOS", "Desayuno", "Breakfast is served from eight to eleven with local bread and cheese."),
+    ("SERVICIOS", "Mascotas", "Dogs are welcome in the tents for a small cleaning fee."),
+]
+
+@pytest.fixture
+def benchmark_env(tmp_path, monkeypatch):
+    docs = tmp_path / "documents"
+    docs.mkdir()
+    pdf = fitz.open()
+    for chapter, section, body in SECTIONS:
+        page = pdf.new_page()
+        page.insert_text((50, 50), chapter, fontsize=24)
+        page.insert_text((50, 90), section, fontsize=18)
+        page.insert_text((50, 120), body, fontsize=11)
+    pdf.save(str(docs / "brochure.pdf"))
+
+    cases = [
+        {"question": "Is breakfast served with local bread?", "expected": {"section": "Desayuno"}},
+        {"question": "Are dogs welcome?", "expected": {"section": "mascotas", "page": 3}},
+        {"question": "How many guests sleep in a safari tent?", "expected": [{"section": "Tiendas"}]},
+    ]
+    (tmp_path / "faq.jsonl").write_text("\n".join(json.dumps(c) for c in cases) + "\nWhere is the glamping?\n")
+    monkeypatch.setattr("src.utils.BENCHMARK_DIR", str(tmp_path))
+    # Ingest would reload the process-wide runtime at the end
+    with patch("src.rag.ingest.get_runtime"):
+        yield str(docs)
+
+def test_hash_embeddings_are_deterministic_and_normalized():
+    embeddings = HashEmbeddings(dim=64)
+    first, second = embeddings.embed_documents(["Cabañas de madera", "Desayuno local"])
+    assert first == embeddings.embed_query("Cabañas de madera")
+    assert first != second
+    assert sum(v * v for v in first) == pytest.approx(1.0)
+
+def test_parse_case_and_matches():
+    assert parse_case("Where is it?") == {"question": "Where is it?", "expected": []}
+    assert parse_case('{"question": "Wifi?", "expected": {"page": 2}}') == {"question": "Wifi?", "expected": [{"page": 2}]}
+    assert matches({"section": "Cabañas", "page": 1}, {"section": "cabanas"})
+    assert not matches({"section": "Cabañas", "page": 1}, {"section": "Cabañas", "page": 2})
+    assert percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.0
+    assert percentile([1.0, 2.0, 3.0, 4.0], 99) == 4.0
+
+def test_benchmark_reports_metrics_per_strategy_and_mode(benchmark_env, tmp_path):
+    results = run_benchmark("faq.jsonl", docs_path=benchmark_env, strategies=["recursive"], k=2)
+
+    assert results["questions"] == 4
+    recursive = results["strategies"]["recursive"]
+    assert recursive["chunks"] == len(SECTIONS)
+    assert recursive["index_bytes"] > 0
+    assert recursive["ingest_seconds"] > 0
+    assert set(recursive["modes"]) == {"vector", "bm25", "hybrid"}
+    for scores in recursive["modes"].values():
+        assert scores["judged_questions"] == 3
+        assert set(scores["latency_ms"]) == {"p50", "p95", "p99"}
+    # Every question shares its distinctive words with one section only
+    assert recursive["modes"]["bm25"]["recall@2"] == 1.0
+    assert recursive["modes"]["hybrid"]["mrr"] > 0.5
+    # Ingest points back at the real database once the scratch one is gone
+    assert benchmark.ingest.DB_PATH == "data/chroma_db"
+    assert not any(tmp_path.glob("**/chroma_db"))
+
+def test_failing_strategy_is_reported(benchmark_env):
+    results = run_benchmark("faq.jsonl", docs_path=benchmark_env, strategies=["md"])
+    # md ingests markdown files and the folder only holds a PDF
+    assert "error" in results["strategies"]["md"]
@@ -0,0 +1,49 @@
+import json
+from src.rag.bm25 import BM25Index, tokenize
+
+def build_index():
+    index = BM25Index()
+    index.add(
+        ["wifi", "checkin", "prices"],
+        ["The wifi is free in every dome.", "Check-in starts at 16:00 at reception.", "Prices per night in summer and winter."],
+        [{"keywords": json.dumps(["wifi", "internet"])}, {"keywords": json.dumps(["check-in", "horario"])}, {"keywords": json.dumps(["precio", "tarifas"])}],
+    )
+    return index
+
+def test_tokenize_normalizes_and_drops_stopwords():
+    assert tokenize("¿Cuál es el PRECIO de la noche?") == ["cual", "precio", "noche"]
+
+def test_search_ranks_by_text_and_keywords():
+    index = build_index()
+
+    assert index.search("is there wifi?")[0][0] == "wifi"
+    # "precio" only appears in the keywords metadata
+    assert index.search("precio")[0][0] == "prices"
+    assert index.search("spa") == []
+
+def test_covers_query_uses_keyword_terms():
+    index = build_index()
+
+    assert index.covers_query("wifi", "Wifi?")
+    assert not index.covers_query("wifi", "wifi password")
+
+def test_remove_and_sync(tmp_path):
+    index = build_index()
+    index.remove(["wifi"])
+    assert index.search("wifi") == []
+    assert "wifi" not in index.postings
+
+    class Collection:
+        def get(self, ids, include):
+            return {"ids": ids, "documents": ["Free parking."] * len(ids), "metadatas": [{}] * len(ids)}
+
+    index.sync(Collection(), ["prices", "parking"])
+    assert sorted(index.docs) == ["parking", "prices"]
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / "index.bm25.json")
+    build_index().save(path)
+
+    loaded = BM25Index.load(path)
+    assert loaded.search("check-in") == build_index().search("check-in")
+    assert BM25Index.load(str(tmp_path / "missing.json")).search("wifi") == []
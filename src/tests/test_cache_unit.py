@@ -0,0 +1,57 @@
+from unittest.mock import MagicMock
+from src.rag.cache import TTLCache, normalize_query, detect_language
+from src.rag.runtime import CachedEmbeddings
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_normalize_query_ignores_case_accents_and_whitespace():
+    assert normalize_query("  Precío\t ") == "precio"
+    assert normalize_query("Check-IN  hoy") == "check-in hoy"
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_ttl_cache_expires_entries():
+    clock = FakeClock()
+    cache = TTLCache(max_size=10, ttl=5, clock=clock)
+    cache.set("a", 1)
+    clock.now = 4
+    assert cache.get("a") == 1
+    clock.now = 6
+    assert cache.get("a") is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["size"] == 0
+
+def test_cached_embeddings_embeds_each_normalized_query_once():
+    inner = MagicMock()
+    inner.embed_query.return_value = [0.1, 0.2]
+    embeddings = CachedEmbeddings(inner, TTLCache())
+
+    assert embeddings.embed_query("Wifi?") == [0.1, 0.2]
+    assert embeddings.embed_query("  wifi? ") == [0.1, 0.2]
+
+    inner.embed_query.assert_called_once_with("Wifi?")
+    assert embeddings.cache.stats()["hits"] == 1
+
+def test_detect_language():
+    assert detect_language("¿Tienen wifi?") == "es"
+    assert detect_language("Cuanto cuesta la noche") == "es"
+    assert detect_language("What is the price?") == "en"
+    assert detect_language("wifi") == "unknown"
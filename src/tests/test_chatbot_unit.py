@@ -2,8 +2,12 @@ from unittest.mock import MagicMock, patch
 import pytest
 from src.rag.chatbot import ask_question
 
+@patch("src.rag.chatbot.get_answer_cache")
+@patch("src.rag.chatbot.get_runtime")
 @patch("src.rag.chatbot.get_rag_chain")
-def test_ask_question_auto_language(mock_get_chain):
+def test_ask_question_auto_language(mock_get_chain, mock_runtime, mock_answer_cache):
+    mock_answer_cache.return_value.lookup.return_value = None
+
     # Mock chain
     mock_chain = MagicMock()
     mock_get_chain.return_value = mock_chain
@@ -16,8 +20,12 @@ def test_ask_question_auto_language(mock_get_chain):
     assert answer == "This is a test answer."
     mock_chain.invoke.assert_called_with({"input": question, "language": "the same language as the question"})
 
+@patch("src.rag.chatbot.get_answer_cache")
+@patch("src.rag.chatbot.get_runtime")
 @patch("src.rag.chatbot.get_rag_chain")
-def test_ask_question_specific_language(mock_get_chain):
+def test_ask_question_specific_language(mock_get_chain, mock_runtime, mock_answer_cache):
+    mock_answer_cache.return_value.lookup.return_value = None
+
     # Mock chain
     mock_chain = MagicMock()
     mock_get_chain.return_value = mock_chain
@@ -29,3 +37,71 @@ def test_ask_question_specific_language(mock_get_chain):
     
     assert answer == "Respuesta de prueba."
     mock_chain.invoke.assert_called_with({"input": question, "language": "Spanish"})
+
+@patch("src.rag.chatbot.get_answer_cache")
+@patch("src.rag.chatbot.get_runtime")
+@patch("src.rag.chatbot.get_rag_chain")
+def test_ask_question_uses_cached_answer(mock_get_chain, mock_runtime, mock_answer_cache):
+    mock_runtime.return_value.generation = 3
+    mock_runtime.return_value.embeddings.embed_query.return_value = [0.1, 0.2]
+    mock_answer_cache.return_value.lookup.return_value = "Cached answer."
+
+    answer = ask_question("What is the price?")
+
+    assert answer == "Cached answer."
+    mock_answer_cache.return_value.lookup.assert_called_with([0.1, 0.2], "en", 3)
+    mock_get_chain.assert_not_called()
+
+@patch("src.rag.chatbot.get_answer_cache")
+@patch("src.rag.chatbot.get_runtime")
+@patch("src.rag.chatbot.get_agent")
+def test_stream_question_yields_tokens_and_caches_full_answer(mock_get_agent, mock_runtime, mock_answer_cache):
+    from langchain_core.messages import AIMessageChunk, ToolMessage
+    from src.rag.chatbot import stream_question
+    mock_runtime.return_value.generation = 1
+    mock_runtime.return_value.embeddings.embed_query.return_value = [0.3]
+    mock_answer_cache.return_value.lookup.return_value = None
+    mock_get_agent.return_value.stream.return_value = iter([
+        (AIMessageChunk(content="The price "), {}),
+        (ToolMessage(content="ignored", tool_call_id="1"), {}),
+        (AIMessageChunk(content="is 80€."), {}),
+    ])
+
+    tokens = list(stream_question("What is the price?", language="English"))
+
+    assert tokens == ["The price ", "is 80€."]
+    mock_answer_cache.return_value.store.assert_called_with("What is the price?", [0.3], "English", 1, "The price is 80€.")
+
+@patch("src.rag.chatbot.get_answer_cache")
+@patch("src.rag.chatbot.get_runtime")
+@patch("src.rag.chatbot.get_agent")
+def test_stream_question_does_not_cache_abandoned_answers(mock_get_agent, mock_runtime, mock_answer_cache):
+    from langchain_core.messages import AIMessageChunk
+    from src.rag.chatbot import stream_question
+    mock_answer_cache.return_value.lookup.return_value = None
+    mock_get_agent.return_value.stream.return_value = iter([(AIMessageChunk(content=t), {}) for t in ["a", "b"]])
+
+    tokens = stream_question("Hello")
+    assert next(tokens) == "a"
+    tokens.close()
+
+    mock_answer_cache.return_value.store.assert_not_called()
+
+@patch("src.rag.chatbot.get_memory")
+@patch("src.rag.chatbot.get_answer_cache")
+@patch("src.rag.chatbot.get_runtime")
+@patch("src.rag.chatbot.get_rag_chain")
+def test_ask_question_with_history_skips_answer_cache_and_records_turn(mock_get_chain, mock_runtime,
+                                                                       mock_answer_cache, mock_memory):
+    history = {"history": [{"role": "user", "content": "Do you have cabins?"},
+                           {"role": "assistant", "content": "Yes."}]}
+    mock_memory.return_value.history.return_value = history
+    mock_get_chain.return_value.invoke.return_value = {"answer": "80€ per night."}
+
+    answer = ask_question("And the price?", language="English", conversation="whatsapp:1")
+
+    assert answer == "80€ per night."
+    mock_get_chain.return_value.invoke.assert_called_with({"input": "And the price?", "language": "English", **history})
+    mock_answer_cache.return_value.lookup.assert_not_called()
+    mock_answer_cache.return_value.store.assert_not_called()
+    mock_memory.return_value.append.assert_called_with("whatsapp:1", "And the price?", "80€ per night.")
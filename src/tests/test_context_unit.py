@@ -0,0 +1,62 @@
+from langchain_core.documents import Document
+from src.rag.context import pack_context, strip_keywords
+from src.rag.ingest import add_keywords, recursive_chunking_strategie
+from src.rag.memory import count_tokens
+
+class FakeExtractor:
+    def extract_metadata_batch(self, contents, max_concurrency=4):
+        return [["glamping", "prices"] for _ in contents]
+
+def ingested_chunks(text, **metadata):
+    """Chunks as ingest stores them: recursive split (with overlap) plus the keyword header."""
+    section = Document(page_content=text, metadata={"source": "data/documents/faq.pdf", "page": 1, **metadata})
+    return add_keywords(recursive_chunking_strategie([section]), FakeExtractor())
+
+def sentences(prefix, count):
+    return " ".join(f"{prefix} sentence {i} describes the cabins and the forest." for i in range(count))
+
+def test_strips_keyword_header():
+    chunk = ingested_chunks("Check-in is at 16:00.")[0]
+    assert "[KEYWORDS]" in chunk.page_content
+    assert strip_keywords(chunk.page_content) == "Check-in is at 16:00."
+
+def test_overlapping_chunks_of_a_section_are_merged_back():
+    text = sentences("Pricing", 60)
+    chunks = ingested_chunks(text, section="Prices")
+    assert len(chunks) >= 3
+
+    # Retrieved out of order, as relevance ranking would
+    packed = pack_context([chunks[2], chunks[0], chunks[1]], token_budget=10000)
+
+    end = chunks[2].metadata["start_index"] + len(strip_keywords(chunks[2].page_content))
+    assert packed == [text[:end]]
+    assert count_tokens(packed[0]) < sum(count_tokens(strip_keywords(c.page_content)) for c in chunks[:3])
+
+def test_chunks_of_different_sections_are_not_merged():
+    first = ingested_chunks("Breakfast is served from 8 to 11.", section="Food")[0]
+    second = ingested_chunks("Pets are welcome in two cabins.", section="Pets")[0]
+
+    assert pack_context([first, second]) == ["Breakfast is served from 8 to 11.", "Pets are welcome in two cabins."]
+
+def test_near_duplicates_are_dropped_in_favour_of_the_better_ranked():
+    best = Document(page_content="The sauna is open every day from 10:00 to 22:00 for all guests of the cabins.",
+                    metadata={"source": "a.pdf"})
+    copy = Document(page_content="The sauna is open every day from 10:00 to 22:00 for all guests of the cabins!",
+                    metadata={"source": "b.pdf"})
+    other = Document(page_content="Parking is free next to reception.", metadata={"source": "a.pdf"})
+
+    assert pack_context([best, copy, other]) == [best.page_content, other.page_content]
+
+def test_fills_the_token_budget_in_relevance_order():
+    docs = [
+        Document(page_content=sentences("First", 4), metadata={"source": "1"}),
+        Document(page_content=sentences("Second", 40), metadata={"source": "2"}),
+        Document(page_content=sentences("Third", 4), metadata={"source": "3"}),
+    ]
+    budget = count_tokens(docs[0].page_content) + count_tokens(docs[2].page_content) + 5
+
+    packed = pack_context(docs, token_budget=budget)
+
+    # The second passage doesn't fit; the smaller third one still does
+    assert packed == [docs[0].page_content, docs[2].page_content]
+    assert pack_context(docs[1:2], token_budget=10) == [docs[1].page_content[:40]]
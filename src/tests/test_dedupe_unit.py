@@ -0,0 +1,51 @@
+from src.api.dedupe import MessageDeduper
+
+def test_duplicates_are_dropped_until_they_expire():
+    now = [1000.0]
+    deduper = MessageDeduper(path=None, ttl=60, clock=lambda: now[0])
+
+    assert deduper.first_time("whatsapp:wamid.1")
+    assert not deduper.first_time("whatsapp:wamid.1")
+    assert deduper.first_time("instagram:wamid.1")
+    now[0] += 61
+    assert deduper.first_time("whatsapp:wamid.1")
+    assert deduper.stats()["duplicates"] == 1
+
+def test_keeps_at_most_max_size_ids():
+    deduper = MessageDeduper(path=None, max_size=2)
+    for message_id in ["a", "b", "c"]:
+        deduper.first_time(message_id)
+
+    assert deduper.stats()["size"] == 2
+    assert deduper.first_time("a")
+
+def test_filter_new_keeps_first_occurrences_and_items_without_id():
+    deduper = MessageDeduper(path=None)
+    items = [{"id": "1"}, {"id": "2"}, {"id": "1"}, {}]
+
+    assert deduper.filter_new("whatsapp", items, lambda item: item.get("id")) == [{"id": "1"}, {"id": "2"}, {}]
+    assert deduper.filter_new("whatsapp", items, lambda item: item.get("id")) == [{}]
+
+def test_seen_ids_survive_a_restart(tmp_path):
+    now = [1000.0]
+    path = str(tmp_path / "seen.sqlite3")
+    first = MessageDeduper(path=path, ttl=60, clock=lambda: now[0])
+    first.first_time("old")
+    now[0] += 30
+    first.first_time("recent")
+
+    now[0] += 40
+    restarted = MessageDeduper(path=path, ttl=60, clock=lambda: now[0])
+
+    assert not restarted.first_time("recent")
+    assert restarted.first_time("old")
+
+def test_forgotten_ids_are_accepted_again(tmp_path):
+    path = str(tmp_path / "seen.sqlite3")
+    deduper = MessageDeduper(path=path)
+    deduper.filter_new("whatsapp", [{"id": "1"}, {"id": "2"}], lambda item: item.get("id"))
+
+    deduper.forget("whatsapp", "1")
+
+    assert MessageDeduper(path=path).filter_new("whatsapp", [{"id": "1"}, {"id": "2"}], lambda item: item.get("id")) == [{"id": "1"}]
+    assert deduper.filter_new("whatsapp", [{"id": "1"}], lambda item: item.get("id")) == [{"id": "1"}]
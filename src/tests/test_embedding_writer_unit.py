@@ -0,0 +1,80 @@
+import threading
+import time
+import uuid
+import chromadb
+from langchain_core.documents import Document
+from src.rag.embedding_writer import EmbeddingWriter
+
+class FakeEmbeddings:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.calls.append(list(texts))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        return [[float(len(t)), 1.0] for t in texts]
+
+def new_collection():
+    return chromadb.EphemeralClient().get_or_create_collection(f"test_{uuid.uuid4().hex}")
+
+def docs(*texts):
+    return [Document(page_content=t, metadata={"section": "S"}) for t in texts]
+
+def test_batches_are_written_in_submit_order():
+    collection = new_collection()
+    embeddings = FakeEmbeddings(delay=0.01)
+    written = []
+    with EmbeddingWriter(embeddings, collection, "llama3.1", max_in_flight=2) as writer:
+        for i in range(6):
+            written += writer.submit(docs(f"text {i}"), [f"id-{i}"], tag=i)
+        written += writer.flush()
+
+    assert written == list(range(6))
+    assert collection.count() == 6
+    assert 1 < embeddings.max_in_flight <= 2
+    stored = collection.get(ids=["id-3"], include=["documents", "metadatas"])
+    assert stored["documents"] == ["text 3"]
+    assert stored["metadatas"][0]["section"] == "S"
+    assert "content_hash" in stored["metadatas"][0]
+
+def test_stored_content_hashes_are_not_embedded_again():
+    collection = new_collection()
+    embeddings = FakeEmbeddings()
+    with EmbeddingWriter(embeddings, collection, "llama3.1") as writer:
+        writer.submit(docs("alpha", "beta"), ["a-1", "b-1"])
+        writer.flush()
+        # Same text under new IDs, as after a file edit elsewhere in the file
+        writer.submit(docs("alpha", "gamma"), ["a-2", "c-2"])
+        writer.flush()
+
+    assert embeddings.calls == [["alpha", "beta"], ["gamma"]]
+    assert writer.stats["reused"] == 1
+    assert collection.get(ids=["a-2"], include=["embeddings"])["embeddings"][0].tolist() == [5.0, 1.0]
+
+def test_embeddings_are_reused_from_previous_collection():
+    previous = new_collection()
+    with EmbeddingWriter(FakeEmbeddings(), previous, "llama3.1") as writer:
+        writer.submit(docs("alpha"), ["a-1"])
+        writer.flush()
+
+    embeddings = FakeEmbeddings()
+    with EmbeddingWriter(embeddings, new_collection(), "llama3.1", reuse_from=[previous]) as writer:
+        writer.submit(docs("alpha"), ["a-1"])
+        writer.flush()
+
+    assert embeddings.calls == []
+
+def test_empty_batches_pass_through():
+    with EmbeddingWriter(FakeEmbeddings(), new_collection(), "llama3.1", max_in_flight=1) as writer:
+        assert writer.submit([], [], tag="first") == []
+        assert writer.submit(docs("alpha"), ["a-1"], tag="second") == ["first"]
+        assert writer.flush() == ["second"]
@@ -0,0 +1,127 @@
+import threading
+import time
+import fitz
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+from src.rag.extract_processor import ExtractProcessor
+from src.rag.keyword_cache import KeywordCache
+
+def fake_llm(answer_for, delay=0.0):
+    state = {"in_flight": 0, "max_in_flight": 0, "calls": 0}
+    lock = threading.Lock()
+
+    def call(prompt):
+        with lock:
+            state["calls"] += 1
+            state["in_flight"] += 1
+            state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        time.sleep(delay)
+        with lock:
+            state["in_flight"] -= 1
+        return AIMessage(content=answer_for(prompt.to_string()))
+
+    return RunnableLambda(call), state
+
+def test_batch_keeps_order_and_limits_concurrency():
+    llm, state = fake_llm(lambda prompt: f'["{prompt.split("chunk-")[1].split()[0]}"]', delay=0.02)
+    processor = ExtractProcessor(llm)
+    contents = [f"chunk-{i}" for i in range(12)]
+
+    results = processor.extract_metadata_batch(contents, max_concurrency=3)
+
+    assert results == [[f"{i}"] for i in range(12)]
+    assert 1 < state["max_in_flight"] <= 3
+
+def test_batch_retries_then_skips_unparsable_answers():
+    attempts = {}
+
+    def answer_for(prompt):
+        key = "bad" if "bad" in prompt else "flaky" if "flaky" in prompt else "good"
+        attempts[key] = attempts.get(key, 0) + 1
+        if key == "bad" or (key == "flaky" and attempts[key] == 1):
+            return "no list here"
+        return '["ok"]'
+
+    llm, state = fake_llm(answer_for)
+    processor = ExtractProcessor(llm)
+
+    results = processor.extract_metadata_batch(["good", "flaky", "bad"], max_concurrency=1, retries=2)
+
+    assert results == [["ok"], ["ok"], []]
+    assert attempts == {"good": 1, "flaky": 2, "bad": 3}
+
+def test_keyword_cache_skips_llm_for_known_text(tmp_path):
+    llm, state = fake_llm(lambda prompt: '["wifi", "check-in"]')
+    cache = KeywordCache(path=str(tmp_path / "keywords.sqlite3"))
+
+    assert ExtractProcessor(llm, cache=cache).extract_metadata("Free wifi") == ["wifi", "check-in"]
+    # A new processor over the same file, as on the next ingest
+    cache = KeywordCache(path=str(tmp_path / "keywords.sqlite3"))
+    assert ExtractProcessor(llm, cache=cache).extract_metadata("Free wifi") == ["wifi", "check-in"]
+
+    assert state["calls"] == 1
+    assert cache.stats()["hits"] == 1
+
+def test_keyword_cache_does_not_store_failed_parses(tmp_path):
+    llm, state = fake_llm(lambda prompt: "no list here")
+    cache = KeywordCache(path=str(tmp_path / "keywords.sqlite3"))
+    processor = ExtractProcessor(llm, cache=cache)
+
+    processor.extract_metadata("text")
+    processor.extract_metadata("text")
+
+    assert state["calls"] == 2
+    assert len(cache) == 0
+
+def test_keyword_cache_evicts_least_recently_used(tmp_path):
+    cache = KeywordCache(path=str(tmp_path / "keywords.sqlite3"), max_size=2)
+    cache.set("a", ["a"])
+    time.sleep(0.01)
+    cache.set("b", ["b"])
+    time.sleep(0.01)
+    cache.get("a")
+    time.sleep(0.01)
+    cache.set("c", ["c"])
+
+    assert cache.get("b") is None
+    assert cache.get("a") == ["a"]
+    assert cache.stats()["evictions"] == 1
+
+def test_keyword_cache_key_depends_on_model_and_prompt():
+    key = KeywordCache.make_key("llama3.1", "prompt", "text")
+    assert key != KeywordCache.make_key("llama3.2", "prompt", "text")
+    assert key != KeywordCache.make_key("llama3.1", "other prompt", "text")
+
+def make_pdf(path, pages):
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        page.insert_text((50, 50), f"CHAPTER {page_num}", fontsize=24)
+        page.insert_text((50, 90), f"Sub {page_num}", fontsize=18)
+        page.insert_text((50, 120), f"Body text {page_num} about the glamping.", fontsize=11)
+        page.insert_text((50, 140), f"More text {page_num} about the glamping.", fontsize=11)
+    doc.save(str(path))
+
+def test_sections_follow_heading_hierarchy(tmp_path):
+    make_pdf(tmp_path / "brochure.pdf", pages=2)
+
+    docs = ExtractProcessor(None).process_document(str(tmp_path / "brochure.pdf"))
+
+    assert [d.metadata for d in docs] == [
+        {"parent_section": "CHAPTER 0", "section": "Sub 0", "page": 0},
+        {"parent_section": "CHAPTER 1", "section": "Sub 1", "page": 1},
+    ]
+    assert docs[0].page_content == "Body text 0 about the glamping.\n\nMore text 0 about the glamping."
+
+def test_parallel_parsing_matches_serial(tmp_path):
+    make_pdf(tmp_path / "a.pdf", pages=20)
+    make_pdf(tmp_path / "b.pdf", pages=3)
+    paths = [str(tmp_path / "a.pdf"), str(tmp_path / "b.pdf")]
+    processor = ExtractProcessor(None)
+
+    serial = list(processor.process_documents(paths))
+    parallel = list(processor.process_documents(paths, workers=3))
+
+    assert [p for p, _ in parallel] == paths
+    as_tuples = lambda results: [[(d.page_content, d.metadata) for d in docs] for _, docs in results]
+    assert as_tuples(parallel) == as_tuples(serial)
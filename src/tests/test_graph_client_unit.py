@@ -0,0 +1,145 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from src.api.graph_client import GraphClient, GraphAPIError
+
+class StubGraphServer:
+    """Local stand-in for the Graph API. `responses` is a list of status codes to answer with, in order (then 200)."""
+
+    def __init__(self, responses=(), delay=0.0):
+        self.responses = list(responses)
+        self.delay = delay
+        self.requests = []
+        self.ports = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def do_POST(self):
+                with lock:
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                    stub.ports.add(self.client_address[1])
+                    status = stub.responses.pop(0) if stub.responses else 200
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.requests.append((self.path, self.headers["Authorization"], body))
+                time.sleep(stub.delay)
+                answer = json.dumps({"messages": [{"id": "wamid.1"}]} if status == 200 else {"error": "nope"}).encode()
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", "0")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(answer)))
+                self.end_headers()
+                self.wfile.write(answer)
+                with lock:
+                    stub.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v17.0"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**kwargs):
+        servers.append(StubGraphServer(**kwargs))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+def send_all(client, count):
+    async def scenario():
+        results = await asyncio.gather(*[
+            client.post("123/messages", {"to": str(i)}, "token") for i in range(count)
+        ])
+        await client.aclose()
+        return results
+    return asyncio.run(scenario())
+
+def test_posts_json_with_bearer_token_over_kept_alive_connections(stub):
+    server = stub()
+    client = GraphClient(base_url=server.url, max_concurrency=1)
+
+    results = send_all(client, 5)
+
+    assert results == [{"messages": [{"id": "wamid.1"}]}] * 5
+    assert server.requests[0] == ("/v17.0/123/messages", "Bearer token", {"to": "0"})
+    # Sequential sends reuse one pooled connection instead of reconnecting
+    assert len(server.ports) == 1
+
+def test_pool_is_closed_when_the_client_moves_to_another_loop(stub):
+    server = stub()
+    client = GraphClient(base_url=server.url)
+    send = lambda: client.post("123/messages", {"to": "1"}, "token")
+    other_loop = asyncio.new_event_loop()
+    threading.Thread(target=other_loop.run_forever, daemon=True).start()
+
+    asyncio.run_coroutine_threadsafe(send(), other_loop).result(5)
+    first_pool = client._client
+
+    async def send_from_this_loop():
+        await send()
+        rebuilt = first_pool is not client._client and not client._client.is_closed
+        await client.aclose()
+        return rebuilt
+
+    assert asyncio.run(send_from_this_loop())
+    # The old pool is closed by the loop that owns it
+    asyncio.run_coroutine_threadsafe(asyncio.sleep(0.05), other_loop).result(5)
+    assert first_pool.is_closed
+    other_loop.call_soon_threadsafe(other_loop.stop)
+
+def test_limits_concurrent_sends(stub):
+    server = stub(delay=0.05)
+    client = GraphClient(base_url=server.url, max_concurrency=3)
+
+    send_all(client, 9)
+
+    assert len(server.requests) == 9
+    assert server.max_in_flight == 3
+
+def test_retries_rate_limits_and_server_errors_with_backoff(stub):
+    server = stub(responses=[429, 503])
+    client = GraphClient(base_url=server.url, backoff_base=0.01)
+
+    assert send_all(client, 1) == [{"messages": [{"id": "wamid.1"}]}]
+    assert len(server.requests) == 3
+    assert client.stats == {"requests": 3, "retries": 2, "failures": 0}
+
+def test_gives_up_after_retries_and_does_not_retry_client_errors(stub):
+    server = stub(responses=[500, 500, 400])
+    client = GraphClient(base_url=server.url, retries=1, backoff_base=0.01)
+
+    with pytest.raises(GraphAPIError) as exhausted:
+        send_all(client, 1)
+    assert exhausted.value.status_code == 500
+
+    with pytest.raises(GraphAPIError) as rejected:
+        send_all(client, 1)
+    assert rejected.value.status_code == 400
+    assert len(server.requests) == 3
+
+def test_network_errors_are_retried_then_raised():
+    client = GraphClient(base_url="http://127.0.0.1:9", retries=1, backoff_base=0.01)
+
+    with pytest.raises(GraphAPIError):
+        send_all(client, 1)
+    assert client.stats["retries"] == 1
@@ -0,0 +1,43 @@
+import json
+import os
+import subprocess
+import sys
+from unittest.mock import patch
+from src.api import answers
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+IMPORT_TIME_BUDGET = 1.5  # seconds; importing the RAG stack alone takes longer than this
+HEAVY_MODULES = ["chromadb", "langchain", "langchain_core", "langchain_chroma", "langchain_ollama",
+                 "langchain_community", "langchain_experimental", "langgraph", "fitz", "pymupdf", "src.rag.chatbot",
+                 "src.rag.ingest"]
+MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import src.api.main
+print(json.dumps({"seconds": time.perf_counter() - start,
+                  "loaded": [m for m in %r if m in sys.modules]}))
+""" % HEAVY_MODULES
+
+def measure_import(cwd):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    result = subprocess.run([sys.executable, "-c", MEASURE], cwd=cwd, env=env, capture_output=True, text=True,
+                            timeout=60, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def test_api_imports_without_the_rag_stack(tmp_path):
+    # Best of two, so a busy machine doesn't fail the budget on one slow run
+    runs = [measure_import(tmp_path) for _ in range(2)]
+    assert runs[0]["loaded"] == []
+    assert min(run["seconds"] for run in runs) < IMPORT_TIME_BUDGET
+    assert list(tmp_path.iterdir()) == []  # importing the app writes nothing
+
+@patch("src.rag.chatbot.stream_question")
+@patch("src.rag.chatbot.ask_question")
+def test_answers_delegate_to_the_chatbot(mock_ask, mock_stream):
+    mock_ask.return_value = "Answer"
+    mock_stream.return_value = iter(["An", "swer"])
+
+    assert answers.ask_question("Hola", "Spanish", conversation="whatsapp:1") == "Answer"
+    mock_ask.assert_called_once_with("Hola", "Spanish", "whatsapp:1")
+    assert list(answers.stream_question("Hola")) == ["An", "swer"]
+    mock_stream.assert_called_once_with("Hola", "Auto", None)
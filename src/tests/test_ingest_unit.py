@@ -0,0 +1,251 @@
+import os
+from unittest.mock import MagicMock, patch
+import pytest
+from langchain_core.documents import Document
+from src.rag import ingest
+from src.rag.runtime import active_collection, read_active
+from src.rag.bm25 import BM25Index, index_path
+
+@pytest.fixture
+def ingest_env(tmp_path, monkeypatch):
+    data_path = tmp_path / "documents"
+    data_path.mkdir()
+    monkeypatch.setattr(ingest, "DATA_PATH", str(data_path))
+    monkeypatch.setattr(ingest, "DB_PATH", str(tmp_path / "chroma_db"))
+
+    processor = MagicMock()
+    processor.parsed = []
+
+    def process_documents(paths, workers=1):
+        for path in paths:
+            processor.parsed.append(path)
+            yield path, [Document(page_content=open(path).read(), metadata={"parent_section": "", "section": "S", "page": 0})]
+
+    processor.process_documents.side_effect = process_documents
+    processor.extract_metadata_batch.side_effect = lambda contents, **kwargs: [["kw"] for _ in contents]
+
+    with patch.object(ingest, "chromadb") as chroma_client, \
+         patch.object(ingest, "OllamaEmbeddings"), \
+         patch.object(ingest, "ChatOllama"), \
+         patch.object(ingest, "ExtractProcessor", return_value=processor), \
+         patch.object(ingest, "KeywordCache"), \
+         patch.object(ingest, "get_runtime") as runtime:
+        chroma_client.PersistentClient.return_value.delete_collection.side_effect = ValueError("missing")
+        collection = chroma_client.PersistentClient.return_value.get_or_create_collection.return_value
+        stored = {}
+
+        def upsert(ids, documents, metadatas, **kwargs):
+            for doc_id, text, metadata in zip(ids, documents, metadatas):
+                stored[doc_id] = (text, metadata)
+
+        def get(ids=None, where=None, include=()):
+            found = [i for i in (ids or []) if i in stored]
+            return {"ids": found, "documents": [stored[i][0] for i in found],
+                    "metadatas": [stored[i][1] for i in found], "embeddings": []}
+
+        collection.upsert.side_effect = upsert
+        collection.get.side_effect = get
+        yield data_path, collection, processor, runtime
+    if ingest._gc_timer is not None:
+        ingest._gc_timer.cancel()
+
+def test_unchanged_files_are_skipped(ingest_env):
+    data_path, collection, processor, runtime = ingest_env
+    (data_path / "a.pdf").write_text("alpha")
+    (data_path / "b.pdf").write_text("beta")
+
+    ingest.ingest_docs()
+    assert len(processor.parsed) == 2
+    assert collection.upsert.call_count == 2
+
+    ingest.ingest_docs()
+    assert len(processor.parsed) == 2
+    assert collection.upsert.call_count == 2
+    assert runtime.return_value.reload.call_count == 1
+
+def test_changed_file_replaces_only_its_chunks(ingest_env):
+    data_path, collection, processor, runtime = ingest_env
+    (data_path / "a.pdf").write_text("alpha")
+    (data_path / "b.pdf").write_text("beta")
+    ingest.ingest_docs()
+    manifest = ingest.load_manifest(active_collection("recursive", ingest.DB_PATH))
+    old_ids = manifest[str(data_path / "a.pdf")]["chunk_ids"]
+
+    (data_path / "a.pdf").write_text("alpha v2")
+    ingest.ingest_docs()
+
+    assert processor.parsed[-1] == str(data_path / "a.pdf")
+    assert len(processor.parsed) == 3
+    collection.delete.assert_called_once_with(ids=old_ids)
+    new_manifest = ingest.load_manifest(active_collection("recursive", ingest.DB_PATH))
+    assert new_manifest[str(data_path / "a.pdf")]["chunk_ids"] != old_ids
+    assert new_manifest[str(data_path / "b.pdf")] == manifest[str(data_path / "b.pdf")]
+
+def test_deleted_file_chunks_are_removed(ingest_env):
+    data_path, collection, processor, runtime = ingest_env
+    (data_path / "a.pdf").write_text("alpha")
+    (data_path / "b.pdf").write_text("beta")
+    ingest.ingest_docs()
+    b_ids = ingest.load_manifest(active_collection("recursive", ingest.DB_PATH))[str(data_path / "b.pdf")]["chunk_ids"]
+
+    (data_path / "b.pdf").unlink()
+    ingest.ingest_docs()
+
+    collection.delete.assert_called_once_with(ids=b_ids)
+    assert str(data_path / "b.pdf") not in ingest.load_manifest(active_collection("recursive", ingest.DB_PATH))
+
+def test_removing_the_last_file_empties_the_collection(ingest_env):
+    data_path, collection, processor, runtime = ingest_env
+    (data_path / "a.pdf").write_text("alpha")
+    ingest.ingest_docs()
+    collection_name = active_collection("recursive", ingest.DB_PATH)
+    a_ids = ingest.load_manifest(collection_name)[str(data_path / "a.pdf")]["chunk_ids"]
+    runtime.reset_mock()
+
+    (data_path / "a.pdf").unlink()
+    ingest.ingest_docs()
+
+    collection.delete.assert_called_once_with(ids=a_ids)
+    assert ingest.load_manifest(collection_name) == {}
+    assert len(BM25Index.load(index_path(ingest.DB_PATH, collection_name))) == 0
+    runtime.return_value.reload.assert_called_once()
+
+def test_full_rebuild_switches_to_new_collection(ingest_env):
+    data_path, collection, processor, runtime = ingest_env
+    (data_path / "a.pdf").write_text("alpha")
+
+    ingest.ingest_docs()
+    assert active_collection("recursive", ingest.DB_PATH) == "recursive_espazo_nature_v1"
+
+    ingest.ingest_docs(clear_db=True)
+    state = read_active(ingest.DB_PATH)
+    assert state["collections"]["recursive"] == "recursive_espazo_nature_v2"
+    assert state["generation"] == 2
+    # The first switch retires the unversioned collection of older installs
+    assert [r["name"] for r in state["retired"]] == ["recursive_espazo_nature", "recursive_espazo_nature_v1"]
+    assert len(processor.parsed) == 2
+    assert runtime.return_value.reload.call_count == 2
+
+def test_full_rebuild_without_the_previous_collection_embeds_everything(ingest_env):
+    from chromadb.errors import NotFoundError
+    data_path, collection, processor, runtime = ingest_env
+    (data_path / "a.pdf").write_text("alpha")
+    ingest.ingest_docs()
+    ingest.chromadb.PersistentClient.return_value.get_collection.side_effect = NotFoundError("gone")
+
+    ingest.ingest_docs(clear_db=True)
+
+    assert active_collection("recursive", ingest.DB_PATH) == "recursive_espazo_nature_v2"
+    assert len(processor.parsed) == 2
+
+def test_retired_collections_are_collected_after_grace_period(ingest_env):
+    data_path, collection, processor, runtime = ingest_env
+    (data_path / "a.pdf").write_text("alpha")
+    ingest.ingest_docs()
+    ingest.ingest_docs(clear_db=True)
+
+    v1_index = index_path(ingest.DB_PATH, "recursive_espazo_nature_v1")
+    ingest.collect_garbage(grace_period=3600)
+    assert len(read_active(ingest.DB_PATH)["retired"]) == 2
+    assert os.path.exists(v1_index)
+
+    ingest.collect_garbage(grace_period=0)
+    assert read_active(ingest.DB_PATH)["retired"] == []
+    deleted = [c.args[0] for c in ingest.chromadb.PersistentClient.return_value.delete_collection.call_args_list]
+    assert deleted == ["recursive_espazo_nature", "recursive_espazo_nature_v1"]
+    assert not os.path.exists(v1_index)
+    assert not os.path.exists(ingest.manifest_path("recursive_espazo_nature_v1"))
+
+def test_garbage_is_collected_after_a_switch_without_another_ingest(ingest_env, monkeypatch):
+    data_path, collection, processor, runtime = ingest_env
+    monkeypatch.setattr(ingest, "GC_GRACE_PERIOD", 0)
+    (data_path / "a.pdf").write_text("alpha")
+    ingest.ingest_docs()
+
+    ingest._gc_timer.join(5)
+
+    assert read_active(ingest.DB_PATH)["retired"] == []
+    ingest.chromadb.PersistentClient.return_value.delete_collection.assert_called_with("recursive_espazo_nature")
+
+def test_crashed_shadow_build_is_retired_by_the_next_ingest(ingest_env):
+    import subprocess
+    import sys
+    from src.rag.runtime import start_build, update_active
+    data_path, collection, processor, runtime = ingest_env
+    (data_path / "a.pdf").write_text("alpha")
+    ingest.ingest_docs()
+    # A full rebuild in another process died before switching
+    assert start_build("recursive", ingest.DB_PATH) == "recursive_espazo_nature_v2"
+    dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    with update_active(ingest.DB_PATH) as state:
+        state["building"]["recursive"]["pid"] = int(dead.stdout)
+
+    (data_path / "b.pdf").write_text("beta")
+    ingest.ingest_docs()
+
+    state = read_active(ingest.DB_PATH)
+    assert state["building"] == {}
+    assert [r["name"] for r in state["retired"]] == ["recursive_espazo_nature", "recursive_espazo_nature_v2"]
+
+def test_shadow_build_of_a_live_process_is_kept_and_resumed(ingest_env):
+    import os
+    from src.rag.runtime import start_build, update_active
+    data_path, collection, processor, runtime = ingest_env
+    (data_path / "a.pdf").write_text("alpha")
+    ingest.ingest_docs()
+    start_build("recursive", ingest.DB_PATH)
+    with update_active(ingest.DB_PATH) as state:
+        state["building"]["recursive"]["pid"] = os.getppid()
+    (data_path / "b.pdf").write_text("beta")
+    ingest.ingest_docs()  # bumps the generation, leaves the build alone
+    assert "recursive" in read_active(ingest.DB_PATH)["building"]
+
+    ingest.ingest_docs(clear_db=True)
+
+    state = read_active(ingest.DB_PATH)
+    assert state["collections"]["recursive"] == "recursive_espazo_nature_v2"
+    assert state["building"] == {}
+
+def test_interrupted_ingest_resumes_after_last_committed_batch(ingest_env):
+    data_path, collection, processor, runtime = ingest_env
+    (data_path / "a.pdf").write_text("\n\n".join(f"Paragraph {i} " + "x" * 900 for i in range(4)))
+    calls = []
+
+    store = collection.upsert.side_effect
+
+    def upsert(ids, **kwargs):
+        calls.append(ids)
+        if len(calls) == 3:
+            raise RuntimeError("crash")
+        store(ids, **kwargs)
+    collection.upsert.side_effect = upsert
+
+    with pytest.raises(RuntimeError):
+        ingest.ingest_docs(batch_size=1)
+    assert active_collection("recursive", ingest.DB_PATH) is None
+
+    collection.upsert.side_effect = lambda ids, **kwargs: calls.append(ids) or store(ids, **kwargs)
+    ingest.ingest_docs(batch_size=1)
+
+    manifest = ingest.load_manifest(active_collection("recursive", ingest.DB_PATH))
+    chunk_ids = manifest[str(data_path / "a.pdf")]["chunk_ids"]
+    assert len(chunk_ids) == 4
+    # Batches 1 and 2 were committed before the crash and are not added again
+    assert calls == [[chunk_ids[0]], [chunk_ids[1]], [chunk_ids[2]], [chunk_ids[2]], [chunk_ids[3]]]
+    assert "pending" not in manifest[str(data_path / "a.pdf")]
+
+def test_bm25_index_follows_the_collection(ingest_env):
+    data_path, collection, processor, runtime = ingest_env
+    (data_path / "a.pdf").write_text("wifi password")
+    (data_path / "b.pdf").write_text("check-in time")
+    ingest.ingest_docs()
+    path = index_path(ingest.DB_PATH, active_collection("recursive", ingest.DB_PATH))
+
+    assert BM25Index.load(path).search("wifi")[0][0].startswith(ingest.chunk_id(str(data_path / "a.pdf"), "", 0)[:8])
+
+    (data_path / "a.pdf").unlink()
+    ingest.ingest_docs()
+
+    bm25 = BM25Index.load(path)
+    assert bm25.search("wifi") == []
+    assert len(bm25) == 1
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import pytest
+from langchain_ollama import ChatOllama, OllamaEmbeddings
+from src.api.graph_client import GraphClient, GraphAPIError
+from src.loadtest import FakeGraph, FakeOllama, app_server, build_requests, reply_latencies, run_load
+
+def test_fake_ollama_streams_tokens_and_embeds():
+    with FakeOllama(latency=0.0, tokens_per_second=1000, answer_tokens=5, embedding_dim=16) as ollama:
+        llm = ChatOllama(model="llama3.1", base_url=ollama.url)
+        chunks = [chunk.content for chunk in llm.stream("Hola")]
+        assert len([c for c in chunks if c]) == 5
+        assert llm.invoke("Hola").content == "".join(chunks)
+
+        vectors = OllamaEmbeddings(model="llama3.1", base_url=ollama.url).embed_documents(["a", "b"])
+        assert [len(v) for v in vectors] == [16, 16]
+        assert ollama.stats() == {"chats": 2, "embeds": 1, "peak_generating": 1}
+
+def test_fake_graph_records_replies_and_injects_errors():
+    async def send(graph, payload):
+        client = GraphClient(base_url=graph.url + "/v17.0", retries=0)
+        try:
+            return await client.post("me/messages", payload, "token")
+        finally:
+            await client.aclose()
+
+    with FakeGraph(latency=0.0) as graph:
+        asyncio.run(send(graph, {"messaging_product": "whatsapp", "to": "34600", "text": {"body": "Hola"}}))
+        asyncio.run(send(graph, {"recipient": {"id": "ig-1"}, "message": {"text": "Hola"}}))
+        assert [d[:2] for d in graph.deliveries] == [("whatsapp", "34600"), ("instagram", "ig-1")]
+
+    with FakeGraph(latency=0.0, error_rate=1.0) as graph:
+        with pytest.raises(GraphAPIError):
+            asyncio.run(send(graph, {"recipient": {"id": "ig-1"}, "message": {"text": "Hola"}}))
+        assert graph.errors == 1 and graph.deliveries == []
+
+def test_schedule_follows_rate_and_mix():
+    schedule = build_requests(rate=10, duration=2, mix={"chat": 1, "whatsapp": 3}, users=5, distinct=True)
+    assert len(schedule) == 20
+    assert [offset for offset, *_ in schedule] == pytest.approx([i / 10 for i in range(20)])
+    assert {endpoint for _, endpoint, *_ in schedule} == {"chat", "whatsapp"}
+    message_ids = [body["entry"][0]["changes"][0]["value"]["messages"][0]["id"]
+                   for _, endpoint, _, body, _ in schedule if endpoint == "whatsapp"]
+    assert len(set(message_ids)) == len(message_ids)
+
+def test_replies_are_matched_to_messages_per_sender_in_order():
+    accepted = [("whatsapp", "a", 1.0), ("whatsapp", "a", 2.0), ("instagram", "b", 1.5), ("whatsapp", "c", 3.0)]
+    deliveries = [("whatsapp", "a", 4.0), ("instagram", "b", 2.0), ("whatsapp", "a", 5.0)]
+
+    latencies, unanswered = reply_latencies(accepted, deliveries)
+
+    assert latencies["whatsapp"] == [3.0, 3.0]
+    assert latencies["instagram"] == [0.5]
+    assert unanswered == {"whatsapp": 1}
+
+def test_load_run_against_the_app(tmp_path):
+    with FakeOllama(latency=0.0, tokens_per_second=1000, answer_tokens=3) as ollama, FakeGraph(latency=0.0) as graph:
+        with app_server(ollama.url, graph.url, workdir=str(tmp_path)) as url:
+            results = asyncio.run(run_load(url, graph, rate=12, duration=1, distinct=True, drain_timeout=20))
+
+    assert sum(e["requests"] for e in results["endpoints"].values()) == 12
+    for endpoint in results["endpoints"].values():
+        assert endpoint["error_rate"] == 0.0
+        assert endpoint.get("unanswered", 0) == 0
+    assert results["graph"]["delivered"] == sum(
+        e["ok"] for name, e in results["endpoints"].items() if name != "chat"
+    )
+    assert ollama.stats()["chats"] == 12
+    # The app ran in the scratch directory
+    assert os.path.exists(tmp_path / "data" / "outbox.sqlite3")
@@ -0,0 +1,68 @@
+from src.rag.memory import ConversationMemory, count_tokens
+
+def history_tokens(inputs):
+    return sum(count_tokens(m["content"]) for m in inputs.get("history", [])) + count_tokens(inputs.get("summary", ""))
+
+def test_new_conversation_has_no_history():
+    memory = ConversationMemory()
+    assert memory.history("whatsapp:1") == {}
+    assert not memory.has_history("whatsapp:1")
+
+def test_history_is_kept_per_conversation_in_order():
+    memory = ConversationMemory()
+    memory.append("whatsapp:1", "Do you have wifi?", "Yes.")
+    memory.append("whatsapp:1", "Is it free?", "Yes, free.")
+    memory.append("instagram:1", "Hola", "¡Hola!")
+
+    assert memory.history("whatsapp:1") == {"history": [
+        {"role": "user", "content": "Do you have wifi?"},
+        {"role": "assistant", "content": "Yes."},
+        {"role": "user", "content": "Is it free?"},
+        {"role": "assistant", "content": "Yes, free."},
+    ]}
+    assert len(memory.history("instagram:1")["history"]) == 2
+
+def test_long_conversations_stay_within_the_token_budget():
+    memory = ConversationMemory(token_budget=200, summary_budget=50)
+    for i in range(30):
+        memory.append("chat:ana", f"Question number {i} about the cabins?", "An answer " * 20)
+
+    inputs = memory.history("chat:ana")
+    assert history_tokens(inputs) <= 200
+    # The newest turns are kept verbatim, the oldest survive as a summary of their questions
+    assert inputs["history"][-2]["content"] == "Question number 29 about the cabins?"
+    first_kept = inputs["history"][0]["content"]
+    trimmed = int(first_kept.split()[2])
+    assert inputs["summary"].endswith(f"Question number {trimmed - 1} about the cabins?")
+    assert "Question number 0 " not in inputs["summary"]
+    assert memory.stats()["trimmed_turns"] == trimmed
+
+def test_oversized_answer_is_cut_to_fit():
+    memory = ConversationMemory(token_budget=100, summary_budget=20)
+    memory.append("chat:ana", "Tell me everything", "x" * 10000)
+
+    assert history_tokens(memory.history("chat:ana")) <= 80
+
+def test_idle_conversations_expire_and_least_recent_are_evicted():
+    now = [0.0]
+    memory = ConversationMemory(max_users=2, idle_ttl=60, clock=lambda: now[0])
+    memory.append("chat:a", "q", "a")
+    now[0] = 30
+    memory.append("chat:b", "q", "a")
+    memory.history("chat:a")  # touch a, so b is the least recently used
+    now[0] = 50
+    memory.append("chat:c", "q", "a")
+
+    assert memory.has_history("chat:a") and memory.has_history("chat:c")
+    assert not memory.has_history("chat:b")
+    now[0] = 91
+    assert not memory.has_history("chat:a")
+    assert memory.has_history("chat:c")
+
+def test_conversations_survive_a_restart(tmp_path):
+    path = str(tmp_path / "conversations.sqlite3")
+    ConversationMemory(path=path).append("whatsapp:34600", "¿Tenéis wifi?", "Sí.")
+
+    restarted = ConversationMemory(path=path)
+
+    assert restarted.history("whatsapp:34600")["history"][0]["content"] == "¿Tenéis wifi?"
@@ -0,0 +1,69 @@
+from unittest.mock import patch
+import pytest
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from src.metrics import Counter, Gauge, Histogram, Registry, STAGE_SECONDS, LLM_IN_FLIGHT
+from src.rag import chatbot
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = Histogram("stage_seconds", "Stage time", ["stage"], buckets=(0.1, 1.0), registry=registry)
+    histogram.observe(0.05, stage="llm")
+    histogram.observe(0.1, stage="llm")
+    histogram.observe(3.0, stage="llm")
+
+    assert histogram.count(stage="llm") == 3
+    assert histogram.sum(stage="llm") == pytest.approx(3.15)
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP stage_seconds Stage time", "# TYPE stage_seconds histogram"]
+    assert lines[2:6] == [
+        'stage_seconds_bucket{stage="llm",le="0.1"} 2',
+        'stage_seconds_bucket{stage="llm",le="1"} 2',
+        'stage_seconds_bucket{stage="llm",le="+Inf"} 3',
+        'stage_seconds_sum{stage="llm"} 3.15',
+    ]
+    assert lines[6] == 'stage_seconds_count{stage="llm"} 3'
+
+def test_counters_gauges_and_scrape_time_values():
+    registry = Registry()
+    lookups = Counter("lookups_total", "Lookups", ["cache", "result"], registry=registry)
+    in_flight = Gauge("in_flight", "Running", registry=registry)
+    depth = Gauge("depth", "Queued", function=lambda: 7, registry=registry)
+    Gauge("broken", "Fails", function=lambda: 1 / 0, registry=registry)
+
+    lookups.inc(cache="answer", result="hit")
+    lookups.inc(cache="answer", result="hit")
+    with in_flight.track():
+        assert in_flight.value() == 1
+    assert in_flight.value() == 0
+    assert depth.value() == 7
+
+    text = registry.render()
+    assert 'lookups_total{cache="answer",result="hit"} 2' in text
+    assert "depth 7" in text
+    assert "# TYPE broken gauge" in text  # a failing callback only loses its own sample
+    with pytest.raises(ValueError):
+        lookups.inc(cache="answer")
+    with pytest.raises(ValueError):
+        Counter("lookups_total", "Again", registry=registry)
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    Counter("errors_total", "Errors", ["detail"], registry=registry).inc(detail='say "hi"\n')
+    assert 'errors_total{detail="say \\"hi\\"\\n"} 1' in registry.render()
+
+@patch("src.rag.chatbot.get_runtime")
+@patch("src.rag.chatbot.ChatOllama")
+def test_agent_records_retrieval_prompt_and_llm_stages(mock_chat_ollama, mock_runtime, monkeypatch):
+    monkeypatch.setattr(chatbot, "_agent", None)
+    mock_chat_ollama.return_value = GenericFakeChatModel(messages=iter([AIMessage(content="Check-in is at 16:00.")]))
+    mock_runtime.return_value.hybrid_search.return_value = [Document(page_content="Check-in from 16:00.")]
+    before = {stage: STAGE_SECONDS.count(path="answer", stage=stage) for stage in ("retrieval", "prompt", "llm")}
+
+    state = chatbot.get_agent().invoke({"messages": [{"role": "user", "content": "Check-in?"}], "language": "English"})
+
+    assert state["messages"][-1].text == "Check-in is at 16:00."
+    for stage, count in before.items():
+        assert STAGE_SECONDS.count(path="answer", stage=stage) == count + 1
+    assert LLM_IN_FLIGHT.value() == 0
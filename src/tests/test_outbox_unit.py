@@ -0,0 +1,131 @@
+import asyncio
+import pytest
+from src.api.graph_client import GraphAPIError
+from src.api.outbox import Outbox, RateLimiter
+
+def make_outbox(tmp_path, **kwargs):
+    kwargs.setdefault("retry_base", 0.01)
+    kwargs.setdefault("poll_interval", 0.01)
+    kwargs.setdefault("rate_limits", {})
+    return Outbox(path=str(tmp_path / "outbox.sqlite3"), **kwargs)
+
+async def drain(outbox, timeout=5):
+    outbox.start()
+    deadline = asyncio.get_running_loop().time() + timeout
+    while outbox.depth() or outbox._sending:
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+    await outbox.stop()
+
+def test_retries_keep_per_recipient_order(tmp_path):
+    outbox = make_outbox(tmp_path, workers=3, retry_base=0.05)
+    sent = []
+    failures = {"alice-1": 2}
+
+    async def send(recipient, text):
+        await asyncio.sleep(0.01)
+        if failures.get(text):
+            failures[text] -= 1
+            raise GraphAPIError("rate limited", 429)
+        sent.append(text)
+    outbox.register_sender("whatsapp", send)
+
+    async def scenario():
+        for text in ["alice-1", "bob-1", "alice-2", "bob-2", "alice-3"]:
+            await outbox.put("whatsapp", text.split("-")[0], text)
+        await drain(outbox)
+
+    asyncio.run(scenario())
+
+    assert [t for t in sent if t.startswith("alice")] == ["alice-1", "alice-2", "alice-3"]
+    assert [t for t in sent if t.startswith("bob")] == ["bob-1", "bob-2"]
+    # Bob isn't held up by Alice's retries
+    assert sent.index("bob-2") < sent.index("alice-1")
+    stats = outbox.stats()
+    assert (stats["sent"], stats["retried"], stats["failed"], stats["depth"]) == (5, 2, 0, 0)
+    assert stats["send_seconds_p95"] >= stats["send_seconds_p50"] > 0
+
+def test_permanent_failures_are_kept_and_unblock_the_recipient(tmp_path):
+    outbox = make_outbox(tmp_path, max_attempts=2)
+    sent = []
+
+    async def send(recipient, text):
+        if text == "bad":
+            raise GraphAPIError("invalid recipient", 400)
+        if text == "flaky":
+            raise GraphAPIError("unavailable", 503)
+        sent.append(text)
+    outbox.register_sender("instagram", send)
+
+    async def scenario():
+        for text in ["bad", "flaky", "good"]:
+            await outbox.put("instagram", "carol", text)
+        await drain(outbox)
+
+    asyncio.run(scenario())
+
+    assert sent == ["good"]
+    assert outbox.stats()["failed"] == 2
+    rows = outbox._conn.execute("SELECT text, status, attempts FROM outbox ORDER BY id").fetchall()
+    assert rows == [("bad", "failed", 1), ("flaky", "failed", 2)]
+
+def test_missing_credentials_fail_without_retrying(tmp_path, monkeypatch):
+    from src.api.whatsapp import send_whatsapp_message
+    monkeypatch.delenv("WHATSAPP_API_TOKEN", raising=False)
+    monkeypatch.delenv("WHATSAPP_PHONE_NUMBER_ID", raising=False)
+    outbox = make_outbox(tmp_path, max_attempts=5)
+    outbox.register_sender("whatsapp", send_whatsapp_message)
+
+    async def scenario():
+        await outbox.put("whatsapp", "erin", "Hola")
+        await drain(outbox)
+
+    asyncio.run(scenario())
+
+    assert (outbox.stats()["retried"], outbox.stats()["failed"]) == (0, 1)
+    rows = outbox._conn.execute("SELECT status, attempts FROM outbox").fetchall()
+    assert rows == [("failed", 1)]
+
+def test_unexpected_errors_give_up_after_max_attempts(tmp_path):
+    outbox = make_outbox(tmp_path, max_attempts=3)
+    sent = []
+
+    async def send(recipient, text):
+        if text == "broken":
+            raise ValueError("unexpected payload")
+        sent.append(text)
+    outbox.register_sender("whatsapp", send)
+
+    async def scenario():
+        for text in ["broken", "next"]:
+            await outbox.put("whatsapp", "dave", text)
+        await drain(outbox)
+
+    asyncio.run(scenario())
+
+    assert sent == ["next"]
+    assert outbox.stats()["failed"] == 1
+    rows = outbox._conn.execute("SELECT text, status, attempts FROM outbox ORDER BY id").fetchall()
+    assert rows == [("broken", "failed", 3)]
+
+def test_pending_messages_survive_a_restart(tmp_path):
+    first = make_outbox(tmp_path)
+    first.enqueue("whatsapp", "dave", "queued before the crash")
+    sent = []
+
+    async def send(recipient, text):
+        sent.append((recipient, text))
+
+    second = make_outbox(tmp_path)
+    second.register_sender("whatsapp", send)
+    asyncio.run(drain(second))
+
+    assert sent == [("dave", "queued before the crash")]
+
+def test_rate_limiter_spaces_out_sends_after_the_burst():
+    now = [0.0]
+    limiter = RateLimiter(rate=2.0, burst=2, clock=lambda: now[0])
+
+    assert [limiter.reserve() for _ in range(4)] == [0.0, 0.0, 0.5, 1.0]
+    now[0] = 10.0
+    assert limiter.reserve() == 0.0
@@ -0,0 +1,42 @@
+import threading
+import pytest
+from src.rag.pipeline import Pipeline
+
+def test_stages_preserve_order_and_flat_map():
+    pipeline = (
+        Pipeline(range(5))
+        .add_stage("double", lambda x: [x, x])
+        .add_stage("square", lambda x: [x * x])
+    )
+
+    assert list(pipeline.run()) == [0, 0, 1, 1, 4, 4, 9, 9, 16, 16]
+
+def test_queues_bound_items_in_flight():
+    produced = []
+    consumed = []
+
+    def source():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    for item in Pipeline(source(), queue_size=2).add_stage("identity", lambda x: [x]).run():
+        consumed.append(item)
+        # source -> queue(2) -> stage (1 in hand) -> queue(2) -> consumer, plus one blocked put
+        assert len(produced) - len(consumed) <= 7
+
+    assert consumed == list(range(100))
+
+def test_stage_error_stops_pipeline_and_reaches_consumer():
+    def fail_on_three(x):
+        if x == 3:
+            raise ValueError("bad chunk")
+        yield x
+
+    seen = []
+    with pytest.raises(ValueError, match="bad chunk"):
+        for item in Pipeline(range(10)).add_stage("check", fail_on_three).run():
+            seen.append(item)
+
+    assert seen == [0, 1, 2]
+    assert not [t for t in threading.enumerate() if t.name.startswith("pipeline-")]
@@ -0,0 +1,125 @@
+import json
+from unittest.mock import patch
+import pytest
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from src import profiling
+from src.metrics import span
+from src.profiling import TraceBuffer, profile_mode, profiled, trace_span
+from src.rag import chatbot
+
+@pytest.fixture
+def buffer(monkeypatch):
+    buffer = TraceBuffer(size=3)
+    monkeypatch.setattr(profiling, "_trace_buffer", buffer)
+    monkeypatch.delenv("PROFILE_REQUESTS", raising=False)
+    monkeypatch.delenv("PROFILE_SAMPLE_RATE", raising=False)
+    monkeypatch.setattr(profiling, "_sample_rate", None)
+    return buffer
+
+def span_names(span):
+    return [span["name"], [span_names(child) for child in span["children"]]]
+
+def test_profile_mode_from_header_env_and_sampling(buffer, monkeypatch):
+    assert profile_mode(None) is None
+    assert profile_mode("1") == "spans"
+    assert profile_mode("cProfile") == "cprofile"
+    monkeypatch.setenv("PROFILE_REQUESTS", "1")
+    assert profile_mode(None) == "spans"
+    monkeypatch.delenv("PROFILE_REQUESTS")
+    monkeypatch.setenv("PROFILE_SAMPLE_RATE", "1.0")
+    monkeypatch.setattr(profiling, "_sample_rate", None)
+    assert profile_mode(None) == "spans"
+
+def test_invalid_sample_rate_turns_sampling_off(buffer, monkeypatch):
+    monkeypatch.setenv("PROFILE_SAMPLE_RATE", "10%")
+    assert profile_mode(None) is None
+    assert profile_mode("1") == "spans"
+
+def test_unprofiled_requests_run_the_function_itself(buffer):
+    def ask(question):
+        with trace_span("ignored"):
+            return question.upper()
+    assert profiled(ask, "chat") is ask
+    assert ask("hola") == "HOLA"
+    assert buffer.list() == []
+
+def test_profiled_call_records_span_tree(buffer):
+    def ask(question):
+        with span("answer", "retrieval"):
+            with trace_span("bm25_search", k=4):
+                pass
+        with span("answer", "llm"):
+            return "Answer"
+
+    ask = profiled(ask, "whatsapp", "1", user_id="34600")
+    assert ask("Hola") == "Answer"
+
+    [summary] = buffer.list()
+    assert summary["name"] == "whatsapp" and summary["attrs"] == {"user_id": "34600"}
+    trace = buffer.get(summary["id"]).to_dict()
+    assert span_names(trace["spans"]) == [
+        "whatsapp", [["queue_wait", []], ["retrieval", [["bm25_search", []]]], ["llm", []]]
+    ]
+    assert trace["spans"]["children"][1]["children"][0]["attrs"] == {"k": 4}
+    assert trace["profile"] is None
+
+def test_cprofile_report_and_ring_buffer(buffer):
+    for i in range(4):
+        profiled(lambda: sum(range(1000)), f"chat-{i}", "cprofile")()
+
+    assert [t["name"] for t in buffer.list()] == ["chat-3", "chat-2", "chat-1"]
+    assert "function calls" in buffer.get(buffer.list()[0]["id"]).profile
+    assert [json.loads(line)["name"] for line in buffer.export().splitlines()] == ["chat-1", "chat-2", "chat-3"]
+
+def test_cprofile_report_covers_spans_run_on_other_threads(buffer):
+    import threading
+    import contextvars
+
+    def build_vocabulary():
+        return sorted(str(i) for i in range(1000))
+
+    def node():
+        with trace_span("llm"):
+            return build_vocabulary()
+
+    def ask():
+        # Like LangGraph running a node on its executor, with the request's context
+        context = contextvars.copy_context()
+        worker = threading.Thread(target=context.run, args=(node,))
+        worker.start()
+        worker.join()
+
+    profiled(ask, "chat", "cprofile")()
+
+    [summary] = buffer.list()
+    assert "build_vocabulary" in buffer.get(summary["id"]).profile
+
+def test_traces_are_appended_to_export_file(tmp_path):
+    buffer = TraceBuffer(export_path=str(tmp_path / "traces.jsonl"))
+    with patch("src.profiling.get_trace_buffer", return_value=buffer):
+        profiled(lambda: None, "chat", "1")()
+    [line] = (tmp_path / "traces.jsonl").read_text().splitlines()
+    assert json.loads(line)["spans"]["name"] == "chat"
+
+@patch("src.rag.chatbot.get_answer_cache")
+@patch("src.rag.chatbot.get_runtime")
+@patch("src.rag.chatbot.ChatOllama")
+def test_ask_question_trace_covers_cache_middleware_retrieval_and_llm(mock_chat_ollama, mock_runtime,
+                                                                    mock_answer_cache, buffer, monkeypatch):
+    monkeypatch.setattr(chatbot, "_agent", None)
+    monkeypatch.setattr(chatbot, "_rag_chain", None)
+    mock_chat_ollama.return_value = GenericFakeChatModel(messages=iter([AIMessage(content="At 16:00.")]))
+    mock_runtime.return_value.hybrid_search.return_value = [Document(page_content="Check-in from 16:00.")]
+    mock_runtime.return_value.embeddings.embed_query.return_value = [0.1, 0.2]
+    mock_answer_cache.return_value.lookup.return_value = None
+
+    assert profiled(chatbot.ask_question, "chat", "1")("Check-in?") == "At 16:00."
+
+    trace = buffer.get(buffer.list()[0]["id"]).to_dict()
+    names = json.dumps(span_names(trace["spans"]))
+    for name in ("queue_wait", "answer_cache", "prompt_with_context", "retrieval", "prompt", "llm"):
+        assert f'"{name}"' in names
+    middleware = next(s for s in trace["spans"]["children"] if s["name"] == "prompt_with_context")
+    assert [child["name"] for child in middleware["children"]] == ["retrieval", "prompt"]
@@ -0,0 +1,136 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+from src.rag.runtime import RetrievalRuntime, bump_generation, read_generation, activate_collection, read_active
+
+@patch("src.rag.runtime.chromadb.PersistentClient")
+@patch("src.rag.runtime.OllamaEmbeddings")
+@patch("src.rag.runtime.Chroma")
+def test_handles_are_built_once_across_threads(mock_chroma, mock_embeddings, mock_client):
+    runtime = RetrievalRuntime()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        stores = list(pool.map(lambda _: runtime.get_vectorstore(), range(32)))
+
+    assert all(store is stores[0] for store in stores)
+    assert mock_chroma.call_count == 1
+    assert mock_embeddings.call_count == 1
+    assert mock_client.call_count == 1
+
+@patch("src.rag.runtime.chromadb.PersistentClient")
+@patch("src.rag.runtime.OllamaEmbeddings")
+@patch("src.rag.runtime.Chroma")
+def test_reload_swaps_vectorstore_and_keeps_clients(mock_chroma, mock_embeddings, mock_client, tmp_path):
+    mock_chroma.side_effect = lambda **kwargs: MagicMock()
+    runtime = RetrievalRuntime(db_path=str(tmp_path))
+
+    old_store = runtime.get_vectorstore()
+    bump_generation(str(tmp_path))
+    runtime.reload()
+    new_store = runtime.get_vectorstore()
+
+    assert new_store is not old_store
+    assert runtime.generation == 1
+    assert mock_embeddings.call_count == 1
+    assert mock_client.call_count == 1
+
+@patch("src.rag.runtime.Chroma")
+def test_reload_before_first_use_stays_lazy(mock_chroma, tmp_path):
+    runtime = RetrievalRuntime(db_path=str(tmp_path))
+    bump_generation(str(tmp_path))
+    runtime.reload()
+
+    assert mock_chroma.call_count == 0
+    assert runtime.generation == 1
+
+@patch("src.rag.runtime.chromadb.PersistentClient")
+@patch("src.rag.runtime.OllamaEmbeddings")
+@patch("src.rag.runtime.Chroma")
+def test_reload_clears_query_embedding_cache(mock_chroma, mock_embeddings, mock_client, tmp_path):
+    runtime = RetrievalRuntime(db_path=str(tmp_path))
+    runtime.get_vectorstore()
+    runtime.embedding_cache.set("wifi", [0.1])
+
+    runtime.reload()
+
+    assert len(runtime.embedding_cache) == 0
+
+def test_generation_is_persisted(tmp_path):
+    assert read_generation(str(tmp_path)) == 0
+    assert bump_generation(str(tmp_path)) == 1
+    assert bump_generation(str(tmp_path)) == 2
+    assert RetrievalRuntime(db_path=str(tmp_path)).generation == 2
+
+def bump_many(db_path, times):
+    for _ in range(times):
+        bump_generation(db_path)
+
+def test_pointer_updates_from_several_processes_are_not_lost(tmp_path):
+    import multiprocessing
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=bump_many, args=(str(tmp_path), 25)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+
+    assert read_generation(str(tmp_path)) == 100
+
+def test_first_switch_retires_the_legacy_collection(tmp_path):
+    activate_collection("recursive", "recursive_espazo_nature_v1", str(tmp_path))
+    activate_collection("md", "md_espazo_nature_v2", str(tmp_path))
+
+    retired = [r["name"] for r in read_active(str(tmp_path))["retired"]]
+    assert retired == ["recursive_espazo_nature", "md_espazo_nature"]
+
+@patch("src.rag.runtime.chromadb.PersistentClient")
+@patch("src.rag.runtime.OllamaEmbeddings")
+@patch("src.rag.runtime.Chroma")
+def test_readers_follow_active_collection_switch(mock_chroma, mock_embeddings, mock_client, tmp_path):
+    mock_chroma.side_effect = lambda **kwargs: MagicMock(name=kwargs["collection_name"])
+    runtime = RetrievalRuntime(db_path=str(tmp_path))
+    runtime.get_vectorstore()
+    assert mock_chroma.call_args.kwargs["collection_name"] == "recursive_espazo_nature"
+
+    # Another process switches the pointer
+    activate_collection("recursive", "recursive_espazo_nature_v7", str(tmp_path))
+    runtime._next_pointer_check = 0.0
+    runtime.get_vectorstore()
+
+    assert mock_chroma.call_args.kwargs["collection_name"] == "recursive_espazo_nature_v7"
+    assert runtime.generation == 1
+
+def runtime_with_bm25(tmp_path, vector_results):
+    from src.tests.test_bm25_unit import build_index
+    runtime = RetrievalRuntime(db_path=str(tmp_path))
+    runtime._bm25 = build_index()
+    runtime.similarity_search = MagicMock(return_value=vector_results)
+    return runtime
+
+def test_hybrid_search_on_a_fresh_runtime_loads_the_saved_index(tmp_path):
+    from src.rag.bm25 import index_path
+    from src.tests.test_bm25_unit import build_index
+    build_index().save(index_path(str(tmp_path), "recursive_espazo_nature"))
+    runtime = RetrievalRuntime(db_path=str(tmp_path))
+
+    docs = runtime.hybrid_search("wifi?", k=1)
+
+    assert [d.id for d in docs] == ["wifi"]
+
+def test_hybrid_search_fuses_lexical_and_vector_ranks(tmp_path):
+    from langchain_core.documents import Document
+    vector_results = [Document(id="prices", page_content="p"), Document(id="spa", page_content="s")]
+    runtime = runtime_with_bm25(tmp_path, vector_results)
+
+    docs = runtime.hybrid_search("night prices in summer", k=2)
+
+    # "prices" is first in both rankings
+    assert [d.id for d in docs] == ["prices", "spa"]
+    runtime.similarity_search.assert_called_once()
+
+def test_hybrid_search_answers_clear_keyword_hits_lexically(tmp_path):
+    runtime = runtime_with_bm25(tmp_path, [])
+
+    docs = runtime.hybrid_search("wifi?", k=1)
+
+    assert [d.id for d in docs] == ["wifi"]
+    runtime.similarity_search.assert_not_called()
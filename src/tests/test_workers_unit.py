@@ -0,0 +1,143 @@
+import threading
+import pytest
+from src.api.workers import AnswerExecutor, QueueFullError, retry_when_full
+
+def blocked_executor(**kwargs):
+    """Executor with a single worker held busy until the returned event is set."""
+    executor = AnswerExecutor(workers=1, **kwargs)
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    executor.submit(block, user_id="blocker")
+    started.wait(5)
+    return executor, release
+
+def test_higher_priority_and_round_robin_across_users():
+    executor, release = blocked_executor(max_queue=10, max_queued_per_user=5)
+    order = []
+    futures = [
+        executor.submit(order.append, "ig-spammer-1", channel="instagram", user_id="spammer"),
+        executor.submit(order.append, "ig-spammer-2", channel="instagram", user_id="spammer"),
+        executor.submit(order.append, "ig-spammer-3", channel="instagram", user_id="spammer"),
+        executor.submit(order.append, "wa-alice", channel="whatsapp", user_id="alice"),
+        executor.submit(order.append, "chat-bob", channel="chat", user_id="bob"),
+    ]
+    release.set()
+    for future in futures:
+        future.result(5)
+    executor.shutdown()
+
+    assert order == ["chat-bob", "ig-spammer-1", "wa-alice", "ig-spammer-2", "ig-spammer-3"]
+
+def test_full_queue_and_user_quota_are_rejected():
+    executor, release = blocked_executor(max_queue=3, max_queued_per_user=2)
+    executor.submit(lambda: None, user_id="alice")
+    executor.submit(lambda: None, user_id="alice")
+
+    with pytest.raises(QueueFullError) as per_user:
+        executor.submit(lambda: None, user_id="alice")
+    assert per_user.value.status_code == 429
+
+    executor.submit(lambda: None, user_id="bob")
+    with pytest.raises(QueueFullError) as full:
+        executor.submit(lambda: None, user_id="carol")
+    assert full.value.status_code == 503
+    assert full.value.retry_after >= 1
+    assert executor.is_full()
+    assert executor.stats()["rejected"] == 2
+
+    release.set()
+    executor.shutdown()
+
+def test_acknowledged_messages_wait_for_capacity_instead_of_failing():
+    import asyncio
+    executor, release = blocked_executor(max_queue=1)
+    executor.submit(lambda: None, user_id="alice")
+    attempts = []
+
+    async def answer():
+        attempts.append(1)
+        return await executor.run(lambda: "answered", channel="whatsapp", user_id="bob")
+
+    async def scenario():
+        with pytest.raises(QueueFullError):
+            await retry_when_full(answer, timeout=0)
+        threading.Timer(0.1, release.set).start()
+        return await retry_when_full(answer, timeout=1.5)
+
+    assert asyncio.run(scenario()) == "answered"
+    assert len(attempts) == 3
+    executor.shutdown()
+
+def test_cancelled_tasks_are_skipped():
+    executor, release = blocked_executor()
+    calls = []
+    future = executor.submit(calls.append, "x")
+    future.cancel()
+    release.set()
+    executor.shutdown()
+
+    assert calls == []
+
+def test_errors_reach_the_caller():
+    executor = AnswerExecutor(workers=1)
+
+    def fail():
+        raise ValueError("model unavailable")
+
+    with pytest.raises(ValueError, match="model unavailable"):
+        executor.submit(fail).result(5)
+    executor.shutdown()
+
+def test_identical_questions_share_one_generation():
+    import asyncio
+    from src.api.workers import answer_key
+    executor, release = blocked_executor(max_queue=10, max_queued_per_user=1)
+    calls = []
+
+    def generate(question):
+        calls.append(question)
+        return f"answer to {question}"
+
+    async def scenario():
+        tasks = [
+            asyncio.create_task(executor.run(generate, question, user_id=f"user-{i}", key=answer_key(question)))
+            for i, question in enumerate(["Precio?", "  precío? ", "PRECIO?", "Wifi?"])
+        ]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*tasks)
+
+    answers = asyncio.run(scenario())
+    executor.shutdown()
+
+    assert answers == ["answer to Precio?"] * 3 + ["answer to Wifi?"]
+    assert calls == ["Precio?", "Wifi?"]
+    assert executor.stats()["coalesced"] == 2
+    # Finished keys are forgotten, so a later question runs again
+    assert executor._shared == {}
+
+def test_shared_generation_is_cancelled_only_when_every_caller_leaves():
+    import asyncio
+    executor, release = blocked_executor()
+    calls = []
+
+    async def scenario():
+        first = asyncio.create_task(executor.run(calls.append, "x", key="same"))
+        second = asyncio.create_task(executor.run(calls.append, "x", key="same"))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        await asyncio.sleep(0.05)
+        assert not executor._shared["same"][0].cancelled()
+        second.cancel()
+        await asyncio.sleep(0.05)
+        release.set()
+
+    asyncio.run(scenario())
+    executor.shutdown()
+
+    assert calls == []
@@ -1,3 +1,4 @@
+import math
 import os
 
 BENCHMARK_DIR = "benchmarks"
@@ -5,4 +6,11 @@ BENCHMARK_DIR = "benchmarks"
 def load_benchmark(benchmark_name: str) -> list[str]:
     benchmark_path = os.path.join(BENCHMARK_DIR, benchmark_name)
     with open(benchmark_path, "r") as f:
-        return [line.strip() for line in f if line.strip()]
\ No newline at end of file
+        return [line.strip() for line in f if line.strip()]
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile (p in 0-100) of `values`, 0.0 when empty."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]